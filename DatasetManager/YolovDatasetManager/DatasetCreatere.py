@@ -6,7 +6,6 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import cv2
 import numpy as np
 import torch
-import torchvision.transforms as T
 from PIL import Image
 from tqdm import tqdm
 
@@ -249,6 +248,9 @@ class YoloProcessor:
                 bright = [0.99, 1.11]
                 contrast = [0.99, 1.11]
 
+            # torchvision is slow to import and only needed for the augmentations
+            import torchvision.transforms as T
+
             augmentations = T.Compose([
                 T.ColorJitter(brightness=(bright[0], bright[1]), contrast=(contrast[0], contrast[1])),
                 T.ToTensor(),
@@ -5,6 +5,7 @@
 # LICENSE file in the root directory of this source tree.
 
 # Adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/automatic_mask_generator.py
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Dict, List, Optional, Tuple
 
 import numpy as np
@@ -14,21 +15,17 @@ from torchvision.ops.boxes import batched_nms, box_area  # type: ignore
 from sam2.modeling.sam2_base import SAM2Base
 from sam2.sam2_image_predictor import SAM2ImagePredictor
 from sam2.utils.amg import (
-    area_from_rle,
     batch_iterator,
     batched_mask_to_box,
+    batched_remove_small_regions,
     box_xyxy_to_xywh,
     build_all_layer_point_grids,
     calculate_stability_score,
-    coco_encode_rle,
+    FlatRLE,
     generate_crop_boxes,
     is_box_near_crop_edge,
-    mask_to_rle_pytorch,
     MaskData,
-    remove_small_regions,
-    rle_to_mask,
     uncrop_boxes_xyxy,
-    uncrop_masks,
     uncrop_points,
 )
 
@@ -53,6 +50,9 @@ class SAM2AutomaticMaskGenerator:
             output_mode: str = "binary_mask",
             use_m2m: bool = False,
             multimask_output: bool = True,
+            crops_per_batch: int = 4,
+            num_rle_workers: int = 2,
+            low_res_stability_margin: Optional[float] = 0.05,
             **kwargs,
     ) -> None:
         """
@@ -96,11 +96,22 @@ class SAM2AutomaticMaskGenerator:
             to remove disconnected regions and holes in masks with area smaller
             than min_mask_region_area. Requires opencv.
           output_mode (str): The form masks are returned in. Can be 'binary_mask',
-            'uncompressed_rle', or 'coco_rle'. 'coco_rle' requires pycocotools.
+            'uncompressed_rle', or 'coco_rle'.
             For large resolutions, 'binary_mask' may consume large amounts of
             memory.
           use_m2m (bool): Whether to add a one step refinement using previous mask predictions.
           multimask_output (bool): Whether to output multimask at each point of the grid.
+          crops_per_batch (int): The number of image crops (over all crop layers) that
+            are embedded together by the image encoder in one batch. Higher numbers may
+            be faster but use more GPU memory.
+          num_rle_workers (int): The number of worker threads that encode the masks of
+            each point batch into RLEs, while the model runs on the next point batch.
+          low_res_stability_margin (float or None): Masks are filtered by predicted IoU
+            and by their stability score on the low resolution mask logits before being
+            upscaled, rejecting those whose low resolution stability score is below
+            stability_score_thresh minus this margin. The surviving masks are then
+            filtered by their stability score at the crop resolution as usual. If None,
+            the stability score is only computed at the crop resolution.
         """
 
         assert (points_per_side is None) != (
@@ -122,13 +133,6 @@ class SAM2AutomaticMaskGenerator:
             "uncompressed_rle",
             "coco_rle",
         ], f"Unknown output_mode {output_mode}."
-        if output_mode == "coco_rle":
-            try:
-                from pycocotools import mask as mask_utils  # type: ignore  # noqa: F401
-            except ImportError as e:
-                print("Please install pycocotools")
-                raise e
-
         self.predictor = SAM2ImagePredictor(
             model,
             max_hole_area=min_mask_region_area,
@@ -148,6 +152,9 @@ class SAM2AutomaticMaskGenerator:
         self.output_mode = output_mode
         self.use_m2m = use_m2m
         self.multimask_output = multimask_output
+        self.crops_per_batch = crops_per_batch
+        self.num_rle_workers = max(num_rle_workers, 1)
+        self.low_res_stability_margin = low_res_stability_margin
 
     @classmethod
     def from_pretrained(cls, model_id: str, **kwargs) -> "SAM2AutomaticMaskGenerator":
@@ -167,12 +174,18 @@ class SAM2AutomaticMaskGenerator:
         return cls(sam_model, **kwargs)
 
     @torch.no_grad()
-    def generate(self, image: np.ndarray) -> List[Dict[str, Any]]:
+    def generate(
+            self, image: np.ndarray, ignore_mask: Optional[np.ndarray] = None
+    ) -> List[Dict[str, Any]]:
         """
         Generates masks for the given image.
 
         Arguments:
           image (np.ndarray): The image to generate masks for, in HWC uint8 format.
+          ignore_mask (np.ndarray or None): An HW boolean mask of the image regions
+            that are already segmented (e.g. by tracked objects). The point prompts
+            falling on these regions are skipped, so that only the rest of the image
+            is searched for masks.
 
         Returns:
            list(dict(str, any)): A list over records for masks. Each record is
@@ -193,24 +206,34 @@ class SAM2AutomaticMaskGenerator:
         """
 
         # Generate masks
-        mask_data = self._generate_masks(image)
+        mask_data = self._generate_masks(image, ignore_mask)
+        if len(mask_data.items()) == 0:
+            return []  # all the point prompts were skipped
+
+        # Filter small disconnected regions and holes in masks
+        if self.min_mask_region_area > 0:
+            mask_data = self.postprocess_small_regions(
+                mask_data,
+                self.min_mask_region_area,
+                max(self.box_nms_thresh, self.crop_nms_thresh),
+            )
 
-        # Encode masks
+        # Encode masks (all at once from the flat RLE counts)
+        rles = FlatRLE.from_rles(mask_data["rles"])
         if self.output_mode == "coco_rle":
-            mask_data["segmentations"] = [
-                coco_encode_rle(rle) for rle in mask_data["rles"]
-            ]
+            mask_data["segmentations"] = rles.to_coco()
         elif self.output_mode == "binary_mask":
-            mask_data["segmentations"] = [rle_to_mask(rle) for rle in mask_data["rles"]]
+            mask_data["segmentations"] = list(rles.decode())
         else:
-            mask_data["segmentations"] = mask_data["rles"]
+            mask_data["segmentations"] = rles.to_rles()
+        areas = rles.areas()
 
         # Write mask records
         curr_anns = []
         for idx in range(len(mask_data["segmentations"])):
             ann = {
                 "segmentation": mask_data["segmentations"][idx],
-                "area": area_from_rle(mask_data["rles"][idx]),
+                "area": int(areas[idx]),
                 "bbox": box_xyxy_to_xywh(mask_data["boxes"][idx]).tolist(),
                 "predicted_iou": mask_data["iou_preds"][idx].item(),
                 "point_coords": [mask_data["points"][idx].tolist()],
@@ -221,20 +244,39 @@ class SAM2AutomaticMaskGenerator:
 
         return curr_anns
 
-    def _generate_masks(self, image: np.ndarray) -> MaskData:
+    def _generate_masks(
+            self, image: np.ndarray, ignore_mask: Optional[np.ndarray] = None
+    ) -> MaskData:
         orig_size = image.shape[:2]
         crop_boxes, layer_idxs = generate_crop_boxes(
             orig_size, self.crop_n_layers, self.crop_overlap_ratio
         )
 
-        # Iterate over image crops
+        # Iterate over image crops, embedding up to `crops_per_batch` crops (of any crop
+        # layer and size) together in one batch of the image encoder
         data = MaskData()
-        for crop_box, layer_idx in zip(crop_boxes, layer_idxs):
-            crop_data = self._process_crop(image, crop_box, layer_idx, orig_size)
-            data.cat(crop_data)
+        for (crop_inds,) in batch_iterator(
+            self.crops_per_batch, list(range(len(crop_boxes)))
+        ):
+            cropped_ims = [
+                image[y0:y1, x0:x1, :]
+                for x0, y0, x1, y1 in (crop_boxes[i] for i in crop_inds)
+            ]
+            self.predictor.set_image_batch(cropped_ims)
+            for img_idx, crop_idx in enumerate(crop_inds):
+                crop_data = self._process_crop(
+                    image,
+                    crop_boxes[crop_idx],
+                    layer_idxs[crop_idx],
+                    orig_size,
+                    img_idx=img_idx,
+                    ignore_mask=ignore_mask,
+                )
+                data.cat(crop_data)
+            self.predictor.reset_predictor()
 
         # Remove duplicate masks between crops
-        if len(crop_boxes) > 1:
+        if len(crop_boxes) > 1 and len(data.items()) > 0:
             # Prefer masks from smaller crops
             scores = 1 / box_area(data["crop_boxes"])
             scores = scores.to(data["boxes"].device)
@@ -254,26 +296,64 @@ class SAM2AutomaticMaskGenerator:
             crop_box: List[int],
             crop_layer_idx: int,
             orig_size: Tuple[int, ...],
+            img_idx: Optional[int] = None,
+            ignore_mask: Optional[np.ndarray] = None,
     ) -> MaskData:
+        """
+        Generate the masks on a crop of the image. If `img_idx` is given, the crop is
+        the `img_idx`-th image already embedded by `predictor.set_image_batch`;
+        otherwise, the crop is embedded here with `predictor.set_image`. The points
+        falling on `ignore_mask` (in the original image frame) are skipped.
+        """
         # Crop the image and calculate embeddings
         x0, y0, x1, y1 = crop_box
         cropped_im = image[y0:y1, x0:x1, :]
         cropped_im_size = cropped_im.shape[:2]
-        self.predictor.set_image(cropped_im)
+        if img_idx is None:
+            self.predictor.set_image(cropped_im)
 
         # Get points for this crop
         points_scale = np.array(cropped_im_size)[None, ::-1]
         points_for_image = self.point_grids[crop_layer_idx] * points_scale
-
-        # Generate masks for this crop in batches
+        if ignore_mask is not None:
+            xs = np.minimum(points_for_image[:, 0].astype(np.int64) + x0, x1 - 1)
+            ys = np.minimum(points_for_image[:, 1].astype(np.int64) + y0, y1 - 1)
+            points_for_image = points_for_image[~ignore_mask[ys, xs]]
+            if len(points_for_image) == 0:
+                if img_idx is None:
+                    self.predictor.reset_predictor()
+                return MaskData()
+
+        # Generate masks for this crop in batches, encoding the masks of each batch to
+        # RLEs in the worker threads while the model runs on the next batch (the
+        # workers are shut down with the pool once the crop is done)
         data = MaskData()
-        for (points,) in batch_iterator(self.points_per_batch, points_for_image):
-            batch_data = self._process_batch(
-                points, cropped_im_size, crop_box, orig_size, normalize=True
-            )
-            data.cat(batch_data)
-            del batch_data
-        self.predictor.reset_predictor()
+        rle_futures = []
+        with ThreadPoolExecutor(max_workers=self.num_rle_workers) as rle_executor:
+            for (points,) in batch_iterator(self.points_per_batch, points_for_image):
+                batch_data = self._process_batch(
+                    points,
+                    cropped_im_size,
+                    crop_box,
+                    orig_size,
+                    normalize=True,
+                    img_idx=-1 if img_idx is None else img_idx,
+                    encode_rles=False,
+                )
+                rle_futures.append(
+                    rle_executor.submit(
+                        self._encode_rles, batch_data["masks"], crop_box, orig_size
+                    )
+                )
+                del batch_data["masks"]
+                data.cat(batch_data)
+                del batch_data
+                # bound the number of batches whose masks are still held for encoding
+                if len(rle_futures) > self.num_rle_workers:
+                    rle_futures[-self.num_rle_workers - 1].result()
+            data["rles"] = FlatRLE.cat([future.result() for future in rle_futures])
+        if img_idx is None:
+            self.predictor.reset_predictor()
 
         # Remove duplicates within this crop.
         keep_by_nms = batched_nms(
@@ -287,7 +367,7 @@ class SAM2AutomaticMaskGenerator:
         # Return to the original image frame
         data["boxes"] = uncrop_boxes_xyxy(data["boxes"], crop_box)
         data["points"] = uncrop_points(data["points"], crop_box)
-        data["crop_boxes"] = torch.tensor([crop_box for _ in range(len(data["rles"]))])
+        data["crop_boxes"] = torch.tensor([crop_box]).repeat(len(data["rles"]), 1)
 
         return data
 
@@ -298,7 +378,14 @@ class SAM2AutomaticMaskGenerator:
             crop_box: List[int],
             orig_size: Tuple[int, ...],
             normalize=False,
+            img_idx: int = -1,
+            encode_rles: bool = True,
     ) -> MaskData:
+        """
+        Generate and filter the masks of a batch of point prompts on the `img_idx`-th
+        image set in the predictor. If `encode_rles=False`, the binary masks are
+        returned under "masks" (in the crop frame) instead of their RLEs under "rles".
+        """
         orig_h, orig_w = orig_size
 
         # Run model on this batch
@@ -311,21 +398,25 @@ class SAM2AutomaticMaskGenerator:
         in_labels = torch.ones(
             in_points.shape[0], dtype=torch.int, device=in_points.device
         )
-        masks, iou_preds, low_res_masks = self.predictor._predict(
+        # Keep the low resolution logits, so that only the masks surviving the
+        # filters below are upscaled to the crop size
+        low_res_logits, iou_preds, low_res_masks = self.predictor._predict(
             in_points[:, None, :],
             in_labels[:, None],
             multimask_output=self.multimask_output,
             return_logits=True,
+            img_idx=img_idx,
+            upscale_masks=False,
         )
 
         # Serialize predictions and store in MaskData
         data = MaskData(
-            masks=masks.flatten(0, 1),
+            low_res_logits=low_res_logits.flatten(0, 1),
             iou_preds=iou_preds.flatten(0, 1),
-            points=points.repeat_interleave(masks.shape[1], dim=0),
+            points=points.repeat_interleave(low_res_logits.shape[1], dim=0),
             low_res_masks=low_res_masks.flatten(0, 1),
         )
-        del masks
+        del low_res_logits
 
         if not self.use_m2m:
             # Filter by predicted IoU
@@ -333,6 +424,27 @@ class SAM2AutomaticMaskGenerator:
                 keep_mask = data["iou_preds"] > self.pred_iou_thresh
                 data.filter(keep_mask)
 
+            # Reject clearly unstable masks on the low resolution logits
+            if (
+                self.stability_score_thresh > 0.0
+                and self.low_res_stability_margin is not None
+            ):
+                low_res_stability = calculate_stability_score(
+                    data["low_res_logits"],
+                    self.mask_threshold,
+                    self.stability_score_offset,
+                )
+                keep_mask = low_res_stability >= (
+                    self.stability_score_thresh - self.low_res_stability_margin
+                )
+                data.filter(keep_mask)
+
+            # Upscale the surviving masks to the crop size
+            data["masks"] = self.predictor._transforms.postprocess_masks(
+                data["low_res_logits"][:, None], im_size
+            )[:, 0]
+            del data["low_res_logits"]
+
             # Calculate and filter by stability score
             data["stability_score"] = calculate_stability_score(
                 data["masks"], self.mask_threshold, self.stability_score_offset
@@ -349,8 +461,13 @@ class SAM2AutomaticMaskGenerator:
                 in_points.shape[0], dtype=torch.int, device=in_points.device
             )
             masks, ious = self.refine_with_m2m(
-                in_points, labels, data["low_res_masks"], self.points_per_batch
+                in_points,
+                labels,
+                data["low_res_masks"],
+                self.points_per_batch,
+                img_idx=img_idx,
             )
+            del data["low_res_logits"]
             data["masks"] = masks.squeeze(1)
             data["iou_preds"] = ious.squeeze(1)
 
@@ -377,64 +494,91 @@ class SAM2AutomaticMaskGenerator:
             data.filter(keep_mask)
 
         # Compress to RLE
-        data["masks"] = uncrop_masks(data["masks"], crop_box, orig_h, orig_w)
-        data["rles"] = mask_to_rle_pytorch(data["masks"])
-        del data["masks"]
+        if encode_rles:
+            data["rles"] = self._encode_rles(data["masks"], crop_box, orig_size)
+            del data["masks"]
 
         return data
 
+    @staticmethod
+    def _encode_rles(
+            masks: torch.Tensor, crop_box: List[int], orig_size: Tuple[int, ...]
+    ) -> FlatRLE:
+        """Encode binary masks in a crop frame to RLEs in the original image frame."""
+        return FlatRLE.from_masks(masks, crop_box, orig_size)
+
     @staticmethod
     def postprocess_small_regions(
-            mask_data: MaskData, min_area: int, nms_thresh: float
+            mask_data: MaskData, min_area: int, nms_thresh: float, chunk_size: int = 64
     ) -> MaskData:
         """
         Removes small disconnected regions and holes in masks, then reruns
-        box NMS to remove any new duplicates.
+        box NMS to remove any new duplicates. The masks are decoded from their
+        RLEs `chunk_size` at a time and processed in a thread pool.
 
         Edits mask_data in place.
 
         Requires open-cv as a dependency.
         """
-        if len(mask_data["rles"]) == 0:
+        rles = FlatRLE.from_rles(mask_data["rles"])
+        if len(rles) == 0:
             return mask_data
 
-        # Filter small disconnected regions and holes
-        new_masks = []
-        scores = []
-        for rle in mask_data["rles"]:
-            mask = rle_to_mask(rle)
-
-            mask, changed = remove_small_regions(mask, min_area, mode="holes")
-            unchanged = not changed
-            mask, changed = remove_small_regions(mask, min_area, mode="islands")
-            unchanged = unchanged and not changed
-
-            new_masks.append(torch.as_tensor(mask).unsqueeze(0))
-            # Give score=0 to changed masks and score=1 to unchanged masks
-            # so NMS will prefer ones that didn't need postprocessing
-            scores.append(float(unchanged))
-
-        # Recalculate boxes and remove any new duplicates
-        masks = torch.cat(new_masks, dim=0)
-        boxes = batched_mask_to_box(masks)
+        # Filter small disconnected regions and holes, decoding a chunk of masks at
+        # a time to bound the memory of the full-image masks
+        boxes, changed, new_rles = [], [], []
+        for start in range(0, len(rles), chunk_size):
+            inds = np.arange(start, min(start + chunk_size, len(rles)))
+            masks, chunk_changed = batched_remove_small_regions(
+                rles.index(inds).decode(), min_area
+            )
+            masks = torch.from_numpy(masks)
+            boxes.append(batched_mask_to_box(masks))
+            changed.append(chunk_changed)
+            # Only recalculate RLEs for masks that have changed
+            if chunk_changed.any():
+                new_rles.append(FlatRLE.from_masks(masks[chunk_changed]))
+        boxes = torch.cat(boxes, dim=0)
+        changed = np.concatenate(changed)
+
+        # Recalculate boxes and remove any new duplicates. Give score=0 to changed
+        # masks and score=1 to unchanged masks so NMS will prefer ones that didn't
+        # need postprocessing
+        scores = torch.from_numpy(~changed).float()
         keep_by_nms = batched_nms(
             boxes.float(),
-            torch.as_tensor(scores),
+            scores,
             torch.zeros_like(boxes[:, 0]),  # categories
             iou_threshold=nms_thresh,
         )
 
-        # Only recalculate RLEs for masks that have changed
-        for i_mask in keep_by_nms:
-            if scores[i_mask] == 0.0:
-                mask_torch = masks[i_mask].unsqueeze(0)
-                mask_data["rles"][i_mask] = mask_to_rle_pytorch(mask_torch)[0]
-                mask_data["boxes"][i_mask] = boxes[i_mask]  # update res directly
+        if changed.any():
+            # Put the new RLEs of the changed masks in place of the old ones
+            order = np.concatenate([np.flatnonzero(~changed), np.flatnonzero(changed)])
+            inv_order = np.empty_like(order)
+            inv_order[order] = np.arange(len(order))
+            mask_data["rles"] = FlatRLE.cat([rles.index(~changed)] + new_rles).index(
+                inv_order
+            )
+            # the boxes are a numpy array when called from `generate` (after
+            # `to_numpy`), but may also be a tensor when called directly
+            old_boxes = mask_data["boxes"]
+            if isinstance(old_boxes, np.ndarray):
+                new_boxes = old_boxes.copy()
+                new_boxes[changed] = boxes[changed].numpy().astype(old_boxes.dtype)
+            else:
+                changed_t = torch.from_numpy(changed).to(old_boxes.device)
+                new_boxes = torch.where(
+                    changed_t[:, None], boxes.to(old_boxes), old_boxes
+                )
+            mask_data["boxes"] = new_boxes
         mask_data.filter(keep_by_nms)
 
         return mask_data
 
-    def refine_with_m2m(self, points, point_labels, low_res_masks, points_per_batch):
+    def refine_with_m2m(
+            self, points, point_labels, low_res_masks, points_per_batch, img_idx=-1
+    ):
         new_masks = []
         new_iou_preds = []
 
@@ -447,6 +591,7 @@ class SAM2AutomaticMaskGenerator:
                 mask_input=low_res_mask[:, None, :],
                 multimask_output=False,
                 return_logits=True,
+                img_idx=img_idx,
             )
             new_masks.append(best_masks)
             new_iou_preds.append(best_iou_preds)
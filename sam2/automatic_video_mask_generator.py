@@ -0,0 +1,172 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import torch
+from PIL import Image
+
+from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+from sam2.sam2_video_predictor import SAM2VideoPredictor
+
+
+class SAM2AutomaticVideoMaskGenerator:
+    def __init__(
+            self,
+            predictor: SAM2VideoPredictor,
+            keyframe_interval: int = 30,
+            min_new_mask_area: int = 100,
+            max_covered_ratio: float = 0.5,
+            max_num_objects: Optional[int] = None,
+            **kwargs,
+    ) -> None:
+        """
+        Using a SAM 2 video predictor, generates masks for all the objects in a video
+        without any prompts. Automatic mask generation is only run on keyframes: the
+        masks found on the first keyframe are added as objects with `add_new_mask`
+        and tracked through the video, and the following keyframes are only searched
+        (skipping the point prompts on tracked objects) for objects that appeared in
+        the meantime. When new objects are found on a keyframe, the tracking restarts
+        from there, with the tracked objects re-added from their masks on that frame.
+
+        Arguments:
+          predictor (SAM2VideoPredictor): The video predictor used for tracking. Its
+            model is also used for the automatic mask generation.
+          keyframe_interval (int): The number of frames between two keyframes.
+          min_new_mask_area (int): The minimum area (in pixels at the video
+            resolution) of a mask to be added as a new object.
+          max_covered_ratio (float): The maximum fraction of a mask's area that may be
+            covered by tracked (or other new) objects to be added as a new object.
+          max_num_objects (int or None): The maximum number of objects to add over the
+            whole video. If None, there is no limit.
+          **kwargs: Additional arguments to pass to `SAM2AutomaticMaskGenerator`,
+            e.g. `points_per_side` or `pred_iou_thresh`.
+        """
+        assert keyframe_interval >= 1, "keyframe_interval must be at least 1."
+        self.predictor = predictor
+        self.mask_generator = SAM2AutomaticMaskGenerator(
+            predictor, output_mode="binary_mask", **kwargs
+        )
+        self.keyframe_interval = keyframe_interval
+        self.min_new_mask_area = min_new_mask_area
+        self.max_covered_ratio = max_covered_ratio
+        self.max_num_objects = max_num_objects
+
+    @torch.inference_mode()
+    def generate(self, inference_state) -> Dict[int, Dict[int, np.ndarray]]:
+        """
+        Generates masks for all the objects in a video.
+
+        Arguments:
+          inference_state (dict): The inference state of the video, from
+            `predictor.init_state`. Any inputs and tracking results in it are reset.
+
+        Returns:
+          dict(int, dict(int, np.ndarray)): The binary masks (of shape HW, at the
+            video resolution) of each object id on each frame.
+        """
+        num_frames = inference_state["num_frames"]
+        video_segments = {}
+        next_obj_id = 0
+        # the objects (and their masks) to add on `start_frame_idx`
+        seeds = {}
+        start_frame_idx = 0
+        new_masks = self._find_new_masks(inference_state, start_frame_idx, None)
+        while True:
+            for mask in new_masks:
+                if not self._can_add_object(next_obj_id):
+                    break
+                seeds[next_obj_id] = mask
+                next_obj_id += 1
+
+            if len(seeds) == 0:
+                # nothing to track yet, so search the next keyframe
+                end_frame_idx = start_frame_idx + self.keyframe_interval
+                end_frame_idx = min(end_frame_idx, num_frames)
+                for frame_idx in range(start_frame_idx, end_frame_idx):
+                    video_segments[frame_idx] = {}
+                start_frame_idx = end_frame_idx
+                if start_frame_idx >= num_frames:
+                    break
+                new_masks = self._find_new_masks(
+                    inference_state, start_frame_idx, None
+                )
+                continue
+
+            self.predictor.reset_state(inference_state)
+            for obj_id, mask in seeds.items():
+                self.predictor.add_new_mask(
+                    inference_state, frame_idx=start_frame_idx, obj_id=obj_id, mask=mask
+                )
+            new_masks = []
+            tracking = self.predictor.propagate_in_video(
+                inference_state, start_frame_idx=start_frame_idx
+            )
+            for frame_idx, obj_ids, video_res_masks in tracking:
+                masks = (video_res_masks[:, 0] > 0.0).cpu().numpy()
+                video_segments[frame_idx] = dict(zip(obj_ids, masks))
+                if (
+                    frame_idx == start_frame_idx
+                    or frame_idx % self.keyframe_interval != 0
+                    or not self._can_add_object(next_obj_id)
+                ):
+                    continue
+                new_masks = self._find_new_masks(
+                    inference_state, frame_idx, masks.any(axis=0)
+                )
+                if len(new_masks) > 0:
+                    # restart the tracking from this keyframe (new objects can't be
+                    # added to a session once tracking has started), with the objects
+                    # that are still visible re-added from their tracked masks
+                    seeds = {
+                        obj_id: mask
+                        for obj_id, mask in zip(obj_ids, masks)
+                        if mask.any()
+                    }
+                    start_frame_idx = frame_idx
+                    break
+            if len(new_masks) == 0:
+                break
+
+        return video_segments
+
+    def _can_add_object(self, next_obj_id: int) -> bool:
+        return self.max_num_objects is None or next_obj_id < self.max_num_objects
+
+    def _find_new_masks(
+            self, inference_state, frame_idx: int, covered: Optional[np.ndarray]
+    ) -> List[np.ndarray]:
+        """
+        Run automatic mask generation on a frame, skipping the regions `covered` by
+        tracked objects, and return the masks of the new objects on it.
+        """
+        image = self._get_frame_image(inference_state, frame_idx)
+        records = self.mask_generator.generate(image, ignore_mask=covered)
+
+        if covered is None:
+            taken = np.zeros(image.shape[:2], dtype=bool)
+        else:
+            taken = covered.copy()
+        new_masks = []
+        # prefer the masks with the highest predicted quality among overlapping ones
+        for record in sorted(records, key=lambda r: r["predicted_iou"], reverse=True):
+            mask, area = record["segmentation"], record["area"]
+            if area < self.min_new_mask_area:
+                continue
+            if np.count_nonzero(mask & taken) > self.max_covered_ratio * area:
+                continue
+            new_masks.append(mask)
+            taken |= mask
+        return new_masks
+
+    def _get_frame_image(self, inference_state, frame_idx: int) -> np.ndarray:
+        """
+        Get a video frame as an HWC uint8 image at the original video resolution, read
+        from its file (rather than from the resized and normalized model input).
+        """
+        img_pil = Image.open(inference_state["img_paths"][frame_idx])
+        return np.array(img_pil.convert("RGB"))
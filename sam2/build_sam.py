@@ -4,14 +4,36 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import contextlib
 import logging
+import os
 
 import torch
+import torch.nn as nn
 from hydra import compose
 from hydra.utils import instantiate
 from omegaconf import OmegaConf
 
 
+# process-wide cache of the models built with `use_cache=True`, keyed by their build
+# arguments (see `_build_model`)
+_MODEL_CACHE = {}
+
+# the `torch.nn.init` functions disabled by `_skip_weight_init`
+_INIT_FNS = (
+    "uniform_",
+    "normal_",
+    "trunc_normal_",
+    "constant_",
+    "ones_",
+    "zeros_",
+    "xavier_uniform_",
+    "xavier_normal_",
+    "kaiming_uniform_",
+    "kaiming_normal_",
+)
+
+
 def build_sam2(
         config_file,
         ckpt_path=None,
@@ -19,6 +41,14 @@ def build_sam2(
         mode="eval",
         hydra_overrides_extra=[],
         apply_postprocessing=True,
+        cpu_int8=False,
+        quantized_ckpt_path=None,
+        # whether to skip the random weight init and memory-map the checkpoint tensors
+        # into the model instead of copying them (only applies with a checkpoint)
+        fast_load=True,
+        # whether to reuse a model built earlier in this process with the same config,
+        # checkpoint and device (the returned model is then shared by all the callers)
+        use_cache=False,
         **kwargs,
 ):
     if apply_postprocessing:
@@ -29,15 +59,17 @@ def build_sam2(
             "++model.sam_mask_decoder_extra_args.dynamic_multimask_stability_delta=0.05",
             "++model.sam_mask_decoder_extra_args.dynamic_multimask_stability_thresh=0.98",
         ]
-    # Read config and init model
-    cfg = compose(config_name=config_file, overrides=hydra_overrides_extra)
-    OmegaConf.resolve(cfg)
-    model = instantiate(cfg.model, _recursive_=True)
-    _load_checkpoint(model, ckpt_path)
-    model = model.to(device)
-    if mode == "eval":
-        model.eval()
-    return model
+    return _build_model(
+        config_file,
+        hydra_overrides_extra,
+        ckpt_path,
+        device,
+        mode,
+        cpu_int8,
+        quantized_ckpt_path,
+        fast_load,
+        use_cache,
+    )
 
 
 def build_sam2_video_predictor(
@@ -47,6 +79,14 @@ def build_sam2_video_predictor(
         mode="eval",
         hydra_overrides_extra=[],
         apply_postprocessing=True,
+        cpu_int8=False,
+        quantized_ckpt_path=None,
+        # whether to skip the random weight init and memory-map the checkpoint tensors
+        # into the model instead of copying them (only applies with a checkpoint)
+        fast_load=True,
+        # whether to reuse a model built earlier in this process with the same config,
+        # checkpoint and device (the returned model is then shared by all the callers)
+        use_cache=False,
         **kwargs,
 ):
     hydra_overrides = [
@@ -66,15 +106,17 @@ def build_sam2_video_predictor(
         ]
     hydra_overrides.extend(hydra_overrides_extra)
 
-    # Read config and init model
-    cfg = compose(config_name=config_file, overrides=hydra_overrides)
-    OmegaConf.resolve(cfg)
-    model = instantiate(cfg.model, _recursive_=True)
-    _load_checkpoint(model, ckpt_path)
-    model = model.to(device)
-    if mode == "eval":
-        model.eval()
-    return model
+    return _build_model(
+        config_file,
+        hydra_overrides,
+        ckpt_path,
+        device,
+        mode,
+        cpu_int8,
+        quantized_ckpt_path,
+        fast_load,
+        use_cache,
+    )
 
 
 def build_sam2_hf(model_id, **kwargs):
@@ -113,10 +155,135 @@ def build_sam2_video_predictor_hf(model_id, **kwargs):
     )
 
 
-def _load_checkpoint(model, ckpt_path):
+def clear_model_cache():
+    """Release the models cached by the builders with `use_cache=True`."""
+    _MODEL_CACHE.clear()
+
+
+def _build_model(
+        config_file,
+        hydra_overrides,
+        ckpt_path,
+        device,
+        mode,
+        cpu_int8,
+        quantized_ckpt_path,
+        fast_load,
+        use_cache,
+):
+    cache_key = None
+    if use_cache:
+        cache_key = (
+            config_file,
+            tuple(hydra_overrides),
+            None if ckpt_path is None else os.path.abspath(ckpt_path),
+            str(torch.device(device)),
+            mode,
+            cpu_int8,
+            quantized_ckpt_path,
+        )
+        model = _MODEL_CACHE.get(cache_key)
+        if model is not None:
+            logging.info("Reusing the cached model")
+            return model
+
+    # Read config and init model
+    cfg = compose(config_name=config_file, overrides=hydra_overrides)
+    OmegaConf.resolve(cfg)
+    # all the weights are overwritten by the checkpoint, so skip their random init
+    with _skip_weight_init(enabled=fast_load and ckpt_path is not None):
+        model = instantiate(cfg.model, _recursive_=True)
+    if cpu_int8:
+        _load_cpu_int8_model(model, ckpt_path, device, quantized_ckpt_path, fast_load)
+    else:
+        _load_checkpoint(model, ckpt_path, mmap=fast_load)
+    model = model.to(device)
+    if mode == "eval":
+        model.eval()
+
+    if cache_key is not None:
+        _MODEL_CACHE[cache_key] = model
+    return model
+
+
+@contextlib.contextmanager
+def _skip_weight_init(enabled=True):
+    """
+    Turn the `torch.nn.init` functions into no-ops, so that the modules created in this
+    context allocate their parameters without initializing them. The parameters must
+    then all be loaded (e.g. from a strict checkpoint load). Note that this patches the
+    functions globally, i.e. for all threads.
+    """
+    if not enabled:
+        yield
+        return
+    init_fns = {name: getattr(nn.init, name) for name in _INIT_FNS}
+    try:
+        for name in init_fns:
+            setattr(nn.init, name, lambda tensor, *args, **kwargs: tensor)
+        yield
+    finally:
+        for name, fn in init_fns.items():
+            setattr(nn.init, name, fn)
+
+
+def quantize_for_cpu(model):
+    """
+    Apply dynamic int8 quantization (int8 weights, with the activations quantized on
+    the fly) in place to the linear layers of the Hiera blocks (attention projections
+    and MLPs) and of the memory attention, which dominate the CPU inference time.
+    """
+    module_names = set()
+    for name, module in model.named_modules():
+        if not isinstance(module, nn.Linear):
+            continue
+        if not name.startswith(("image_encoder.trunk.blocks.", "memory_attention.")):
+            continue
+        # the memory keys are cached as separate projections of the memory features
+        # and of their positional encoding (see `MemoryKVCache`), which relies on the
+        # linearity of the float key projection
+        if name.endswith("cross_attn_image.k_proj"):
+            continue
+        module_names.add(name)
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig for name in module_names
+    }
+    torch.ao.quantization.quantize_dynamic(
+        model, qconfig_spec, dtype=torch.qint8, inplace=True
+    )
+    return model
+
+
+def _load_cpu_int8_model(model, ckpt_path, device, quantized_ckpt_path, mmap=False):
+    """
+    Load the weights of the CPU int8 inference profile. The model is quantized from the
+    float checkpoint `ckpt_path`, unless the quantized weights were already saved to
+    `quantized_ckpt_path`, in which case they are loaded from there (otherwise they are
+    saved there after the quantization).
+    """
+    if torch.device(device).type != "cpu":
+        raise ValueError(f"cpu_int8 only supports CPU inference (got device={device})")
+    if quantized_ckpt_path is not None and os.path.isfile(quantized_ckpt_path):
+        # only set up the quantized modules; their weights come from the checkpoint
+        quantize_for_cpu(model)
+        _load_checkpoint(model, quantized_ckpt_path)
+        return
+    _load_checkpoint(model, ckpt_path, mmap=mmap)
+    quantize_for_cpu(model)
+    if quantized_ckpt_path is not None:
+        torch.save({"model": model.state_dict()}, quantized_ckpt_path)
+        logging.info(f"Saved the int8 quantized model to {quantized_ckpt_path}")
+
+
+def _load_checkpoint(model, ckpt_path, mmap=False):
+    """
+    Load the checkpoint weights into the model. With `mmap=True`, the checkpoint is
+    memory-mapped (so its tensors are only read when used) and its tensors are assigned
+    to the model instead of being copied into the existing parameters.
+    """
     if ckpt_path is not None:
-        sd = torch.load(ckpt_path, map_location="cpu")["model"]
-        missing_keys, unexpected_keys = model.load_state_dict(sd)
+        sd = torch.load(ckpt_path, map_location="cpu", mmap=mmap)["model"]
+        missing_keys, unexpected_keys = model.load_state_dict(sd, assign=mmap)
         if missing_keys:
             logging.error(missing_keys)
             raise RuntimeError()
@@ -10,24 +10,47 @@ from typing import List, Tuple, Union
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.nn.modules.utils import _pair
 
 from sam2.modeling.backbones.utils import (
     PatchEmbed,
     window_partition,
+    window_partition_strided,
     window_unpartition,
+    window_unpartition_strided,
 )
 
 from sam2.modeling.sam2_utils import DropPath, MLP
 
 
+def _is_tiling_max_pool(pool: nn.Module, H: int, W: int) -> bool:
+    """Whether `pool` takes the max over non-overlapping windows that tile HxW."""
+    if not isinstance(pool, nn.MaxPool2d):
+        return False
+    kernel_size, stride = _pair(pool.kernel_size), _pair(pool.stride)
+    return (
+        kernel_size == stride
+        and _pair(pool.padding) == (0, 0)
+        and _pair(pool.dilation) == (1, 1)
+        and H % stride[0] == 0
+        and W % stride[1] == 0
+    )
+
+
 def do_pool(x: torch.Tensor, pool: nn.Module, norm: nn.Module = None) -> torch.Tensor:
     if pool is None:
         return x
-    # (B, H, W, C) -> (B, C, H, W)
-    x = x.permute(0, 3, 1, 2)
-    x = pool(x)
-    # (B, C, H', W') -> (B, H', W', C)
-    x = x.permute(0, 2, 3, 1)
+    B, H, W, C = x.shape
+    if _is_tiling_max_pool(pool, H, W):
+        # max over the windows directly in (B, H, W, C), without permuting to BCHW
+        sh, sw = _pair(pool.stride)
+        x = x.reshape(B, H // sh, sh, W // sw, sw, C).amax(dim=(2, 4))
+    else:
+        # (B, H, W, C) -> (B, C, H, W)
+        x = x.permute(0, 3, 1, 2)
+        x = pool(x)
+        # (B, C, H', W') -> (B, H', W', C)
+        x = x.permute(0, 2, 3, 1)
     if norm:
         x = norm(x)
 
@@ -78,6 +101,38 @@ class MultiScaleAttention(nn.Module):
 
         return x
 
+    def forward_windowed(self, x: torch.Tensor, window_size: int) -> torch.Tensor:
+        """
+        Attention within the non-overlapping windows of x (B, H, W, C), without Q
+        pooling. Same as `forward` on `window_partition(x, window_size)` followed by
+        `window_unpartition`, but the qkv projection runs on the unpadded tokens (the
+        padding tokens take the projection of a zero token, i.e. the qkv bias) and the
+        tokens are copied once into and out of the windows.
+        """
+        assert self.q_pool is None
+        B, H, W, C = x.shape
+        qkv = self.qkv(x)
+        # computed rather than read from `self.qkv.bias`, so that it also works when
+        # `self.qkv` is replaced by e.g. a dynamically quantized linear layer
+        pad_value = None
+        if H % window_size != 0 or W % window_size != 0:
+            pad_value = self.qkv(x.new_zeros(1, C))[0]
+        qkv, _ = window_partition_strided(qkv, window_size, pad_value)
+        N = qkv.shape[0]
+        # qkv with shape (B * nWindows, window_size**2, 3, nHead, C)
+        qkv = qkv.view(N, window_size * window_size, 3, self.num_heads, -1)
+        q, k, v = torch.unbind(qkv, 2)
+
+        x = F.scaled_dot_product_attention(
+            q.transpose(1, 2),
+            k.transpose(1, 2),
+            v.transpose(1, 2),
+        )
+        x = x.transpose(1, 2).reshape(N, window_size, window_size, -1)
+        x = self.proj(x)
+
+        return window_unpartition_strided(x, window_size, (H, W))
+
 
 class MultiScaleBlock(nn.Module):
     def __init__(
@@ -91,6 +146,10 @@ class MultiScaleBlock(nn.Module):
         q_stride: Tuple[int, int] = None,
         act_layer: nn.Module = nn.GELU,
         window_size: int = 0,
+        # whether to run windowed attention (in blocks without Q pooling) with
+        # `MultiScaleAttention.forward_windowed`, which avoids the padded copies of
+        # `window_partition` and `window_unpartition`
+        fast_window_attn: bool = True,
     ):
         super().__init__()
 
@@ -102,6 +161,7 @@ class MultiScaleBlock(nn.Module):
         self.norm1 = norm_layer(dim)
 
         self.window_size = window_size
+        self.fast_window_attn = fast_window_attn
 
         self.pool, self.q_stride = None, q_stride
         if self.q_stride:
@@ -137,6 +197,19 @@ class MultiScaleBlock(nn.Module):
         if self.dim != self.dim_out:
             shortcut = do_pool(self.proj(x), self.pool)
 
+        window_size = self.window_size
+        if window_size > 0 and not self.q_stride and self.fast_window_attn:
+            # Window partition + Window Attention + Reverse window partition
+            x = self.attn.forward_windowed(x, window_size)
+        else:
+            x = self._forward_attn(x, shortcut)
+
+        x = shortcut + self.drop_path(x)
+        # MLP
+        x = x + self.drop_path(self.mlp(self.norm2(x)))
+        return x
+
+    def _forward_attn(self, x: torch.Tensor, shortcut: torch.Tensor) -> torch.Tensor:
         # Window partition
         window_size = self.window_size
         if window_size > 0:
@@ -157,10 +230,6 @@ class MultiScaleBlock(nn.Module):
         # Reverse window partition
         if self.window_size > 0:
             x = window_unpartition(x, window_size, pad_hw, (H, W))
-
-        x = shortcut + self.drop_path(x)
-        # MLP
-        x = x + self.drop_path(self.mlp(self.norm2(x)))
         return x
 
 
@@ -62,6 +62,91 @@ def window_unpartition(windows, window_size, pad_hw, hw):
     return x
 
 
+def _window_spans(size, window_size):
+    """
+    Split a dimension of `size` tokens into the span of its full windows and the span
+    of its last partial window (if any), each as a tuple of slices (over the windows,
+    within the windows, over the tokens).
+    """
+    num_full = size // window_size
+    rem = size - num_full * window_size
+    end = num_full * window_size
+    spans = []
+    if num_full > 0:
+        spans.append((slice(0, num_full), slice(0, window_size), slice(0, end)))
+    if rem > 0:
+        spans.append((slice(num_full, num_full + 1), slice(0, rem), slice(end, size)))
+    return spans
+
+
+def window_partition_strided(x, window_size, pad_value=None):
+    """
+    Same as `window_partition`, but without materializing a padded copy of `x`: the
+    tokens are copied once from strided views of `x` into the windows, and only the
+    padding in the last row and column of windows is filled.
+    Args:
+        x (tensor): input tokens with [B, H, W, C].
+        window_size (int): window size.
+        pad_value (tensor or None): [C] value of the padding tokens (zeros if None).
+    Returns:
+        windows: windows after partition with [B * num_windows, window_size, window_size, C].
+        (Hp, Wp): padded height and width before partition
+    """
+    B, H, W, C = x.shape
+    nh = (H + window_size - 1) // window_size
+    nw = (W + window_size - 1) // window_size
+    Hp, Wp = nh * window_size, nw * window_size
+    if Hp == H and Wp == W:
+        x = x.reshape(B, nh, window_size, nw, window_size, C)
+        windows = x.permute(0, 1, 3, 2, 4, 5).reshape(-1, window_size, window_size, C)
+        return windows, (Hp, Wp)
+
+    windows = x.new_empty(B, nh, nw, window_size, window_size, C)
+    pad_value = 0 if pad_value is None else pad_value.to(x.dtype)
+    # all the padding tokens are in the last row or column of windows
+    if Hp > H:
+        windows[:, -1] = pad_value
+    if Wp > W:
+        windows[:, :, -1] = pad_value
+    # (B, nh, window_size, nw, window_size, C) view of the padded tokens
+    padded = windows.permute(0, 1, 3, 2, 4, 5)
+    for win_h, in_h, rows in _window_spans(H, window_size):
+        for win_w, in_w, cols in _window_spans(W, window_size):
+            dst = padded[:, win_h, in_h, win_w, in_w]
+            dst.copy_(x[:, rows, cols].reshape(dst.shape))
+    return windows.view(-1, window_size, window_size, C), (Hp, Wp)
+
+
+def window_unpartition_strided(windows, window_size, hw):
+    """
+    Same as `window_unpartition`, but copying the tokens once from strided views of
+    the windows into the output, without materializing the padded sequences.
+    Args:
+        windows (tensor): input tokens with [B * num_windows, window_size, window_size, C].
+        window_size (int): window size.
+        hw (Tuple): original height and width (H, W) before padding.
+    Returns:
+        x: unpartitioned sequences with [B, H, W, C].
+    """
+    H, W = hw
+    nh = (H + window_size - 1) // window_size
+    nw = (W + window_size - 1) // window_size
+    B = windows.shape[0] // (nh * nw)
+    C = windows.shape[-1]
+    # (B, nh, window_size, nw, window_size, C) view of the padded tokens
+    padded = windows.view(B, nh, nw, window_size, window_size, C)
+    padded = padded.permute(0, 1, 3, 2, 4, 5)
+    if nh * window_size == H and nw * window_size == W:
+        return padded.reshape(B, H, W, C)
+
+    x = windows.new_empty(B, H, W, C)
+    for win_h, in_h, rows in _window_spans(H, window_size):
+        for win_w, in_w, cols in _window_spans(W, window_size):
+            src = padded[:, win_h, in_h, win_w, in_w]
+            x[:, rows, cols].view(src.shape).copy_(src)
+    return x
+
+
 class PatchEmbed(nn.Module):
     """
     Image to Patch Embedding.
@@ -4,9 +4,10 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
-from typing import Optional
+from typing import List, Optional, Tuple
 
 import torch
+import torch.nn.functional as F
 from torch import nn, Tensor
 
 from sam2.modeling.sam.transformer import RoPEAttention
@@ -63,18 +64,36 @@ class MemoryAttentionLayer(nn.Module):
         tgt = tgt + self.dropout1(tgt2)
         return tgt
 
-    def _forward_ca(self, tgt, memory, query_pos, pos, num_k_exclude_rope=0):
+    def _forward_ca(
+        self,
+        tgt,
+        memory,
+        query_pos,
+        pos,
+        num_k_exclude_rope=0,
+        memory_kv=None,
+        memory_mask=None,
+    ):
         kwds = {}
         if num_k_exclude_rope > 0:
             assert isinstance(self.cross_attn_image, RoPEAttention)
             kwds = {"num_k_exclude_rope": num_k_exclude_rope}
+        if memory_mask is not None:
+            kwds["attn_mask"] = memory_mask
 
         # Cross-Attention
         tgt2 = self.norm2(tgt)
+        if memory_kv is not None:
+            # the keys and values are already projected (see `MemoryKVCache`)
+            k, v = memory_kv
+            kwds["kv_projected"] = True
+        else:
+            k = memory + pos if self.pos_enc_at_cross_attn_keys else memory
+            v = memory
         tgt2 = self.cross_attn_image(
             q=tgt2 + query_pos if self.pos_enc_at_cross_attn_queries else tgt2,
-            k=memory + pos if self.pos_enc_at_cross_attn_keys else memory,
-            v=memory,
+            k=k,
+            v=v,
             **kwds,
         )
         tgt = tgt + self.dropout2(tgt2)
@@ -87,11 +106,15 @@ class MemoryAttentionLayer(nn.Module):
         pos: Optional[Tensor] = None,
         query_pos: Optional[Tensor] = None,
         num_k_exclude_rope: int = 0,
+        memory_kv: Optional[Tuple[Tensor, Tensor]] = None,
+        memory_mask: Optional[Tensor] = None,
     ) -> torch.Tensor:
 
         # Self-Attn, Cross-Attn
         tgt = self._forward_sa(tgt, query_pos)
-        tgt = self._forward_ca(tgt, memory, query_pos, pos, num_k_exclude_rope)
+        tgt = self._forward_ca(
+            tgt, memory, query_pos, pos, num_k_exclude_rope, memory_kv, memory_mask
+        )
         # MLP
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -123,6 +146,20 @@ class MemoryAttention(nn.Module):
         curr_pos: Optional[Tensor] = None,  # pos_enc for self-attention inputs
         memory_pos: Optional[Tensor] = None,  # pos_enc for cross-attention inputs
         num_obj_ptr_tokens: int = 0,  # number of object pointer *tokens*
+        # Whether `curr` (and `curr_pos`) is the same for all the objects in the batch,
+        # e.g. the same frame's features expanded to all objects in video tracking. If
+        # so, the first layer's self-attention and query projection run only once and are
+        # broadcast to the per-object memory cross-attention. By default (None), this is
+        # detected in eval mode from `curr` being an expanded tensor along the batch dim.
+        shared_curr: Optional[bool] = None,
+        # An optional `MemoryKVCache` to reuse the projected keys and values of memories
+        # from the previous frames, with `memory_segments` describing the memories
+        # concatenated in `memory` (see `MemoryKVCache.project` for the format).
+        memory_kv_cache: Optional["MemoryKVCache"] = None,
+        memory_segments: Optional[List[tuple]] = None,
+        # An optional [B, 1, 1, L] boolean mask of the memory tokens to attend to (False
+        # for padding), e.g. when the memory is padded to a fixed length for compilation
+        memory_mask: Optional[Tensor] = None,
     ):
         if isinstance(curr, list):
             assert isinstance(curr_pos, list)
@@ -136,6 +173,19 @@ class MemoryAttention(nn.Module):
             curr.shape[1] == memory.shape[1]
         ), "Batch size must be the same for curr and memory"
 
+        if shared_curr is None:
+            shared_curr = (
+                not self.training
+                and curr.size(1) > 1
+                and curr.stride(1) == 0
+                and (curr_pos is None or curr_pos.stride(1) == 0)
+            )
+        if shared_curr:
+            # keep a single copy of the current frame's tokens; they become per-object
+            # after the first layer's cross-attention to each object's memory
+            curr = curr[:, :1]
+            curr_pos = curr_pos[:, :1] if curr_pos is not None else None
+
         output = curr
         if self.pos_enc_at_input and curr_pos is not None:
             output = output + 0.1 * curr_pos
@@ -147,19 +197,31 @@ class MemoryAttention(nn.Module):
             memory = memory.transpose(0, 1)
             memory_pos = memory_pos.transpose(0, 1)
 
-        for layer in self.layers:
+        for layer_idx, layer in enumerate(self.layers):
             kwds = {}
             if isinstance(layer.cross_attn_image, RoPEAttention):
                 kwds = {"num_k_exclude_rope": num_obj_ptr_tokens}
+            if memory_kv_cache is not None:
+                kwds["memory_kv"] = memory_kv_cache.project(
+                    layer_idx,
+                    layer,
+                    memory,
+                    memory_pos,
+                    memory_segments,
+                    seq_dim=1 if self.batch_first else 0,
+                )
 
             output = layer(
                 tgt=output,
                 memory=memory,
                 pos=memory_pos,
                 query_pos=curr_pos,
+                memory_mask=memory_mask,
                 **kwds,
             )
         normed_output = self.norm(output)
+        if memory_kv_cache is not None:
+            memory_kv_cache.evict_unused()
 
         if self.batch_first:
             # Convert back to seq first
@@ -167,3 +229,94 @@ class MemoryAttention(nn.Module):
             curr_pos = curr_pos.transpose(0, 1)
 
         return normed_output
+
+
+class MemoryKVCache:
+    """
+    A per-session cache of the projected keys and values of the memories in the
+    cross-attention of each `MemoryAttention` layer. Most of the memories (e.g. the
+    conditioning frames and the older non-conditioning frames) are the same between
+    consecutive frames in tracking, so only the newly added memory is projected on each
+    frame. Since the key projection is linear, the keys are cached as the projection of
+    the memory features plus that of their positional encoding, where the latter
+    only depends on the memory's temporal position and is shared across objects.
+
+    Entries that are not used in a forward pass of `MemoryAttention` are dropped
+    afterwards, so the cache only holds the memories in the current attention window.
+    """
+
+    def __init__(self):
+        # {(layer_idx, id(source)): (source, k, v)} for memory features, where `source`
+        # is the stored memory feature object (kept alive so that its id stays unique)
+        self._feat_entries = {}
+        # {(layer_idx, pos_key): k} for the positional encodings of the keys
+        self._pos_entries = {}
+        self._used_feat_keys = set()
+        self._used_pos_keys = set()
+
+    def project(self, layer_idx, layer, memory, memory_pos, memory_segments, seq_dim):
+        """
+        Get the projected keys and values of `memory` for the cross-attention of the
+        `layer_idx`-th layer. `memory_segments` is a list of (length, source, pos_key)
+        tuples for each memory concatenated along `seq_dim` in `memory`, where `source`
+        is the stored object that the memory features are taken from (or None if they
+        can't be cached, e.g. object pointers) and `pos_key` identifies a positional
+        encoding that is the same for all frames and objects (or None if it isn't).
+        """
+        attn = layer.cross_attn_image
+        add_pos = layer.pos_enc_at_cross_attn_keys and memory_pos is not None
+        k_list, v_list = [], []
+        start = 0
+        for length, source, pos_key in memory_segments:
+            mem = memory.narrow(seq_dim, start, length)
+            pos = memory_pos.narrow(seq_dim, start, length) if add_pos else None
+            start += length
+            if source is None:
+                k_list.append(attn.k_proj(mem + pos if add_pos else mem))
+                v_list.append(attn.v_proj(mem))
+                continue
+            feat_key = (layer_idx, id(source))
+            entry = self._feat_entries.get(feat_key)
+            if entry is None or entry[0] is not source:
+                # the feature part of the keys (without the bias, which is added below)
+                k_feat = F.linear(mem, attn.k_proj.weight)
+                entry = (source, k_feat, attn.v_proj(mem))
+                self._feat_entries[feat_key] = entry
+            self._used_feat_keys.add(feat_key)
+            _, k, v = entry
+            if not add_pos:
+                k = k + attn.k_proj.bias if attn.k_proj.bias is not None else k
+            elif pos_key is None:
+                k = k + attn.k_proj(pos)
+            else:
+                k = k + self._project_pos(layer_idx, attn, pos, pos_key, seq_dim)
+            k_list.append(k)
+            v_list.append(v)
+        assert start == memory.size(seq_dim), "memory_segments must cover the memory"
+        return torch.cat(k_list, dim=seq_dim), torch.cat(v_list, dim=seq_dim)
+
+    def _project_pos(self, layer_idx, attn, pos, pos_key, seq_dim):
+        pos_key = (layer_idx, pos_key)
+        k_pos = self._pos_entries.get(pos_key)
+        if k_pos is None:
+            # the encoding is the same across objects, so only project it once
+            k_pos = attn.k_proj(pos.narrow(1 - seq_dim, 0, 1))
+            self._pos_entries[pos_key] = k_pos
+        self._used_pos_keys.add(pos_key)
+        return k_pos
+
+    def evict_unused(self):
+        """Drop the entries that were not used since the last call."""
+        for entries, used in [
+            (self._feat_entries, self._used_feat_keys),
+            (self._pos_entries, self._used_pos_keys),
+        ]:
+            for key in [key for key in entries if key not in used]:
+                del entries[key]
+            used.clear()
+
+    def clear(self):
+        self._feat_entries.clear()
+        self._pos_entries.clear()
+        self._used_feat_keys.clear()
+        self._used_pos_keys.clear()
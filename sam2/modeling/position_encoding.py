@@ -77,39 +77,51 @@ class PositionEmbeddingSine(nn.Module):
 
     @torch.no_grad()
     def forward(self, x: torch.Tensor):
-        cache_key = (x.shape[-2], x.shape[-1])
-        if cache_key in self.cache:
-            return self.cache[cache_key][None].repeat(x.shape[0], 1, 1, 1)
+        # The encoding only depends on the size of the feature map, so it's computed
+        # once per size (and device and dtype) and expanded to the batch size as a view
+        cache_key = (
+            x.shape[-2],
+            x.shape[-1],
+            x.device,
+            x.dtype,
+            torch.is_inference_mode_enabled(),
+        )
+        pos = self.cache.get(cache_key)
+        if pos is None:
+            pos = self._compute_pos(x.shape[-2], x.shape[-1], x.device).to(x.dtype)
+            self.cache[cache_key] = pos
+        return pos[None].expand(x.shape[0], -1, -1, -1)
+
+    def _compute_pos(self, h: int, w: int, device: torch.device) -> torch.Tensor:
+        """Compute the CxHxW encoding of an HxW feature map."""
         y_embed = (
-            torch.arange(1, x.shape[-2] + 1, dtype=torch.float32, device=x.device)
-            .view(1, -1, 1)
-            .repeat(x.shape[0], 1, x.shape[-1])
+            torch.arange(1, h + 1, dtype=torch.float32, device=device)
+            .view(-1, 1)
+            .repeat(1, w)
         )
         x_embed = (
-            torch.arange(1, x.shape[-1] + 1, dtype=torch.float32, device=x.device)
-            .view(1, 1, -1)
-            .repeat(x.shape[0], x.shape[-2], 1)
+            torch.arange(1, w + 1, dtype=torch.float32, device=device)
+            .view(1, -1)
+            .repeat(h, 1)
         )
 
         if self.normalize:
             eps = 1e-6
-            y_embed = y_embed / (y_embed[:, -1:, :] + eps) * self.scale
-            x_embed = x_embed / (x_embed[:, :, -1:] + eps) * self.scale
+            y_embed = y_embed / (y_embed[-1:, :] + eps) * self.scale
+            x_embed = x_embed / (x_embed[:, -1:] + eps) * self.scale
 
-        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=x.device)
+        dim_t = torch.arange(self.num_pos_feats, dtype=torch.float32, device=device)
         dim_t = self.temperature ** (2 * (dim_t // 2) / self.num_pos_feats)
 
-        pos_x = x_embed[:, :, :, None] / dim_t
-        pos_y = y_embed[:, :, :, None] / dim_t
+        pos_x = x_embed[:, :, None] / dim_t
+        pos_y = y_embed[:, :, None] / dim_t
         pos_x = torch.stack(
-            (pos_x[:, :, :, 0::2].sin(), pos_x[:, :, :, 1::2].cos()), dim=4
-        ).flatten(3)
+            (pos_x[:, :, 0::2].sin(), pos_x[:, :, 1::2].cos()), dim=3
+        ).flatten(2)
         pos_y = torch.stack(
-            (pos_y[:, :, :, 0::2].sin(), pos_y[:, :, :, 1::2].cos()), dim=4
-        ).flatten(3)
-        pos = torch.cat((pos_y, pos_x), dim=3).permute(0, 3, 1, 2)
-        self.cache[cache_key] = pos[0]
-        return pos
+            (pos_y[:, :, 0::2].sin(), pos_y[:, :, 1::2].cos()), dim=3
+        ).flatten(2)
+        return torch.cat((pos_y, pos_x), dim=2).permute(2, 0, 1)
 
 
 class PositionEmbeddingRandom(nn.Module):
@@ -183,6 +195,23 @@ def compute_axial_cis(dim: int, end_x: int, end_y: int, theta: float = 10000.0):
     return torch.cat([freqs_cis_x, freqs_cis_y], dim=-1)
 
 
+# {(dim, end_x, end_y, theta, device, inference_mode): freqs_cis} shared by all the
+# RoPE attention layers (and models) with the same settings
+_AXIAL_CIS_CACHE = {}
+
+
+def get_axial_cis(
+    dim: int, end_x: int, end_y: int, theta: float, device: torch.device
+) -> torch.Tensor:
+    """A cached `compute_axial_cis` on `device` (which must not be modified in place)."""
+    key = (dim, end_x, end_y, theta, device, torch.is_inference_mode_enabled())
+    freqs_cis = _AXIAL_CIS_CACHE.get(key)
+    if freqs_cis is None:
+        freqs_cis = compute_axial_cis(dim, end_x, end_y, theta).to(device)
+        _AXIAL_CIS_CACHE[key] = freqs_cis
+    return freqs_cis
+
+
 def reshape_for_broadcast(freqs_cis: torch.Tensor, x: torch.Tensor):
     ndim = x.ndim
     assert 0 <= 1 < ndim
@@ -64,6 +64,9 @@ class PromptEncoder(nn.Module):
             nn.Conv2d(mask_in_chans, embed_dim, kernel_size=1),
         )
         self.no_mask_embed = nn.Embedding(1, embed_dim)
+        # the dense positional encoding only changes with the Gaussian matrix buffer
+        # (e.g. when loading a checkpoint or moving the model to another device)
+        self._dense_pe_cache = {}
 
     def get_dense_pe(self) -> torch.Tensor:
         """
@@ -74,7 +77,20 @@ class PromptEncoder(nn.Module):
           torch.Tensor: Positional encoding with shape
             1x(embed_dim)x(embedding_h)x(embedding_w)
         """
-        return self.pe_layer(self.image_embedding_size).unsqueeze(0)
+        matrix = self.pe_layer.positional_encoding_gaussian_matrix
+        cache_key = (
+            matrix.device,
+            matrix.data_ptr(),
+            # inference tensors have no version counter (and are never updated)
+            -1 if matrix.is_inference() else matrix._version,
+            torch.is_inference_mode_enabled(),
+        )
+        dense_pe = self._dense_pe_cache.get(cache_key)
+        if dense_pe is None:
+            with torch.no_grad():
+                dense_pe = self.pe_layer(self.image_embedding_size).unsqueeze(0)
+            self._dense_pe_cache = {cache_key: dense_pe}
+        return dense_pe
 
     def _embed_points(
         self,
@@ -7,40 +7,51 @@
 import contextlib
 import math
 import warnings
-from functools import partial
-from typing import Tuple, Type
+from functools import lru_cache, partial
+from typing import Optional, Tuple, Type
 
 import torch
 import torch.nn.functional as F
 from torch import nn, Tensor
 
-from sam2.modeling.position_encoding import apply_rotary_enc, compute_axial_cis
+from sam2.modeling.position_encoding import (
+    apply_rotary_enc,
+    compute_axial_cis,
+    get_axial_cis,
+)
 from sam2.modeling.sam2_utils import MLP
 from sam2.utils.misc import get_sdpa_settings
 
 warnings.simplefilter(action="ignore", category=FutureWarning)
-# Check whether Flash Attention is available (and use it by default)
-OLD_GPU, USE_FLASH_ATTN, MATH_KERNEL_ON = get_sdpa_settings()
 # A fallback setting to allow all available kernels if Flash Attention fails
 ALLOW_ALL_KERNELS = False
 
 
-def sdp_kernel_context(dropout_p):
+def sdp_kernel_context(dropout_p, attn_mask=None):
     """
     Get the context for the attention scaled dot-product kernel. We use Flash Attention
-    by default, but fall back to all available kernels if Flash Attention fails.
+    by default, but fall back to all available kernels if Flash Attention fails (or
+    if there is an attention mask, which Flash Attention doesn't support).
     """
-    if ALLOW_ALL_KERNELS:
+    if ALLOW_ALL_KERNELS or attn_mask is not None:
         return contextlib.nullcontext()
 
+    old_gpu, use_flash_attn, math_kernel_on = _get_sdpa_settings()
     return torch.backends.cuda.sdp_kernel(
-        enable_flash=USE_FLASH_ATTN,
+        enable_flash=use_flash_attn,
         # if Flash attention kernel is off, then math kernel needs to be enabled
-        enable_math=(OLD_GPU and dropout_p > 0.0) or MATH_KERNEL_ON,
-        enable_mem_efficient=OLD_GPU,
+        enable_math=(old_gpu and dropout_p > 0.0) or math_kernel_on,
+        enable_mem_efficient=old_gpu,
     )
 
 
+@lru_cache(maxsize=None)
+def _get_sdpa_settings():
+    # Check whether Flash Attention is available (and use it by default). This is done
+    # on first use rather than at import, as it initializes CUDA.
+    return get_sdpa_settings()
+
+
 class TwoWayTransformer(nn.Module):
     def __init__(
         self,
@@ -252,22 +263,40 @@ class Attention(nn.Module):
         x = x.transpose(1, 2)
         return x.reshape(b, n_tokens, n_heads * c_per_head)  # B x N_tokens x C
 
-    def forward(self, q: Tensor, k: Tensor, v: Tensor) -> Tensor:
-        # Input projections
+    def _broadcast_q(self, q: Tensor, k: Tensor) -> Tensor:
+        # A single query shared across the batch (i.e. q of batch size 1 with keys of
+        # batch size B) is projected once and then broadcast to all the keys
+        if q.size(0) == 1 and k.size(0) > 1:
+            q = q.expand(k.size(0), -1, -1, -1)
+        return q
+
+    def forward(
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        kv_projected: bool = False,
+        attn_mask: Optional[Tensor] = None,
+    ) -> Tensor:
+        # Input projections (`k` and `v` might be already projected by the caller)
         q = self.q_proj(q)
-        k = self.k_proj(k)
-        v = self.v_proj(v)
+        if not kv_projected:
+            k = self.k_proj(k)
+            v = self.v_proj(v)
 
         # Separate into heads
         q = self._separate_heads(q, self.num_heads)
         k = self._separate_heads(k, self.num_heads)
         v = self._separate_heads(v, self.num_heads)
 
+        q = self._broadcast_q(q, k)
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
         try:
-            with sdp_kernel_context(dropout_p):
-                out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            with sdp_kernel_context(dropout_p, attn_mask):
+                out = F.scaled_dot_product_attention(
+                    q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+                )
         except Exception as e:
             # Fall back to all kernels if the Flash attention kernel fails
             warnings.warn(
@@ -278,7 +307,9 @@ class Attention(nn.Module):
             )
             global ALLOW_ALL_KERNELS
             ALLOW_ALL_KERNELS = True
-            out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            out = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+            )
 
         out = self._recombine_heads(out)
         out = self.out_proj(out)
@@ -304,17 +335,25 @@ class RoPEAttention(Attention):
         self.compute_cis = partial(
             compute_axial_cis, dim=self.internal_dim // self.num_heads, theta=rope_theta
         )
+        self.rope_theta = rope_theta
         freqs_cis = self.compute_cis(end_x=feat_sizes[0], end_y=feat_sizes[1])
         self.freqs_cis = freqs_cis
         self.rope_k_repeat = rope_k_repeat
 
     def forward(
-        self, q: Tensor, k: Tensor, v: Tensor, num_k_exclude_rope: int = 0
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        num_k_exclude_rope: int = 0,
+        kv_projected: bool = False,
+        attn_mask: Optional[Tensor] = None,
     ) -> Tensor:
-        # Input projections
+        # Input projections (`k` and `v` might be already projected by the caller)
         q = self.q_proj(q)
-        k = self.k_proj(k)
-        v = self.v_proj(v)
+        if not kv_projected:
+            k = self.k_proj(k)
+            v = self.v_proj(v)
 
         # Separate into heads
         q = self._separate_heads(q, self.num_heads)
@@ -322,10 +361,15 @@ class RoPEAttention(Attention):
         v = self._separate_heads(v, self.num_heads)
 
         # Apply rotary position encoding
-        w = h = math.sqrt(q.shape[-2])
-        self.freqs_cis = self.freqs_cis.to(q.device)
-        if self.freqs_cis.shape[0] != q.shape[-2]:
-            self.freqs_cis = self.compute_cis(end_x=w, end_y=h).to(q.device)
+        if (
+            self.freqs_cis.shape[0] != q.shape[-2]
+            or self.freqs_cis.device != q.device
+        ):
+            # take the encoding shared by all layers with the same settings and size
+            w = h = int(math.sqrt(q.shape[-2]))
+            self.freqs_cis = get_axial_cis(
+                self.internal_dim // self.num_heads, w, h, self.rope_theta, q.device
+            )
         if q.shape[-2] != k.shape[-2]:
             assert self.rope_k_repeat
 
@@ -337,11 +381,14 @@ class RoPEAttention(Attention):
             repeat_freqs_k=self.rope_k_repeat,
         )
 
+        q = self._broadcast_q(q, k)
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
         try:
-            with sdp_kernel_context(dropout_p):
-                out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            with sdp_kernel_context(dropout_p, attn_mask):
+                out = F.scaled_dot_product_attention(
+                    q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+                )
         except Exception as e:
             # Fall back to all kernels if the Flash attention kernel fails
             warnings.warn(
@@ -352,7 +399,9 @@ class RoPEAttention(Attention):
             )
             global ALLOW_ALL_KERNELS
             ALLOW_ALL_KERNELS = True
-            out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            out = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+            )
 
         out = self._recombine_heads(out)
         out = self.out_proj(out)
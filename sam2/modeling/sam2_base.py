@@ -4,21 +4,45 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import functools
+
 import torch
 import torch.distributed
 import torch.nn.functional as F
 
 from torch.nn.init import trunc_normal_
+from torch.utils._pytree import tree_map
 
 from sam2.modeling.sam.mask_decoder import MaskDecoder
 from sam2.modeling.sam.prompt_encoder import PromptEncoder
 from sam2.modeling.sam.transformer import TwoWayTransformer
 from sam2.modeling.sam2_utils import get_1d_sine_pe, MLP, select_closest_cond_frames
+from sam2.utils.misc import maybe_dequantize
 
 # a large negative value as a placeholder score for missing objects
 NO_OBJ_SCORE = -1024.0
 
 
+def _compile_with_cloned_outputs(forward, **compile_kwargs):
+    """
+    Compile a forward function and clone its output tensors. Under "max-autotune",
+    the compiled function runs as a CUDA graph whose outputs live in static buffers
+    that the next replay overwrites, while the outputs here are kept across frames
+    (e.g. the memories in `output_dict` or the cached image features).
+    """
+    compiled_forward = torch.compile(forward, **compile_kwargs)
+
+    @functools.wraps(forward)
+    def wrapper(*args, **kwargs):
+        torch.compiler.cudagraph_mark_step_begin()
+        out = compiled_forward(*args, **kwargs)
+        return tree_map(
+            lambda x: x.clone() if isinstance(x, torch.Tensor) else x, out
+        )
+
+    return wrapper
+
+
 class SAM2Base(torch.nn.Module):
     def __init__(
         self,
@@ -91,6 +115,13 @@ class SAM2Base(torch.nn.Module):
         # extra arguments used to construct the SAM mask decoder; if not None, it should be a dict of kwargs to be passed into `MaskDecoder` class.
         sam_mask_decoder_extra_args=None,
         compile_image_encoder: bool = False,
+        # Whether to pad the memory in memory attention to a fixed number of memory frames
+        # and object pointers (masking out the padding) during inference, so that the
+        # tracking step always sees the same shapes (e.g. for compilation or CUDA graphs)
+        static_memory_shape: bool = False,
+        # Whether to compile memory attention, the SAM mask decoder and the memory encoder
+        # for the tracking step (implies `static_memory_shape=True`)
+        compile_track_step: bool = False,
     ):
         super().__init__()
 
@@ -175,13 +206,43 @@ class SAM2Base(torch.nn.Module):
         self.add_all_frames_to_correct_as_cond = add_all_frames_to_correct_as_cond
         self.max_cond_frames_in_attn = max_cond_frames_in_attn
 
+        # Cache of the memory positional encodings (spatial + temporal) and the object
+        # pointer temporal encodings in inference, which only depend on the weights.
+        # It's cleared whenever the weights might change (see `train` and the hook below).
+        self._memory_pe_cache = {}
+        self.register_load_state_dict_post_hook(self._clear_memory_pe_cache)
+
+        # With a static memory shape, the memory in memory attention always holds slots
+        # for `max_cond_frames_in_attn` (or 1 if unlimited) conditioning frames and
+        # `num_maskmem - 1` non-conditioning frames, plus the object pointers of them all;
+        # frames with more conditioning frames than that fall back to a dynamic shape.
+        self.static_memory_shape = static_memory_shape or compile_track_step
+        self.num_static_cond_slots = max(self.max_cond_frames_in_attn, 1)
+
         # Model compilation
+        if compile_track_step:
+            print(
+                "Tracking step compilation is enabled. First forward passes will be slow."
+            )
+            # Memory attention sees a fixed memory length under `static_memory_shape`, and
+            # the mask decoder and memory encoder only depend on the number of objects.
+            compiled_modules = [
+                self.memory_attention,
+                self.sam_mask_decoder,
+                self.memory_encoder,
+            ]
+            for module in compiled_modules:
+                module.forward = _compile_with_cloned_outputs(
+                    module.forward,
+                    mode="max-autotune",
+                    dynamic=False,
+                )
         if compile_image_encoder:
             # Compile the forward function (not the full module) to allow loading checkpoints.
             print(
                 "Image encoder compilation is enabled. First forward pass will be slow."
             )
-            self.image_encoder.forward = torch.compile(
+            self.image_encoder.forward = _compile_with_cloned_outputs(
                 self.image_encoder.forward,
                 mode="max-autotune",
                 fullgraph=True,
@@ -192,6 +253,14 @@ class SAM2Base(torch.nn.Module):
     def device(self):
         return next(self.parameters()).device
 
+    def train(self, mode=True):
+        self._clear_memory_pe_cache()
+        return super().train(mode)
+
+    def _clear_memory_pe_cache(self, *args):
+        """Clear the cached positional encodings (e.g. after the weights are updated)."""
+        self._memory_pe_cache.clear()
+
     def forward(self, *args, **kwargs):
         raise NotImplementedError(
             "Please use the corresponding methods in SAM2VideoPredictor for inference."
@@ -490,6 +559,39 @@ class SAM2Base(torch.nn.Module):
 
         return backbone_out, vision_feats, vision_pos_embeds, feat_sizes
 
+    def _get_maskmem_pos_table(self, maskmem_pos_enc):
+        """
+        Get the memory positional encodings of all temporal positions in (HW)BC layout,
+        i.e. a [num_maskmem, HW, 1, C] tensor whose t_pos-th entry is the spatial encoding
+        `maskmem_pos_enc` plus the temporal encoding of a memory at t_pos (cached, since
+        the spatial encoding is the same across frames and objects).
+        """
+        key = ("maskmem_pos", tuple(maskmem_pos_enc.shape[-2:]), maskmem_pos_enc.device)
+        pos_table = self._memory_pe_cache.get(key)
+        if pos_table is None:
+            # only take one object, since the encoding is the same across objects
+            spatial_enc = maskmem_pos_enc[0:1].flatten(2).permute(2, 0, 1)
+            # a memory at t_pos uses the temporal encoding at (num_maskmem - t_pos - 1)
+            pos_table = spatial_enc.unsqueeze(0) + self.maskmem_tpos_enc.flip(0)
+            self._memory_pe_cache[key] = pos_table
+        return pos_table
+
+    def _get_obj_ptr_tpos_table(self, max_pos, t_diff_max, tpos_dim, device):
+        """
+        Get the (projected) temporal positional encodings of object pointers for
+        all temporal distances in [0, max_pos] as a [N, mem_dim] tensor with N > max_pos
+        (cached and grown on demand, since the distances are small integers).
+        """
+        key = ("obj_ptr_tpos", t_diff_max, tpos_dim, device, torch.is_autocast_enabled())
+        tpos_table = self._memory_pe_cache.get(key)
+        if tpos_table is None or tpos_table.size(0) <= max_pos:
+            num_pos = 1 << max(max_pos, 15).bit_length()  # at least 16 positions
+            pos = torch.arange(num_pos, dtype=torch.float32, device=device)
+            tpos_table = get_1d_sine_pe(pos / t_diff_max, dim=tpos_dim)
+            tpos_table = self.obj_ptr_tpos_proj(tpos_table)
+            self._memory_pe_cache[key] = tpos_table
+        return tpos_table
+
     def _prepare_memory_conditioned_features(
         self,
         frame_idx,
@@ -500,6 +602,7 @@ class SAM2Base(torch.nn.Module):
         output_dict,
         num_frames,
         track_in_reverse=False,  # tracking in reverse time order (for demo usage)
+        memory_kv_cache=None,  # an optional `MemoryKVCache` (only used in inference)
     ):
         """Fuse the current frame's visual feature map with previous memory."""
         B = current_vision_feats[-1].size(1)  # batch size on this frame
@@ -513,6 +616,19 @@ class SAM2Base(torch.nn.Module):
             return pix_feat
 
         num_obj_ptr_tokens = 0
+        # In inference, take the memory positional encodings from the cached tables
+        # (instead of recomputing them for each memory on every frame)
+        use_pe_cache = not self.training and not torch.is_grad_enabled()
+        if not use_pe_cache:
+            memory_kv_cache = None
+        # (length, source, pos_key) of each concatenated memory for `memory_kv_cache`
+        memory_segments = []
+        # In the static-shape mode, the memory is padded to a fixed length, with a mask
+        # of the memory tokens to attend to (built on device to avoid any host sync)
+        use_static_memory = (
+            self.static_memory_shape and use_pe_cache and not is_init_cond_frame
+        )
+        to_cat_memory_mask = []
         # Step 1: condition the visual features of the current frame on previous memories
         if not is_init_cond_frame:
             # Retrieve the memories encoded with the maskmem backbone
@@ -526,6 +642,12 @@ class SAM2Base(torch.nn.Module):
                 frame_idx, cond_outputs, self.max_cond_frames_in_attn
             )
             t_pos_and_prevs = [(0, out) for out in selected_cond_outputs.values()]
+            if use_static_memory:
+                num_pad = self.num_static_cond_slots - len(t_pos_and_prevs)
+                if num_pad >= 0:
+                    t_pos_and_prevs.extend([(0, None)] * num_pad)
+                else:
+                    use_static_memory = False  # too many cond frames for the slots
             # Add last (self.num_maskmem - 1) frames before current frame for non-conditioning memory
             # the earliest one has t_pos=1 and the latest one has t_pos=self.num_maskmem-1
             # We also allow taking the memory frame non-consecutively (with r>1), in which case
@@ -564,19 +686,40 @@ class SAM2Base(torch.nn.Module):
 
             for t_pos, prev in t_pos_and_prevs:
                 if prev is None:
+                    if use_static_memory:
+                        # add an empty slot for this frame (masked out in attention)
+                        pad = current_vision_feats[-1].new_zeros(H * W, B, self.mem_dim)
+                        to_cat_memory.append(pad)
+                        to_cat_memory_pos_embed.append(pad)
+                        to_cat_memory_mask.append(
+                            torch.zeros(H * W, dtype=torch.bool, device=device)
+                        )
                     continue  # skip padding frames
-                # "maskmem_features" might have been offloaded to CPU in demo use cases,
-                # so we load it back to GPU (it's a no-op if it's already on GPU).
-                feats = prev["maskmem_features"].to(device, non_blocking=True)
+                # "maskmem_features" might have been offloaded to CPU (and possibly quantized)
+                # in demo use cases, so we load it back to GPU (it's a no-op if it's already
+                # an unquantized tensor on GPU).
+                feats = maybe_dequantize(prev["maskmem_features"], device)
                 to_cat_memory.append(feats.flatten(2).permute(2, 0, 1))
+                memory_segments.append(
+                    (to_cat_memory[-1].size(0), prev["maskmem_features"], t_pos)
+                )
                 # Spatial positional encoding (it might have been offloaded to CPU in eval)
                 maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
-                maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
-                # Temporal positional encoding
-                maskmem_enc = (
-                    maskmem_enc + self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
-                )
+                if use_pe_cache:
+                    # spatial + temporal positional encoding, expanded to the batch size
+                    pos_table = self._get_maskmem_pos_table(maskmem_enc)
+                    maskmem_enc = pos_table[t_pos].expand(-1, B, -1)
+                else:
+                    maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
+                    # Temporal positional encoding
+                    maskmem_enc = (
+                        maskmem_enc + self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
+                    )
                 to_cat_memory_pos_embed.append(maskmem_enc)
+                if use_static_memory:
+                    to_cat_memory_mask.append(
+                        torch.ones(maskmem_enc.size(0), dtype=torch.bool, device=device)
+                    )
 
             # Construct the list of past object pointers
             if self.use_obj_ptrs_in_encoder:
@@ -606,6 +749,18 @@ class SAM2Base(torch.nn.Module):
                     )
                     if out is not None:
                         pos_and_ptrs.append((t_diff, out["obj_ptr"]))
+                num_valid_ptrs = len(pos_and_ptrs)
+                if use_static_memory:
+                    # pad with empty pointers up to the max number of pointers from the
+                    # cond frame slots and the non-cond frames (masked out in attention)
+                    max_num_ptrs = (
+                        self.num_static_cond_slots + self.max_obj_ptrs_in_encoder - 1
+                    )
+                    ptr_like = pos_and_ptrs[0][1] if num_valid_ptrs > 0 else None
+                    if ptr_like is None:
+                        ptr_like = current_vision_feats[-1]
+                    ptr_pad = ptr_like.new_zeros(B, C)
+                    pos_and_ptrs.extend([(0, ptr_pad)] * (max_num_ptrs - num_valid_ptrs))
                 # If we have at least one object pointer, add them to the across attention
                 if len(pos_and_ptrs) > 0:
                     pos_list, ptrs_list = zip(*pos_and_ptrs)
@@ -616,9 +771,16 @@ class SAM2Base(torch.nn.Module):
                     if self.add_tpos_enc_to_obj_ptrs:
                         t_diff_max = max_obj_ptrs_in_encoder - 1
                         tpos_dim = C if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
-                        obj_pos = torch.tensor(pos_list, device=device)
-                        obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
-                        obj_pos = self.obj_ptr_tpos_proj(obj_pos)
+                        if use_pe_cache:
+                            # gather the rows of the cached table (no host-to-device copy)
+                            tpos_table = self._get_obj_ptr_tpos_table(
+                                max(pos_list), t_diff_max, tpos_dim, device
+                            )
+                            obj_pos = torch.stack([tpos_table[p] for p in pos_list])
+                        else:
+                            obj_pos = torch.tensor(pos_list, device=device)
+                            obj_pos = get_1d_sine_pe(obj_pos / t_diff_max, dim=tpos_dim)
+                            obj_pos = self.obj_ptr_tpos_proj(obj_pos)
                         obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
                     else:
                         obj_pos = obj_ptrs.new_zeros(len(pos_list), B, self.mem_dim)
@@ -632,6 +794,15 @@ class SAM2Base(torch.nn.Module):
                     to_cat_memory.append(obj_ptrs)
                     to_cat_memory_pos_embed.append(obj_pos)
                     num_obj_ptr_tokens = obj_ptrs.shape[0]
+                    memory_segments.append((num_obj_ptr_tokens, None, None))
+                    if use_static_memory:
+                        # each pointer is split into the same number of tokens (in order)
+                        tokens_per_ptr = num_obj_ptr_tokens // len(pos_list)
+                        num_valid_tokens = num_valid_ptrs * tokens_per_ptr
+                        to_cat_memory_mask.append(
+                            torch.arange(num_obj_ptr_tokens, device=device)
+                            < num_valid_tokens
+                        )
                 else:
                     num_obj_ptr_tokens = 0
         else:
@@ -645,10 +816,17 @@ class SAM2Base(torch.nn.Module):
             # Use a dummy token on the first frame (to avoid empty memory input to tranformer encoder)
             to_cat_memory = [self.no_mem_embed.expand(1, B, self.mem_dim)]
             to_cat_memory_pos_embed = [self.no_mem_pos_enc.expand(1, B, self.mem_dim)]
+            memory_segments.append((1, None, None))
 
         # Step 2: Concatenate the memories and forward through the transformer encoder
         memory = torch.cat(to_cat_memory, dim=0)
         memory_pos_embed = torch.cat(to_cat_memory_pos_embed, dim=0)
+        memory_mask = None
+        if use_static_memory:
+            # the same mask for all objects, broadcast to [B, num_heads, HW, L]
+            memory_mask = torch.cat(to_cat_memory_mask, dim=0).view(1, 1, 1, -1)
+            # the projected memories are not cached with padded memories
+            memory_kv_cache = None
 
         pix_feat_with_mem = self.memory_attention(
             curr=current_vision_feats,
@@ -656,6 +834,9 @@ class SAM2Base(torch.nn.Module):
             memory=memory,
             memory_pos=memory_pos_embed,
             num_obj_ptr_tokens=num_obj_ptr_tokens,
+            memory_kv_cache=memory_kv_cache,
+            memory_segments=memory_segments if memory_kv_cache is not None else None,
+            memory_mask=memory_mask,
         )
         # reshape the output (HW)BC => BCHW
         pix_feat_with_mem = pix_feat_with_mem.permute(1, 2, 0).view(B, C, H, W)
@@ -721,6 +902,8 @@ class SAM2Base(torch.nn.Module):
         run_mem_encoder=True,
         # The previously predicted SAM mask logits (which can be fed together with new clicks in demo).
         prev_sam_mask_logits=None,
+        # An optional `MemoryKVCache` to reuse the projected memories across frames in inference.
+        memory_kv_cache=None,
     ):
         current_out = {"point_inputs": point_inputs, "mask_inputs": mask_inputs}
         # High-resolution feature maps for the SAM head, reshape (HW)BC => BCHW
@@ -750,6 +933,7 @@ class SAM2Base(torch.nn.Module):
                 output_dict=output_dict,
                 num_frames=num_frames,
                 track_in_reverse=track_in_reverse,
+                memory_kv_cache=memory_kv_cache,
             )
             # apply SAM-style segmentation head
             # here we might feed previously predicted low-res SAM mask logits into the SAM mask decoder,
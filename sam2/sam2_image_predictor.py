@@ -54,6 +54,10 @@ class SAM2ImagePredictor:
         self._orig_hw = None
         # Whether the predictor is set for single image or a batch of images
         self._is_batch = False
+        # The tiles (XYXY boxes) and size of an image set with `set_image_tiled`
+        self._tile_boxes = None
+        self._tiled_hw = None
+        self._tile_overlap = 0
 
         # Predictor config
         self.mask_threshold = mask_threshold
@@ -149,9 +153,9 @@ class SAM2ImagePredictor:
                 image, np.ndarray
             ), "Images are expected to be an np.ndarray in RGB format, and of shape  HWC"
             self._orig_hw.append(image.shape[:2])
-        # Transform the image to the form expected by the model
-        img_batch = self._transforms.forward_batch(image_list)
-        img_batch = img_batch.to(self.device)
+        # Transform the image to the form expected by the model (resizing the images
+        # on the model's device after copying the uint8 pixels to it)
+        img_batch = self._transforms.forward_batch(image_list, device=self.device)
         batch_size = img_batch.shape[0]
         assert (
             len(img_batch.shape) == 4 and img_batch.shape[1] == 3
@@ -172,6 +176,196 @@ class SAM2ImagePredictor:
         self._is_batch = True
         logging.info("Image embeddings computed.")
 
+    @torch.no_grad()
+    def set_image_tiled(
+        self,
+        image: np.ndarray,
+        tile_size: Optional[int] = None,
+        tile_overlap: int = 256,
+    ) -> None:
+        """
+        Calculates the image embeddings of overlapping tiles of a (large) image,
+        allowing masks to be predicted at the image's own resolution with the
+        'predict_tiled' method (instead of squashing the whole image to the model's
+        input size). All the tiles are embedded in one batch.
+
+        Arguments:
+          image (np.ndarray): The input image to embed in RGB format, in HWC format
+            with pixel values in [0, 255].
+          tile_size (int or None): The side of the square tiles in pixels. If None,
+            the model's image size is used, so that the tiles are not resized.
+          tile_overlap (int): The overlap in pixels between neighboring tiles, over
+            which the mask logits of the tiles are blended.
+        """
+        if tile_size is None:
+            tile_size = self.model.image_size
+        assert 0 <= tile_overlap < tile_size, "tile_overlap must be below tile_size"
+        h, w = image.shape[:2]
+        tile_boxes = [
+            (x0, y0, min(x0 + tile_size, w), min(y0 + tile_size, h))
+            for y0 in self._get_tile_starts(h, tile_size, tile_overlap)
+            for x0 in self._get_tile_starts(w, tile_size, tile_overlap)
+        ]
+        self.set_image_batch([image[y0:y1, x0:x1] for x0, y0, x1, y1 in tile_boxes])
+        self._tile_boxes = tile_boxes
+        self._tiled_hw = (h, w)
+        self._tile_overlap = tile_overlap
+
+    @staticmethod
+    def _get_tile_starts(length: int, tile_size: int, tile_overlap: int) -> List[int]:
+        """Start offsets of overlapping tiles covering `length` pixels."""
+        if length <= tile_size:
+            return [0]
+        stride = tile_size - tile_overlap
+        starts = list(range(0, length - tile_size, stride))
+        starts.append(length - tile_size)  # the last tile ends at the image border
+        return starts
+
+    def predict_tiled(
+        self,
+        point_coords: Optional[np.ndarray] = None,
+        point_labels: Optional[np.ndarray] = None,
+        box: Optional[np.ndarray] = None,
+        multimask_output: bool = False,
+        return_logits: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Predict masks for the given input prompts on an image set with
+        'set_image_tiled', at the image's own resolution. Each prompt is routed to
+        the tiles containing it: a box prompt goes to every tile it overlaps (clipped
+        to the tile), and point prompts go to the tiles containing one of their
+        foreground points (with only the points inside the tile). The prompts on all
+        tiles are decoded together, and the mask logits of the tiles are blended with
+        linear ramps over the tile overlaps. Pixels outside the tiles an object is
+        routed to are background.
+
+        Arguments:
+          point_coords (np.ndarray or None): A Nx2 array of point prompts in (X,Y)
+            pixels, or a BxNx2 array for B objects.
+          point_labels (np.ndarray or None): A length N (or BxN) array of labels for
+            the point prompts. 1 indicates a foreground point and 0 indicates a
+            background point.
+          box (np.ndarray or None): A length 4 array (or Bx4 array) of box prompts in
+            XYXY format.
+          multimask_output (bool): If true, the model will return three masks per
+            object, blended across tiles by their index.
+          return_logits (bool): If true, returns un-thresholded masks logits
+            instead of a binary mask.
+
+        Returns:
+          (np.ndarray): The output masks in CxHxW format (or BxCxHxW for B objects),
+            where C is the number of masks, and (H, W) is the original image size.
+          (np.ndarray): An array of length C (or BxC) with the model's predictions
+            for the quality of each mask, averaged over the tiles.
+        """
+        if self._tile_boxes is None:
+            raise RuntimeError(
+                "An image must be set with .set_image_tiled(...) before tiled "
+                "mask prediction."
+            )
+        if point_coords is None and box is None:
+            raise ValueError(
+                "predict_tiled needs point or box prompts, to route them to tiles."
+            )
+        is_single = (point_coords is None or np.ndim(point_coords) == 2) and (
+            box is None or np.ndim(box) == 1
+        )
+        if point_coords is not None:
+            assert (
+                point_labels is not None
+            ), "point_labels must be supplied if point_coords is supplied."
+            point_coords = np.asarray(point_coords, dtype=np.float32).reshape(
+                -1, np.shape(point_coords)[-2], 2
+            )
+            point_labels = np.asarray(point_labels).reshape(point_coords.shape[:2])
+        if box is not None:
+            box = np.asarray(box, dtype=np.float32).reshape(-1, 4)
+        num_objs = len(point_coords) if point_coords is not None else len(box)
+
+        # Route the prompts of each object to the tiles containing them
+        entries, prompts_per_entry, tile_inds = [], [], []
+        for obj_idx in range(num_objs):
+            for tile_idx, (x0, y0, x1, y1) in enumerate(self._tile_boxes):
+                coords, labels, tile_box = None, None, None
+                if point_coords is not None:
+                    px, py = point_coords[obj_idx, :, 0], point_coords[obj_idx, :, 1]
+                    inside = (px >= x0) & (px < x1) & (py >= y0) & (py < y1)
+                    if inside.any():
+                        coords = point_coords[obj_idx, inside] - np.array([x0, y0])
+                        labels = point_labels[obj_idx, inside]
+                if box is not None:
+                    bx0, by0, bx1, by1 = box[obj_idx]
+                    if bx0 < x1 and bx1 > x0 and by0 < y1 and by1 > y0:
+                        tile_box = np.clip(
+                            box[obj_idx] - np.array([x0, y0, x0, y0]),
+                            0,
+                            [x1 - x0, y1 - y0, x1 - x0, y1 - y0],
+                        )
+                    elif coords is not None:
+                        coords = None  # the object's box is outside this tile
+                elif coords is not None and not (labels == 1).any():
+                    coords = None  # only background points in this tile
+                if coords is None and tile_box is None:
+                    continue
+                _, unnorm_coords, unnorm_labels, unnorm_box = self._prep_prompts(
+                    coords, labels, tile_box, None, True, img_idx=tile_idx
+                )
+                entries.append((obj_idx, tile_idx))
+                prompts_per_entry.append(
+                    (unnorm_coords, unnorm_labels, unnorm_box, None)
+                )
+                tile_inds.append(tile_idx)
+
+        outputs = []
+        if len(entries) > 0:
+            outputs = self._predict_batch(
+                prompts_per_entry,
+                multimask_output,
+                return_logits=True,
+                img_inds=tile_inds,
+            )
+
+        # Blend the tile logits of each object into the whole image
+        num_masks = 3 if multimask_output else 1
+        h, w = self._tiled_hw
+        logits = torch.zeros(num_objs, num_masks, h, w, device=self.device)
+        weights = torch.zeros(num_objs, 1, h, w, device=self.device)
+        iou_sums = torch.zeros(num_objs, num_masks, device=self.device)
+        num_tiles = torch.zeros(num_objs, 1, device=self.device)
+        for (obj_idx, tile_idx), (masks, iou_predictions, _) in zip(entries, outputs):
+            x0, y0, x1, y1 = self._tile_boxes[tile_idx]
+            tile_weights = self._get_tile_weights(y1 - y0, x1 - x0)
+            logits[obj_idx, :, y0:y1, x0:x1] += masks[0].float() * tile_weights
+            weights[obj_idx, :, y0:y1, x0:x1] += tile_weights
+            iou_sums[obj_idx] += iou_predictions[0].float()
+            num_tiles[obj_idx] += 1
+        logits = torch.where(
+            weights > 0,
+            logits / weights.clamp(min=1e-6),
+            torch.full_like(logits, -32.0),
+        )
+        iou_predictions = iou_sums / num_tiles.clamp(min=1)
+
+        masks = logits if return_logits else logits > self.mask_threshold
+        masks_np = masks.float().cpu().numpy()
+        iou_predictions_np = iou_predictions.cpu().numpy()
+        if is_single:
+            masks_np, iou_predictions_np = masks_np[0], iou_predictions_np[0]
+        return masks_np, iou_predictions_np
+
+    def _get_tile_weights(self, tile_h: int, tile_w: int) -> torch.Tensor:
+        """
+        Blending weights of a tile, ramping up linearly from the tile borders over the
+        tile overlap (the weights are always positive, so a pixel covered by a single
+        tile keeps its logits as they are).
+        """
+        ramp_len = self._tile_overlap + 1
+        ys = torch.arange(tile_h, device=self.device, dtype=torch.float32)
+        xs = torch.arange(tile_w, device=self.device, dtype=torch.float32)
+        ramp_y = (torch.minimum(ys, tile_h - 1 - ys) + 1).clamp(max=ramp_len) / ramp_len
+        ramp_x = (torch.minimum(xs, tile_w - 1 - xs) + 1).clamp(max=ramp_len) / ramp_len
+        return ramp_y[:, None] * ramp_x[None, :]
+
     def predict_batch(
         self,
         point_coords_batch: List[np.ndarray] = None,
@@ -181,9 +375,15 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         normalize_coords=True,
+        return_tensors: bool = False,
     ) -> Tuple[List[np.ndarray], List[np.ndarray], List[np.ndarray]]:
         """This function is very similar to predict(...), however it is used for batched mode, when the model is expected to generate predictions on multiple images.
         It returns a tuple of lists of masks, ious, and low_res_masks_logits.
+
+        The prompts of all images are encoded and decoded together (see `_predict_batch`),
+        and the outputs are only copied to CPU once all the images are processed. With
+        `return_tensors=True`, the outputs are returned as tensors on the model's device
+        instead of numpy arrays (without any device-to-host copy).
         """
         assert self._is_batch, "This function should only be used when in batched mode"
         if not self._is_image_set:
@@ -191,9 +391,7 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image_batch(...) before mask prediction."
             )
         num_images = len(self._features["image_embed"])
-        all_masks = []
-        all_ious = []
-        all_low_res_masks = []
+        prompts_per_image = []
         for img_idx in range(num_images):
             # Transform input prompts
             point_coords = (
@@ -214,15 +412,20 @@ class SAM2ImagePredictor:
                 normalize_coords,
                 img_idx=img_idx,
             )
-            masks, iou_predictions, low_res_masks = self._predict(
-                unnorm_coords,
-                labels,
-                unnorm_box,
-                mask_input,
-                multimask_output,
-                return_logits=return_logits,
-                img_idx=img_idx,
-            )
+            prompts_per_image.append((unnorm_coords, labels, unnorm_box, mask_input))
+
+        all_masks = []
+        all_ious = []
+        all_low_res_masks = []
+        outputs_per_image = self._predict_batch(
+            prompts_per_image, multimask_output, return_logits=return_logits
+        )
+        for masks, iou_predictions, low_res_masks in outputs_per_image:
+            if return_tensors:
+                all_masks.append(masks.squeeze(0))
+                all_ious.append(iou_predictions.squeeze(0))
+                all_low_res_masks.append(low_res_masks.squeeze(0))
+                continue
             masks_np = masks.squeeze(0).float().detach().cpu().numpy()
             iou_predictions_np = (
                 iou_predictions.squeeze(0).float().detach().cpu().numpy()
@@ -333,6 +536,141 @@ class SAM2ImagePredictor:
                 mask_input = mask_input[None, :, :, :]
         return mask_input, unnorm_coords, labels, unnorm_box
 
+    def _get_concat_points(self, point_coords, point_labels, boxes):
+        """Merge the point and box prompts into a single (coords, labels) input."""
+        if point_coords is not None:
+            concat_points = (point_coords, point_labels)
+        else:
+            concat_points = None
+
+        if boxes is not None:
+            box_coords = boxes.reshape(-1, 2, 2)
+            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
+            box_labels = box_labels.repeat(boxes.size(0), 1)
+            # we merge "boxes" and "points" into a single "concat_points" input (where
+            # boxes are added at the beginning) to sam_prompt_encoder
+            if concat_points is not None:
+                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
+                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
+                concat_points = (concat_coords, concat_labels)
+            else:
+                concat_points = (box_coords, box_labels)
+        return concat_points
+
+    @torch.no_grad()
+    def _predict_batch(
+        self,
+        prompts_per_image: List[tuple],
+        multimask_output: bool = True,
+        return_logits: bool = False,
+        img_inds: Optional[List[int]] = None,
+    ) -> List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]:
+        """
+        Predict masks for the prompts of all images in the batch at once. Each item in
+        `prompts_per_image` holds the (point_coords, point_labels, boxes, mask_input)
+        of an image as in `_predict` (where each of them can hold several objects).
+
+        The objects of all images are flattened into one batch and each of them takes
+        its own image's features, so that the prompt encoder and the mask decoder run
+        once per group of objects with the same number of prompt tokens (all the objects
+        are in a single group in the common case of the same prompt type everywhere).
+        Returns the (masks, iou_predictions, low_res_masks) of each image as in `_predict`.
+
+        If `img_inds` is given, the i-th item of `prompts_per_image` holds prompts on
+        the `img_inds[i]`-th image in the batch (so several items can be on the same
+        image), instead of the i-th image.
+        """
+        if not self._is_image_set:
+            raise RuntimeError(
+                "An image must be set with .set_image_batch(...) before mask prediction."
+            )
+
+        # Group the objects by their prompt shape, i.e. (num_point_tokens, has_mask)
+        groups = {}
+        num_objs_per_image = []
+        if img_inds is None:
+            img_inds = list(range(len(prompts_per_image)))
+        for img_idx, (coords, labels, boxes, mask_input) in enumerate(
+            prompts_per_image
+        ):
+            concat_points = self._get_concat_points(coords, labels, boxes)
+            num_tokens = None if concat_points is None else concat_points[0].size(1)
+            if concat_points is not None:
+                num_objs = concat_points[0].size(0)
+            elif mask_input is not None:
+                num_objs = mask_input.size(0)
+            else:
+                num_objs = 1
+            if mask_input is not None:
+                assert mask_input.size(0) == num_objs
+            num_objs_per_image.append(num_objs)
+            key = (num_tokens, mask_input is not None)
+            groups.setdefault(key, []).append((img_idx, concat_points, mask_input))
+
+        low_res_masks_per_image = [None] * len(prompts_per_image)
+        iou_predictions_per_image = [None] * len(prompts_per_image)
+        image_pe = self.model.sam_prompt_encoder.get_dense_pe()
+        for (num_tokens, has_mask), items in groups.items():
+            feat_inds = torch.tensor(
+                [
+                    img_inds[img_idx]
+                    for img_idx, _, _ in items
+                    for _ in range(num_objs_per_image[img_idx])
+                ],
+                device=self.device,
+            )
+            concat_points = None
+            if num_tokens is not None:
+                concat_points = (
+                    torch.cat([points[0] for _, points, _ in items], dim=0),
+                    torch.cat([points[1] for _, points, _ in items], dim=0),
+                )
+            mask_input = None
+            if has_mask:
+                mask_input = torch.cat([mask for _, _, mask in items], dim=0)
+            sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
+                points=concat_points,
+                boxes=None,
+                masks=mask_input,
+            )
+            num_objs = feat_inds.size(0)
+            if sparse_embeddings.size(0) != num_objs:
+                # the prompt encoder gives a batch size of 1 without points or masks
+                sparse_embeddings = sparse_embeddings.expand(num_objs, -1, -1)
+                dense_embeddings = dense_embeddings.expand(num_objs, -1, -1, -1)
+
+            # Each object attends to its own image's features
+            high_res_features = [
+                feat_level[feat_inds] for feat_level in self._features["high_res_feats"]
+            ]
+            low_res_masks, iou_predictions, _, _ = self.model.sam_mask_decoder(
+                image_embeddings=self._features["image_embed"][feat_inds],
+                image_pe=image_pe,
+                sparse_prompt_embeddings=sparse_embeddings,
+                dense_prompt_embeddings=dense_embeddings,
+                multimask_output=multimask_output,
+                repeat_image=False,
+                high_res_features=high_res_features,
+            )
+            start = 0
+            for img_idx, _, _ in items:
+                end = start + num_objs_per_image[img_idx]
+                low_res_masks_per_image[img_idx] = low_res_masks[start:end]
+                iou_predictions_per_image[img_idx] = iou_predictions[start:end]
+                start = end
+
+        outputs = []
+        for img_idx, low_res_masks in enumerate(low_res_masks_per_image):
+            # Upscale the masks to the original image resolution
+            masks = self._transforms.postprocess_masks(
+                low_res_masks, self._orig_hw[img_inds[img_idx]]
+            )
+            low_res_masks = torch.clamp(low_res_masks, -32.0, 32.0)
+            if not return_logits:
+                masks = masks > self.mask_threshold
+            outputs.append((masks, iou_predictions_per_image[img_idx], low_res_masks))
+        return outputs
+
     @torch.no_grad()
     def _predict(
         self,
@@ -343,6 +681,7 @@ class SAM2ImagePredictor:
         multimask_output: bool = True,
         return_logits: bool = False,
         img_idx: int = -1,
+        upscale_masks: bool = True,
     ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
         """
         Predict masks for the given input prompts, using the currently set image.
@@ -369,6 +708,9 @@ class SAM2ImagePredictor:
             input prompts, multimask_output=False can give better results.
           return_logits (bool): If true, returns un-thresholded masks logits
             instead of a binary mask.
+          upscale_masks (bool): If false, the first output holds the raw low
+            resolution mask logits (H=W=256) instead of the post-processed masks at the
+            original image size, e.g. to filter the masks before upscaling them.
 
         Returns:
           (torch.Tensor): The output masks in BxCxHxW format, where C is the
@@ -384,24 +726,8 @@ class SAM2ImagePredictor:
                 "An image must be set with .set_image(...) before mask prediction."
             )
 
-        if point_coords is not None:
-            concat_points = (point_coords, point_labels)
-        else:
-            concat_points = None
-
         # Embed prompts
-        if boxes is not None:
-            box_coords = boxes.reshape(-1, 2, 2)
-            box_labels = torch.tensor([[2, 3]], dtype=torch.int, device=boxes.device)
-            box_labels = box_labels.repeat(boxes.size(0), 1)
-            # we merge "boxes" and "points" into a single "concat_points" input (where
-            # boxes are added at the beginning) to sam_prompt_encoder
-            if concat_points is not None:
-                concat_coords = torch.cat([box_coords, concat_points[0]], dim=1)
-                concat_labels = torch.cat([box_labels, concat_points[1]], dim=1)
-                concat_points = (concat_coords, concat_labels)
-            else:
-                concat_points = (box_coords, box_labels)
+        concat_points = self._get_concat_points(point_coords, point_labels, boxes)
 
         sparse_embeddings, dense_embeddings = self.model.sam_prompt_encoder(
             points=concat_points,
@@ -427,6 +753,10 @@ class SAM2ImagePredictor:
             high_res_features=high_res_features,
         )
 
+        if not upscale_masks:
+            clamped_masks = torch.clamp(low_res_masks, -32.0, 32.0)
+            return low_res_masks, iou_predictions, clamped_masks
+
         # Upscale the masks to the original image resolution
         masks = self._transforms.postprocess_masks(
             low_res_masks, self._orig_hw[img_idx]
@@ -464,3 +794,6 @@ class SAM2ImagePredictor:
         self._features = None
         self._orig_hw = None
         self._is_batch = False
+        self._tile_boxes = None
+        self._tiled_hw = None
+        self._tile_overlap = 0
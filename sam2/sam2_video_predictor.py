@@ -7,11 +7,28 @@
 import warnings
 from collections import OrderedDict
 
+import numpy as np
 import torch
 from tqdm import tqdm
 
+from sam2.modeling.memory_attention import MemoryKVCache
 from sam2.modeling.sam2_base import NO_OBJ_SCORE, SAM2Base
-from sam2.utils.misc import concat_points, fill_holes_in_mask_scores, load_video_frames
+from sam2.utils.misc import (
+    AsyncMaskPacker,
+    concat_points,
+    fill_holes_in_mask_scores,
+    get_video_frame_paths,
+    LazyVideoResMasks,
+    load_video_frames,
+    maybe_dequantize,
+    maybe_quantize,
+    QuantizedTensor,
+)
+from sam2.utils.tiered_storage import (
+    FrameOutputsObjectSlice,
+    slice_frame_output,
+    TieredFrameOutputs,
+)
 
 
 class SAM2VideoPredictor(SAM2Base):
@@ -43,12 +60,18 @@ class SAM2VideoPredictor(SAM2Base):
             offload_video_to_cpu=False,
             offload_state_to_cpu=False,
             async_loading_frames=False,
+            memory_quantization=None,
+            spill_dir=None,
+            state_gpu_window=16,
+            state_cpu_window=64,
+            cache_memory_kv=False,
     ):
         """Initialize an inference state."""
         compute_device = self.device  # device of the model
+        img_paths = get_video_frame_paths(video_path, frame_paths)
         images, video_height, video_width = load_video_frames(
             video_path=video_path,
-            frame_paths=frame_paths,
+            frame_paths=img_paths,
             image_size=self.image_size,
             offload_video_to_cpu=offload_video_to_cpu,
             async_loading_frames=async_loading_frames,
@@ -57,6 +80,8 @@ class SAM2VideoPredictor(SAM2Base):
         inference_state = {}
         inference_state["images"] = images
         inference_state["num_frames"] = len(images)
+        # the paths of the original frames (e.g. to read them at the video resolution)
+        inference_state["img_paths"] = img_paths
         # whether to offload the video frames to CPU memory
         # turning on this option saves the GPU memory with only a very small overhead
         inference_state["offload_video_to_cpu"] = offload_video_to_cpu
@@ -65,6 +90,19 @@ class SAM2VideoPredictor(SAM2Base):
         # (e.g. in a test case of 768x768 model, fps dropped from 27 to 24 when tracking one object
         # and from 24 to 21 when tracking two objects)
         inference_state["offload_state_to_cpu"] = offload_state_to_cpu
+        # optionally store the memory features and mask logits of tracked frames in
+        # "int8" or "fp8" (with per-channel scales) instead of bfloat16 and float32; this
+        # is mostly useful for long sessions together with `offload_state_to_cpu=True`
+        if memory_quantization not in (None, "int8", "fp8"):
+            raise ValueError(
+                f"memory_quantization must be None, 'int8' or 'fp8', got {memory_quantization}"
+            )
+        inference_state["memory_quantization"] = memory_quantization
+        # optionally cache the projected keys and values of the memories in memory
+        # attention, so that each tracked frame only projects its newly added memory
+        # (this holds the projections of all memories in the attention window, i.e. a
+        # few hundred MB per object for 1024x1024 models, on the compute device)
+        inference_state["memory_kv_cache"] = MemoryKVCache() if cache_memory_kv else None
         # the original video height and width, used for resizing final output scores
         inference_state["video_height"] = video_height
         inference_state["video_width"] = video_width
@@ -89,6 +127,17 @@ class SAM2VideoPredictor(SAM2Base):
             "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
             "non_cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
         }
+        # optionally, use a tiered storage for the non-conditioning frame outputs, which
+        # keeps the last `state_gpu_window` frames on the storage device and the next
+        # `state_cpu_window` frames in pinned CPU memory, and spills everything older to
+        # memory-mapped files under `spill_dir` (for arbitrarily long videos)
+        if spill_dir is not None:
+            inference_state["output_dict"]["non_cond_frame_outputs"] = TieredFrameOutputs(
+                spill_dir=spill_dir,
+                compute_device=compute_device,
+                gpu_window=state_gpu_window,
+                cpu_window=state_cpu_window,
+            )
         # Slice (view) of each object tracking results, sharing the same memory with "output_dict"
         inference_state["output_dict_per_obj"] = {}
         # A temporary storage to hold new outputs when user interact with a frame
@@ -146,6 +195,12 @@ class SAM2VideoPredictor(SAM2Base):
                 "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
                 "non_cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
             }
+            non_cond_frame_outputs = inference_state["output_dict"]["non_cond_frame_outputs"]
+            if isinstance(non_cond_frame_outputs, TieredFrameOutputs):
+                # per-object outputs are sliced on the fly from the tiered storage
+                inference_state["output_dict_per_obj"][obj_idx][
+                    "non_cond_frame_outputs"
+                ] = FrameOutputsObjectSlice(non_cond_frame_outputs, obj_idx)
             inference_state["temp_output_dict_per_obj"][obj_idx] = {
                 "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
                 "non_cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
@@ -274,7 +329,7 @@ class SAM2VideoPredictor(SAM2Base):
 
         if prev_out is not None and prev_out["pred_masks"] is not None:
             device = inference_state["device"]
-            prev_sam_mask_logits = prev_out["pred_masks"].to(device, non_blocking=True)
+            prev_sam_mask_logits = maybe_dequantize(prev_out["pred_masks"], device)
             # Clamp the scale of prev_sam_mask_logits to avoid rare numerical issues.
             prev_sam_mask_logits = torch.clamp(prev_sam_mask_logits, -32.0, 32.0)
         current_out, _ = self._run_single_frame_inference(
@@ -314,6 +369,105 @@ class SAM2VideoPredictor(SAM2Base):
         """Deprecated method. Please use `add_new_points_or_box` instead."""
         return self.add_new_points_or_box(*args, **kwargs)
 
+    @torch.inference_mode()
+    def add_new_boxes(
+            self,
+            inference_state,
+            frame_idx,
+            obj_ids,
+            boxes,
+            normalize_coords=True,
+    ):
+        """
+        Add a box prompt for each of several objects on a frame at once. On a frame
+        that hasn't been tracked before, the boxes of all objects are encoded and
+        decoded in one batched call (box prompts already use the single-mask output
+        of the decoder) and the outputs of all objects are consolidated once, instead
+        of calling `add_new_points_or_box` for one object at a time.
+        """
+        if not isinstance(boxes, torch.Tensor):
+            boxes = torch.tensor(np.asarray(boxes), dtype=torch.float32)
+        boxes = boxes.float().reshape(-1, 4)
+        obj_ids = list(obj_ids)
+        if len(obj_ids) != boxes.size(0):
+            raise ValueError("obj_ids and boxes must have the same length")
+        if len(obj_ids) == 0:
+            raise ValueError("at least one box must be provided as input")
+
+        obj_inds = [self._obj_id_to_idx(inference_state, obj_id) for obj_id in obj_ids]
+        is_init_cond_frame = frame_idx not in inference_state["frames_already_tracked"]
+        temp_output_dict_per_obj = inference_state["temp_output_dict_per_obj"]
+        has_prev_out = any(
+            frame_idx in temp_output_dict_per_obj[obj_idx][storage_key]
+            for obj_idx in obj_inds
+            for storage_key in ["cond_frame_outputs", "non_cond_frame_outputs"]
+        )
+        if not is_init_cond_frame or has_prev_out:
+            # refining tracked (or already prompted) objects is conditioned on each
+            # object's own memory and previous mask, so add their boxes one by one
+            for obj_id, box in zip(obj_ids, boxes):
+                out = self.add_new_points_or_box(
+                    inference_state,
+                    frame_idx,
+                    obj_id,
+                    normalize_coords=normalize_coords,
+                    box=box,
+                )
+            return out
+
+        # The boxes are added as the first two points with labels 2 and 3 (consistent
+        # with how SAM 2 is trained)
+        points = boxes.reshape(-1, 2, 2)
+        labels = torch.tensor([[2, 3]], dtype=torch.int32).repeat(points.size(0), 1)
+        if normalize_coords:
+            video_H = inference_state["video_height"]
+            video_W = inference_state["video_width"]
+            points = points / torch.tensor([video_W, video_H]).to(points.device)
+        # scale the (normalized) coordinates by the model's internal image size
+        points = points * self.image_size
+        points = points.to(inference_state["device"])
+        labels = labels.to(inference_state["device"])
+        for i, obj_idx in enumerate(obj_inds):
+            inference_state["point_inputs_per_obj"][obj_idx][frame_idx] = concat_points(
+                None, points[i : i + 1], labels[i : i + 1]
+            )
+            inference_state["mask_inputs_per_obj"][obj_idx].pop(frame_idx, None)
+
+        # Run all the objects in one batch on this initial conditioning frame (which
+        # doesn't use any memory from other frames)
+        current_out, _ = self._run_single_frame_inference(
+            inference_state=inference_state,
+            output_dict=inference_state["output_dict"],
+            frame_idx=frame_idx,
+            batch_size=len(obj_inds),
+            is_init_cond_frame=True,
+            point_inputs=concat_points(None, points, labels),
+            mask_inputs=None,
+            reverse=False,
+            # the memory encoder runs once for all objects in `propagate_in_video`
+            run_mem_encoder=False,
+        )
+        # Add each object's slice of the output to its temporary outputs
+        for i, obj_idx in enumerate(obj_inds):
+            obj_temp_output_dict = temp_output_dict_per_obj[obj_idx]
+            obj_temp_output_dict["cond_frame_outputs"][frame_idx] = slice_frame_output(
+                current_out, i
+            )
+
+        # Resize the output mask to the original video resolution
+        obj_ids = inference_state["obj_ids"]
+        consolidated_out = self._consolidate_temp_output_across_obj(
+            inference_state,
+            frame_idx,
+            is_cond=True,
+            run_mem_encoder=False,
+            consolidate_at_video_res=True,
+        )
+        _, video_res_masks = self._get_orig_video_res_output(
+            inference_state, consolidated_out["pred_masks_video_res"]
+        )
+        return frame_idx, obj_ids, video_res_masks
+
     @torch.inference_mode()
     def add_new_mask(
             self,
@@ -406,7 +560,7 @@ class SAM2VideoPredictor(SAM2Base):
         device = inference_state["device"]
         video_H = inference_state["video_height"]
         video_W = inference_state["video_width"]
-        any_res_masks = any_res_masks.to(device, non_blocking=True)
+        any_res_masks = maybe_dequantize(any_res_masks, device)
         if any_res_masks.shape[-2:] == (video_H, video_W):
             video_res_masks = any_res_masks
         else:
@@ -420,6 +574,19 @@ class SAM2VideoPredictor(SAM2Base):
             video_res_masks = self._apply_non_overlapping_constraints(video_res_masks)
         return any_res_masks, video_res_masks
 
+    def _get_lazy_video_res_output(self, inference_state, any_res_masks):
+        """
+        Wrap the object scores into a handle that resizes them to the original video
+        resolution (and applies non-overlapping constraints) only when requested.
+        """
+        device = inference_state["device"]
+        return LazyVideoResMasks(
+            low_res_masks=maybe_dequantize(any_res_masks, device),
+            video_height=inference_state["video_height"],
+            video_width=inference_state["video_width"],
+            non_overlap_masks=self.non_overlap_masks,
+        )
+
     def _consolidate_temp_output_across_obj(
             self,
             inference_state,
@@ -499,8 +666,8 @@ class SAM2VideoPredictor(SAM2Base):
                     consolidated_out["obj_ptr"][obj_idx: obj_idx + 1] = empty_mask_ptr
                 continue
             # Add the temporary object output mask to consolidated output mask
-            obj_mask = out["pred_masks"]
             consolidated_pred_masks = consolidated_out[consolidated_mask_key]
+            obj_mask = maybe_dequantize(out["pred_masks"], consolidated_pred_masks.device)
             if obj_mask.shape[-2:] == consolidated_pred_masks.shape[-2:]:
                 consolidated_pred_masks[obj_idx: obj_idx + 1] = obj_mask
             else:
@@ -623,7 +790,9 @@ class SAM2VideoPredictor(SAM2Base):
         # edge case: if an output is added to "cond_frame_outputs", we remove any prior
         # output on the same frame in "non_cond_frame_outputs"
         for frame_idx in output_dict["cond_frame_outputs"]:
-            output_dict["non_cond_frame_outputs"].pop(frame_idx, None)
+            # (deleted rather than popped, so that a spilled output isn't read back)
+            if frame_idx in output_dict["non_cond_frame_outputs"]:
+                del output_dict["non_cond_frame_outputs"][frame_idx]
         for obj_output_dict in inference_state["output_dict_per_obj"].values():
             for frame_idx in obj_output_dict["cond_frame_outputs"]:
                 obj_output_dict["non_cond_frame_outputs"].pop(frame_idx, None)
@@ -651,9 +820,21 @@ class SAM2VideoPredictor(SAM2Base):
             start_frame_idx=None,
             max_frame_num_to_track=None,
             reverse=False,
-            isSingle=False
+            isSingle=False,
+            # whether to output binary masks as numpy arrays instead of mask logits on device;
+            # the masks are thresholded and bit-packed on device and copied to the host on a
+            # side stream, so each frame is yielded one step late to overlap compute and transfer
+            async_mask_output=False,
+            # threshold on the mask logits (only relevant when `async_mask_output=True`)
+            score_thresh=0.0,
+            # whether to output a `LazyVideoResMasks` handle on the low-res mask logits
+            # instead of the video-resolution mask logits (so that the consumer only pays
+            # for the upsampling it needs, e.g. uint8 masks via `.masks()` or `.boxes()`)
+            lazy_video_res=False,
     ):
         """Propagate the input points across frames to track in the entire video."""
+        if async_mask_output and lazy_video_res:
+            raise ValueError("async_mask_output and lazy_video_res cannot be used together")
         self.propagate_in_video_preflight(inference_state)
 
         output_dict = inference_state["output_dict"]
@@ -687,8 +868,14 @@ class SAM2VideoPredictor(SAM2Base):
             processing_order = range(start_frame_idx, end_frame_idx + 1)
 
         frame_iter = processing_order if isSingle else tqdm(processing_order, desc="propagate in video")
+        mask_packer = None
+        if async_mask_output:
+            mask_packer = AsyncMaskPacker(inference_state["device"], score_thresh)
 
         for frame_idx in frame_iter:
+            if isinstance(output_dict["non_cond_frame_outputs"], TieredFrameOutputs):
+                # load the memory frames of this and the next frame back from disk
+                self._prefetch_memory_frames(inference_state, frame_idx, reverse)
             if frame_idx in consolidated_frame_inds["cond_frame_outputs"]:
                 storage_key = "cond_frame_outputs"
                 current_out = output_dict[storage_key][frame_idx]
@@ -717,8 +904,36 @@ class SAM2VideoPredictor(SAM2Base):
             self._add_output_per_object(inference_state, frame_idx, current_out, storage_key)
             inference_state["frames_already_tracked"][frame_idx] = {"reverse": reverse}
 
+            if lazy_video_res:
+                yield frame_idx, obj_ids, self._get_lazy_video_res_output(
+                    inference_state, pred_masks
+                )
+                continue
             _, video_res_masks = self._get_orig_video_res_output(inference_state, pred_masks)
-            yield frame_idx, obj_ids, video_res_masks
+            if mask_packer is None:
+                yield frame_idx, obj_ids, video_res_masks
+            else:
+                ready = mask_packer.submit(frame_idx, video_res_masks)
+                if ready is not None:
+                    yield ready[0], obj_ids, ready[1]
+
+        # output the frames that are still in flight
+        if mask_packer is not None:
+            for out_frame_idx, out_masks in mask_packer.flush():
+                yield out_frame_idx, obj_ids, out_masks
+
+    def _prefetch_memory_frames(self, inference_state, frame_idx, reverse):
+        """
+        Prefetch the non-conditioning frame outputs that the memory attention will
+        look up on `frame_idx` and the next frame from a tiered storage (i.e. the memory
+        frames and object pointers before them, or after them when tracking in reverse).
+        """
+        r = self.memory_temporal_stride_for_eval
+        num_ptrs = self.max_obj_ptrs_in_encoder if self.use_obj_ptrs_in_encoder else 0
+        max_t_diff = max(r * self.num_maskmem, num_ptrs) + 1
+        step = 1 if reverse else -1
+        frame_inds = [frame_idx + step * t_diff for t_diff in range(max_t_diff)]
+        inference_state["output_dict"]["non_cond_frame_outputs"].prefetch(frame_inds)
 
     def _add_output_per_object(
             self, inference_state, frame_idx, current_out, storage_key
@@ -728,24 +943,16 @@ class SAM2VideoPredictor(SAM2Base):
         `output_dict_per_obj`. The resulting slices share the same tensor storage.
         """
         maskmem_features = current_out["maskmem_features"]
-        assert maskmem_features is None or isinstance(maskmem_features, torch.Tensor)
+        assert maskmem_features is None or isinstance(
+            maskmem_features, (torch.Tensor, QuantizedTensor)
+        )
 
         maskmem_pos_enc = current_out["maskmem_pos_enc"]
         assert maskmem_pos_enc is None or isinstance(maskmem_pos_enc, list)
 
         output_dict_per_obj = inference_state["output_dict_per_obj"]
         for obj_idx, obj_output_dict in output_dict_per_obj.items():
-            obj_slice = slice(obj_idx, obj_idx + 1)
-            obj_out = {
-                "maskmem_features": None,
-                "maskmem_pos_enc": None,
-                "pred_masks": current_out["pred_masks"][obj_slice],
-                "obj_ptr": current_out["obj_ptr"][obj_slice],
-            }
-            if maskmem_features is not None:
-                obj_out["maskmem_features"] = maskmem_features[obj_slice]
-            if maskmem_pos_enc is not None:
-                obj_out["maskmem_pos_enc"] = [x[obj_slice] for x in maskmem_pos_enc]
+            obj_out = slice_frame_output(current_out, obj_idx)
             obj_output_dict[storage_key][frame_idx] = obj_out
 
     @torch.inference_mode()
@@ -784,6 +991,8 @@ class SAM2VideoPredictor(SAM2Base):
         inference_state["consolidated_frame_inds"]["non_cond_frame_outputs"].clear()
         inference_state["tracking_has_started"] = False
         inference_state["frames_already_tracked"].clear()
+        if inference_state.get("memory_kv_cache") is not None:
+            inference_state["memory_kv_cache"].clear()
 
     def _get_image_feature(self, inference_state, frame_idx, batch_size):
         """Compute the image features on a given frame."""
@@ -856,13 +1065,16 @@ class SAM2VideoPredictor(SAM2Base):
             track_in_reverse=reverse,
             run_mem_encoder=run_mem_encoder,
             prev_sam_mask_logits=prev_sam_mask_logits,
+            memory_kv_cache=inference_state.get("memory_kv_cache"),
         )
 
         # optionally offload the output to CPU memory to save GPU space
         storage_device = inference_state["storage_device"]
+        memory_quantization = inference_state.get("memory_quantization")
         maskmem_features = current_out["maskmem_features"]
         if maskmem_features is not None:
             maskmem_features = maskmem_features.to(torch.bfloat16)
+            maskmem_features = maybe_quantize(maskmem_features, memory_quantization)
             maskmem_features = maskmem_features.to(storage_device, non_blocking=True)
         pred_masks_gpu = current_out["pred_masks"]
         # potentially fill holes in the predicted masks
@@ -870,7 +1082,12 @@ class SAM2VideoPredictor(SAM2Base):
             pred_masks_gpu = fill_holes_in_mask_scores(
                 pred_masks_gpu, self.fill_hole_area
             )
-        pred_masks = pred_masks_gpu.to(storage_device, non_blocking=True)
+        pred_masks = pred_masks_gpu
+        if run_mem_encoder:
+            # only quantize the masks of tracked frames (the outputs from user clicks are
+            # temporary and later consolidated into the conditioning frame memory)
+            pred_masks = maybe_quantize(pred_masks, memory_quantization)
+        pred_masks = pred_masks.to(storage_device, non_blocking=True)
         # "maskmem_pos_enc" is the same across frames, so we only need to store one copy of it
         maskmem_pos_enc = self._get_maskmem_pos_enc(inference_state, current_out)
         # object pointer is a small tensor, so we always keep it on GPU memory for fast access
@@ -906,6 +1123,9 @@ class SAM2VideoPredictor(SAM2Base):
         # optionally offload the output to CPU memory to save GPU space
         storage_device = inference_state["storage_device"]
         maskmem_features = maskmem_features.to(torch.bfloat16)
+        maskmem_features = maybe_quantize(
+            maskmem_features, inference_state.get("memory_quantization")
+        )
         maskmem_features = maskmem_features.to(storage_device, non_blocking=True)
         # "maskmem_pos_enc" is the same across frames, so we only need to store one copy of it
         maskmem_pos_enc = self._get_maskmem_pos_enc(
@@ -953,6 +1173,7 @@ class SAM2VideoPredictor(SAM2Base):
         output_dict = inference_state["output_dict"]
         non_cond_frame_outputs = output_dict["non_cond_frame_outputs"]
         for t in range(frame_idx_begin, frame_idx_end + 1):
-            non_cond_frame_outputs.pop(t, None)
+            if t in non_cond_frame_outputs:
+                del non_cond_frame_outputs[t]
             for obj_output_dict in inference_state["output_dict_per_obj"].values():
                 obj_output_dict["non_cond_frame_outputs"].pop(t, None)
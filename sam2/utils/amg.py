@@ -7,11 +7,13 @@
 import math
 from copy import deepcopy
 from itertools import product
-from typing import Any, Dict, Generator, ItemsView, List, Tuple
+from typing import Any, Dict, Generator, ItemsView, List, Optional, Tuple
 
 import numpy as np
 import torch
 
+from sam2.utils.misc import get_opencv_executor
+
 # Very lightly adapted from https://github.com/facebookresearch/segment-anything/blob/main/segment_anything/utils/amg.py
 
 
@@ -19,62 +21,137 @@ class MaskData:
     """
     A structure for storing masks and their related data in batched format.
     Implements basic filtering and concatenation.
+
+    The data is stored column by column: tensors and numpy arrays are appended into
+    buffers that grow by doubling their capacity, and RLEs are kept as `FlatRLE`s, so
+    concatenating many batches doesn't copy the accumulated data again and again.
+    Filtering only records the indices to keep, which are applied to all columns at
+    once when the data is accessed next.
     """
 
     def __init__(self, **kwargs) -> None:
-        for v in kwargs.values():
-            assert isinstance(
-                v, (list, np.ndarray, torch.Tensor)
-            ), "MaskData only supports list, numpy arrays, and torch tensors."
-        self._stats = dict(**kwargs)
+        self._stats = {}
+        # the number of valid rows of each tensor or numpy array buffer
+        self._lens = {}
+        # indices (into the current rows) of the rows kept by pending filters
+        self._keep = None
+        for k, v in kwargs.items():
+            self[k] = v
 
     def __setitem__(self, key: str, item: Any) -> None:
         assert isinstance(
-            item, (list, np.ndarray, torch.Tensor)
-        ), "MaskData only supports list, numpy arrays, and torch tensors."
+            item, (list, np.ndarray, torch.Tensor, FlatRLE)
+        ), "MaskData only supports list, numpy arrays, torch tensors and FlatRLE."
+        self._apply_keep()
         self._stats[key] = item
+        self._lens[key] = len(item)
 
     def __delitem__(self, key: str) -> None:
         del self._stats[key]
+        del self._lens[key]
 
     def __getitem__(self, key: str) -> Any:
-        return self._stats[key]
+        self._apply_keep()
+        v = self._stats[key]
+        if isinstance(v, (torch.Tensor, np.ndarray)):
+            return v[: self._lens[key]]
+        if isinstance(v, _FlatRLEChunks):
+            v = FlatRLE.cat(v)
+            self._stats[key] = v
+        return v
 
     def items(self) -> ItemsView[str, Any]:
-        return self._stats.items()
+        return {k: self[k] for k in self._stats}.items()
 
     def filter(self, keep: torch.Tensor) -> None:
+        if isinstance(keep, torch.Tensor):
+            keep = keep.detach().cpu().numpy()
+        keep = np.asarray(keep)
+        if keep.dtype == bool:
+            keep = np.flatnonzero(keep)
+        keep = keep.astype(np.int64, copy=False)
+        # compose with any pending filter (applied lazily in `_apply_keep`)
+        self._keep = keep if self._keep is None else self._keep[keep]
+
+    def _apply_keep(self) -> None:
+        if self._keep is None:
+            return
+        keep, self._keep = self._keep, None
         for k, v in self._stats.items():
             if v is None:
-                self._stats[k] = None
+                continue
             elif isinstance(v, torch.Tensor):
-                self._stats[k] = v[torch.as_tensor(keep, device=v.device)]
+                v = v[: self._lens[k]][torch.as_tensor(keep, device=v.device)]
             elif isinstance(v, np.ndarray):
-                self._stats[k] = v[keep.detach().cpu().numpy()]
-            elif isinstance(v, list) and keep.dtype == torch.bool:
-                self._stats[k] = [a for i, a in enumerate(v) if keep[i]]
+                v = v[: self._lens[k]][keep]
+            elif isinstance(v, _FlatRLEChunks):
+                v = FlatRLE.cat(v).index(keep)
+            elif isinstance(v, FlatRLE):
+                v = v.index(keep)
             elif isinstance(v, list):
-                self._stats[k] = [v[i] for i in keep]
+                v = [v[i] for i in keep]
             else:
                 raise TypeError(f"MaskData key {k} has an unsupported type {type(v)}.")
+            self._stats[k] = v
+            self._lens[k] = len(keep)
 
     def cat(self, new_stats: "MaskData") -> None:
+        self._apply_keep()
         for k, v in new_stats.items():
             if k not in self._stats or self._stats[k] is None:
-                self._stats[k] = deepcopy(v)
-            elif isinstance(v, torch.Tensor):
-                self._stats[k] = torch.cat([self._stats[k], v], dim=0)
-            elif isinstance(v, np.ndarray):
-                self._stats[k] = np.concatenate([self._stats[k], v], axis=0)
+                if isinstance(v, torch.Tensor):
+                    self._stats[k] = v.clone()
+                elif isinstance(v, np.ndarray):
+                    self._stats[k] = v.copy()
+                else:
+                    self._stats[k] = deepcopy(v)
+                self._lens[k] = None if v is None else len(v)
+            elif isinstance(v, (torch.Tensor, np.ndarray)):
+                self._append(k, v)
+            elif isinstance(v, FlatRLE):
+                chunks = self._stats[k]
+                if not isinstance(chunks, _FlatRLEChunks):
+                    chunks = _FlatRLEChunks([chunks])
+                chunks.append(v)
+                self._stats[k] = chunks
+                self._lens[k] += len(v)
             elif isinstance(v, list):
                 self._stats[k] = self._stats[k] + deepcopy(v)
+                self._lens[k] += len(v)
             else:
                 raise TypeError(f"MaskData key {k} has an unsupported type {type(v)}.")
 
+    def _append(self, key: str, v: Any) -> None:
+        """Append rows to a tensor or numpy array buffer, doubling its capacity."""
+        buf, n = self._stats[key], self._lens[key]
+        new_len = n + len(v)
+        if isinstance(v, torch.Tensor):
+            dtype = torch.promote_types(buf.dtype, v.dtype)
+            if new_len > buf.shape[0] or dtype != buf.dtype:
+                capacity = max(new_len, 2 * buf.shape[0])
+                new_buf = buf.new_empty((capacity, *buf.shape[1:]), dtype=dtype)
+                new_buf[:n] = buf[:n]
+                buf = new_buf
+            buf[n:new_len] = v.to(buf.device)
+        else:
+            dtype = np.promote_types(buf.dtype, v.dtype)
+            if new_len > buf.shape[0] or dtype != buf.dtype:
+                capacity = max(new_len, 2 * buf.shape[0])
+                new_buf = np.empty((capacity, *buf.shape[1:]), dtype=dtype)
+                new_buf[:n] = buf[:n]
+                buf = new_buf
+            buf[n:new_len] = v
+        self._stats[key] = buf
+        self._lens[key] = new_len
+
     def to_numpy(self) -> None:
-        for k, v in self._stats.items():
+        for k, v in self.items():
             if isinstance(v, torch.Tensor):
-                self._stats[k] = v.float().detach().cpu().numpy()
+                self[k] = v.float().detach().cpu().numpy()
+
+
+class _FlatRLEChunks(list):
+    """The `FlatRLE`s appended to a `MaskData` column, concatenated on access."""
 
 
 def is_box_near_crop_edge(
@@ -106,53 +183,281 @@ def batch_iterator(batch_size: int, *args) -> Generator[List[Any], None, None]:
         yield [arg[b * batch_size : (b + 1) * batch_size] for arg in args]
 
 
+class FlatRLE:
+    """
+    A batch of uncompressed RLEs of masks with the same size, in the format of pycoco
+    tools (i.e. run lengths over the Fortran-order pixels, starting with background),
+    stored as a flat int32 array of all run lengths with per-mask offsets. The masks
+    are encoded, decoded, filtered and converted to COCO compressed RLEs all at once,
+    without looping over the masks (or runs) in Python.
+    """
+
+    def __init__(self, counts: np.ndarray, offsets: np.ndarray, size: List[int]):
+        # run lengths of the i-th mask are `counts[offsets[i] : offsets[i + 1]]`
+        self.counts = np.asarray(counts, dtype=np.int32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.size = [int(size[0]), int(size[1])]  # [h, w]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        """Get the i-th RLE in the pycoco tools format (i.e. a dict)."""
+        counts = self.counts[self.offsets[i] : self.offsets[i + 1]].tolist()
+        return {"size": list(self.size), "counts": counts}
+
+    @classmethod
+    def empty(cls, size: List[int]) -> "FlatRLE":
+        return cls(np.zeros(0, np.int32), np.zeros(1, np.int64), size)
+
+    @classmethod
+    def from_masks(
+        cls,
+        masks: torch.Tensor,
+        crop_box: Optional[List[int]] = None,
+        orig_size: Optional[Tuple[int, int]] = None,
+    ) -> "FlatRLE":
+        """
+        Encode a BxHxW batch of binary masks (e.g. on GPU) in one pass. If `crop_box`
+        and `orig_size` are given, the masks are in the frame of the crop `crop_box`
+        (XYXY) of an image of size `orig_size` (h, w), and are encoded as masks of the
+        whole image, without padding each of them to the image size first.
+        """
+        b, h, w = masks.shape
+        x0, y0 = (0, 0) if crop_box is None else crop_box[:2]
+        out_h, out_w = (h, w) if orig_size is None else orig_size
+        if b == 0:
+            return cls.empty([out_h, out_w])
+        device = masks.device
+
+        if (out_h, out_w) == (h, w):
+            # Put in fortran order and flatten h,w
+            flat = masks.permute(0, 2, 1).flatten(1).bool()
+            # The (mask, pixel) indices where a new run starts, sorted by mask then pixel
+            rows, cols = (flat[:, 1:] ^ flat[:, :-1]).nonzero(as_tuple=True)
+            cols = cols + 1
+            lead = flat[:, 0]
+        else:
+            # Pad each crop column with background above and below, so the changes
+            # within each column are all the changes of the mask in that column, and
+            # place them at their Fortran-order pixel indices in the whole image
+            columns = masks.permute(0, 2, 1).bool()
+            background = columns.new_zeros(b, w, 1)
+            columns = torch.cat([background, columns, background], dim=2)
+            rows, x, y = (columns[..., 1:] ^ columns[..., :-1]).nonzero(as_tuple=True)
+            cols = (x + x0) * out_h + (y + y0)
+            # With full-height crops, a column ending with foreground followed by one
+            # starting with foreground gives the same change twice, which cancel out
+            dup = (cols[1:] == cols[:-1]) & (rows[1:] == rows[:-1])
+            keep = torch.ones_like(cols, dtype=torch.bool)
+            keep[1:] &= ~dup
+            keep[:-1] &= ~dup
+            # a change at the first pixel means the mask starts with foreground, and
+            # the end of the last run is implicit
+            keep &= (cols > 0) & (cols < out_h * out_w)
+            rows, cols = rows[keep], cols[keep]
+            if x0 == 0 and y0 == 0:
+                lead = masks[:, 0, 0].bool()
+            else:
+                lead = torch.zeros(b, dtype=torch.bool, device=device)
+
+        num_changes = torch.bincount(rows, minlength=b)
+        num_runs = num_changes + 1
+        run_offsets = torch.cumsum(num_runs, dim=0) - num_runs
+        change_offsets = torch.cumsum(num_changes, dim=0) - num_changes
+        # each change ends the run at `pos` and starts the run at `pos + 1`
+        rank = torch.arange(rows.numel(), device=device) - change_offsets[rows]
+        pos = run_offsets[rows] + rank
+        total_runs = rows.numel() + b
+        run_ends = torch.full(
+            (total_runs,), out_h * out_w, dtype=torch.long, device=device
+        )
+        run_ends[pos] = cols
+        run_starts = torch.zeros(total_runs, dtype=torch.long, device=device)
+        run_starts[pos + 1] = cols
+        run_lengths = (run_ends - run_starts).cpu().numpy()
+        num_runs = num_runs.cpu().numpy()
+        # the counts start with background, so masks starting with foreground get a 0
+        lead = lead.cpu().numpy().astype(np.int64)
+
+        num_counts = num_runs + lead
+        offsets = np.zeros(b + 1, dtype=np.int64)
+        np.cumsum(num_counts, out=offsets[1:])
+        mask_of_run = np.repeat(np.arange(b), num_runs)
+        run_rank = np.arange(total_runs) - np.repeat(
+            np.cumsum(num_runs) - num_runs, num_runs
+        )
+        counts = np.zeros(offsets[-1], dtype=np.int32)
+        counts[offsets[mask_of_run] + lead[mask_of_run] + run_rank] = run_lengths
+        return cls(counts, offsets, [out_h, out_w])
+
+    @classmethod
+    def from_rles(cls, rles: List[Dict[str, Any]]) -> "FlatRLE":
+        """Build from a list of uncompressed RLEs (dicts) of the same size."""
+        if isinstance(rles, FlatRLE):
+            return rles
+        if len(rles) == 0:
+            return cls.empty([0, 0])
+        size = rles[0]["size"]
+        num_counts = [len(rle["counts"]) for rle in rles]
+        offsets = np.zeros(len(rles) + 1, dtype=np.int64)
+        np.cumsum(num_counts, out=offsets[1:])
+        counts = np.fromiter(
+            (c for rle in rles for c in rle["counts"]), np.int32, offsets[-1]
+        )
+        return cls(counts, offsets, size)
+
+    @staticmethod
+    def cat(rles_list: List["FlatRLE"]) -> "FlatRLE":
+        rles_list = [rles for rles in rles_list if len(rles) > 0] or rles_list[:1]
+        counts = np.concatenate([rles.counts for rles in rles_list])
+        offsets = [rles_list[0].offsets[:1]]
+        for rles in rles_list:
+            offsets.append(rles.offsets[1:] + offsets[-1][-1])
+        return FlatRLE(counts, np.concatenate(offsets), rles_list[0].size)
+
+    def num_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def _mask_of_count(self) -> np.ndarray:
+        return np.repeat(np.arange(len(self)), self.num_counts())
+
+    def _local_index(self) -> np.ndarray:
+        """The index of each count within its own RLE."""
+        num_counts = self.num_counts()
+        return np.arange(len(self.counts)) - np.repeat(self.offsets[:-1], num_counts)
+
+    def index(self, keep) -> "FlatRLE":
+        """Select the RLEs by a boolean mask or integer indices."""
+        if isinstance(keep, torch.Tensor):
+            keep = keep.detach().cpu().numpy()
+        keep = np.asarray(keep)
+        if keep.dtype == bool:
+            keep = np.flatnonzero(keep)
+        # (an empty list of indices is a float array otherwise)
+        keep = keep.astype(np.int64, copy=False)
+        num_counts = self.num_counts()[keep]
+        offsets = np.zeros(len(keep) + 1, dtype=np.int64)
+        np.cumsum(num_counts, out=offsets[1:])
+        src = np.arange(offsets[-1]) + np.repeat(
+            self.offsets[keep] - offsets[:-1], num_counts
+        )
+        return FlatRLE(self.counts[src], offsets, self.size)
+
+    def to_rles(self) -> List[Dict[str, Any]]:
+        """Convert to a list of uncompressed RLEs in the pycoco tools format."""
+        return [self[i] for i in range(len(self))]
+
+    def areas(self) -> np.ndarray:
+        """The foreground area (the sum of every other count) of each mask."""
+        is_fg = (self._local_index() % 2) == 1
+        return np.bincount(
+            self._mask_of_count()[is_fg],
+            weights=self.counts[is_fg],
+            minlength=len(self),
+        ).astype(np.int64)
+
+    def decode(self) -> np.ndarray:
+        """Decode all masks into an NxHxW boolean array."""
+        h, w = self.size
+        values = (self._local_index() % 2) == 1
+        masks = np.repeat(values, self.counts).reshape(len(self), w, h)
+        return masks.transpose(0, 2, 1)  # Put in C order
+
+    def to_coco(self) -> List[Dict[str, Any]]:
+        """
+        Convert to COCO compressed RLEs, i.e. the same as `coco_encode_rle` on each RLE
+        (with the counts string as in `pycocotools.mask.frPyObjects`).
+        """
+        # Each count (minus the count two places before it, after the first three)
+        # is written as 5-bit groups with a continuation bit, lowest bits first
+        counts = self.counts.astype(np.int64)
+        x = counts.copy()
+        has_delta = np.flatnonzero(self._local_index() > 2)
+        x[has_delta] -= counts[has_delta - 2]
+        chars, valid = [], []
+        active = np.ones(len(x), dtype=bool)
+        while active.any():
+            c = x & 0x1F
+            x = x >> 5
+            more = np.where((c & 0x10) != 0, x != -1, x != 0)
+            chars.append((c | (more * 0x20)) + 48)
+            valid.append(active)
+            active = active & more
+        if len(chars) > 0:
+            chars, valid = np.stack(chars, axis=1), np.stack(valid, axis=1)
+            data = chars[valid].astype(np.uint8).tobytes()
+            char_offsets = np.concatenate([[0], np.cumsum(valid.sum(1))])
+        else:
+            data, char_offsets = b"", np.zeros(1, dtype=np.int64)
+        char_offsets = char_offsets[self.offsets]
+        return [
+            {"size": list(self.size), "counts": data[start:end].decode("ascii")}
+            for start, end in zip(char_offsets[:-1], char_offsets[1:])
+        ]
+
+    @classmethod
+    def from_coco(cls, coco_rles: List[Dict[str, Any]]) -> "FlatRLE":
+        """Build from a list of COCO compressed RLEs of the same size."""
+        if len(coco_rles) == 0:
+            return cls.empty([0, 0])
+        strings = [rle["counts"] for rle in coco_rles]
+        strings = [s.encode("ascii") if isinstance(s, str) else s for s in strings]
+        chars = np.frombuffer(b"".join(strings), dtype=np.uint8).astype(np.int64) - 48
+        if len(chars) == 0:
+            offsets = np.zeros(len(coco_rles) + 1, dtype=np.int64)
+            return cls(np.zeros(0, np.int32), offsets, coco_rles[0]["size"])
+        string_offsets = np.concatenate([[0], np.cumsum([len(s) for s in strings])])
+
+        # each count ends at a char without the continuation bit
+        is_last = (chars & 0x20) == 0
+        is_first = np.concatenate([[True], is_last[:-1]])
+        count_starts = np.flatnonzero(is_first)
+        count_of_char = np.cumsum(is_first) - 1
+        shift = 5 * (np.arange(len(chars)) - count_starts[count_of_char])
+        x = np.add.reduceat((chars & 0x1F) << shift, count_starts)
+        # sign-extend the negative values
+        num_chars = np.bincount(count_of_char, minlength=len(count_starts))
+        is_neg = (chars[is_last] & 0x10) != 0
+        x[is_neg] -= np.left_shift(1, 5 * num_chars[is_neg])
+
+        last_cumsum = np.concatenate([[0], np.cumsum(is_last)])
+        offsets = last_cumsum[string_offsets]
+        rles = cls(np.zeros(len(x), dtype=np.int32), offsets, coco_rles[0]["size"])
+        # undo the deltas, i.e. counts[i] = x[i] + counts[i - 2] for i > 2, which is a
+        # cumulative sum along the odd (from i = 1) and even (from i = 2) counts
+        local = rles._local_index()
+        chain = np.where(local == 0, 0, np.where(local % 2 == 1, 1, 2))
+        order = np.lexsort((local, rles._mask_of_count() * 3 + chain))
+        keys = (rles._mask_of_count() * 3 + chain)[order]
+        csum = np.cumsum(x[order])
+        is_chain_start = np.concatenate([[True], keys[1:] != keys[:-1]])
+        chain_start = np.maximum.accumulate(np.where(is_chain_start, np.arange(len(x)), 0))
+        counts = np.empty(len(x), dtype=np.int64)
+        counts[order] = csum - csum[chain_start] + x[order][chain_start]
+        rles.counts = counts.astype(np.int32)
+        return rles
+
+
 def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
     """
     Encodes masks to an uncompressed RLE, in the format expected by
     pycoco tools.
     """
-    # Put in fortran order and flatten h,w
-    b, h, w = tensor.shape
-    tensor = tensor.permute(0, 2, 1).flatten(1)
-
-    # Compute change indices
-    diff = tensor[:, 1:] ^ tensor[:, :-1]
-    change_indices = diff.nonzero()
-
-    # Encode run length
-    out = []
-    for i in range(b):
-        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
-        cur_idxs = torch.cat(
-            [
-                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
-                cur_idxs + 1,
-                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
-            ]
-        )
-        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
-        counts = [] if tensor[i, 0] == 0 else [0]
-        counts.extend(btw_idxs.detach().cpu().tolist())
-        out.append({"size": [h, w], "counts": counts})
-    return out
+    return FlatRLE.from_masks(tensor).to_rles()
 
 
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
-    mask = np.empty(h * w, dtype=bool)
-    idx = 0
-    parity = False
-    for count in rle["counts"]:
-        mask[idx : idx + count] = parity
-        idx += count
-        parity ^= True
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    mask = np.repeat(np.arange(len(counts)) % 2 == 1, counts)
     mask = mask.reshape(w, h)
     return mask.transpose()  # Put in C order
 
 
 def area_from_rle(rle: Dict[str, Any]) -> int:
-    return sum(rle["counts"][1::2])
+    return int(np.asarray(rle["counts"][1::2], dtype=np.int64).sum())
 
 
 def calculate_stability_score(
@@ -279,20 +584,51 @@ def remove_small_regions(
     correct_holes = mode == "holes"
     working_mask = (correct_holes ^ mask).astype(np.uint8)
     n_labels, regions, stats, _ = cv2.connectedComponentsWithStats(working_mask, 8)
-    sizes = stats[:, -1][1:]  # Row 0 is background label
-    small_regions = [i + 1 for i, s in enumerate(sizes) if s < area_thresh]
-    if len(small_regions) == 0:
+    sizes = stats[1:, cv2.CC_STAT_AREA]  # Row 0 is background label
+    is_small = sizes < area_thresh
+    if not is_small.any():
         return mask, False
-    fill_labels = [0] + small_regions
-    if not correct_holes:
-        fill_labels = [i for i in range(n_labels) if i not in fill_labels]
+    # Whether to fill each label (as a lookup table over the labels)
+    if correct_holes:
+        fill_labels = np.concatenate([[True], is_small])
+    else:
+        fill_labels = np.concatenate([[False], ~is_small])
         # If every region is below threshold, keep largest
-        if len(fill_labels) == 0:
-            fill_labels = [int(np.argmax(sizes)) + 1]
-    mask = np.isin(regions, fill_labels)
+        if not fill_labels.any():
+            fill_labels[int(np.argmax(sizes)) + 1] = True
+    mask = fill_labels[regions]
     return mask, True
 
 
+def batched_remove_small_regions(
+    masks: np.ndarray, area_thresh: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Removes small holes and then small disconnected regions in a NxHxW stack of
+    masks. The masks are processed in the OpenCV thread pool shared with the other
+    post-processing steps (see `get_opencv_executor`). Returns the masks and a
+    boolean array indicating which of them have been modified.
+    """
+
+    def _process(mask):
+        mask = np.ascontiguousarray(mask)
+        mask, changed_holes = remove_small_regions(mask, area_thresh, mode="holes")
+        mask, changed_islands = remove_small_regions(mask, area_thresh, mode="islands")
+        return mask, changed_holes or changed_islands
+
+    if len(masks) > 1:
+        results = list(get_opencv_executor().map(_process, masks))
+    else:
+        results = [_process(mask) for mask in masks]
+
+    new_masks = np.zeros(masks.shape, dtype=bool)
+    changed = np.zeros(len(masks), dtype=bool)
+    for i, (mask, mask_changed) in enumerate(results):
+        new_masks[i] = mask
+        changed[i] = mask_changed
+    return new_masks, changed
+
+
 def coco_encode_rle(uncompressed_rle: Dict[str, Any]) -> Dict[str, Any]:
     from pycocotools import mask as mask_utils  # type: ignore
 
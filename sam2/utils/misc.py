@@ -7,7 +7,9 @@
 import os
 import re
 import warnings
-from threading import Thread
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
 
 import numpy as np
 import torch
@@ -58,10 +60,69 @@ def get_connected_components(mask):
               for foreground pixels and 0 for background pixels.
     - counts: A tensor of shape (N, 1, H, W) containing the area of the connected
               components for foreground pixels and 0 for background pixels.
+
+    CUDA tensors are labeled by the CUDA kernel in the `sam2._C` extension (which
+    raises an ImportError if it isn't built), and CPU tensors with OpenCV (see
+    `_get_connected_components_cpu`). CUDA tensors never go through the OpenCV path,
+    as it would add a device-to-host copy and a synchronization to every call.
     """
-    from sam2 import _C
+    if mask.is_cuda:
+        from sam2 import _C
+
+        return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+
+    return _get_connected_components_cpu(mask)
+
 
-    return _C.get_connected_componnets(mask.to(torch.uint8).contiguous())
+_OPENCV_EXECUTOR = None
+_OPENCV_EXECUTOR_LOCK = Lock()
+
+
+def get_opencv_executor():
+    """
+    Get the thread pool (created on first use) shared by the OpenCV post-processing
+    steps. OpenCV releases the GIL, so the masks of a batch are processed in parallel.
+    """
+    global _OPENCV_EXECUTOR
+    with _OPENCV_EXECUTOR_LOCK:
+        if _OPENCV_EXECUTOR is None:
+            _OPENCV_EXECUTOR = ThreadPoolExecutor(
+                max_workers=min(8, os.cpu_count() or 1)
+            )
+    return _OPENCV_EXECUTOR
+
+
+def _get_connected_components_cpu(mask):
+    """
+    CPU implementation of `get_connected_components` with the same outputs, which
+    labels each mask with `cv2.connectedComponentsWithStats` in the OpenCV thread pool.
+    """
+    import cv2  # type: ignore
+
+    N, _, H, W = mask.shape
+    if N == 0:
+        empty = torch.zeros(mask.shape, dtype=torch.int32, device=mask.device)
+        return empty, empty.clone()
+    mask_np = mask.to(torch.uint8).cpu().numpy().reshape(N, H, W)
+
+    def _label(m):
+        _, labels, stats, _ = cv2.connectedComponentsWithStats(
+            m, connectivity=8, ltype=cv2.CV_32S
+        )
+        counts = stats[:, cv2.CC_STAT_AREA].astype(np.int32)
+        counts[0] = 0  # label 0 is the background
+        return labels, counts[labels]
+
+    if N > 1:
+        results = list(get_opencv_executor().map(_label, mask_np))
+    else:
+        results = [_label(m) for m in mask_np]
+
+    labels = np.stack([r[0] for r in results]).reshape(N, 1, H, W)
+    counts = np.stack([r[1] for r in results]).reshape(N, 1, H, W)
+    labels = torch.from_numpy(labels).to(mask.device)
+    counts = torch.from_numpy(counts).to(mask.device)
+    return labels, counts
 
 
 def mask_to_box(masks: torch.Tensor):
@@ -174,24 +235,10 @@ class AsyncVideoFrameLoader:
         return len(self.images)
 
 
-def load_video_frames(
-        video_path,
-        image_size,
-        offload_video_to_cpu,
-        img_mean=(0.485, 0.456, 0.406),
-        img_std=(0.229, 0.224, 0.225),
-        async_loading_frames=False,
-        frame_paths=None,
-        compute_device=torch.device("cuda"),
-
-):
+def get_video_frame_paths(video_path, frame_paths=None):
     """
-    Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
-
-    The frames are resized to image_size x image_size and are loaded to GPU if
-    `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
-
-    You can load a frame asynchronously by setting `async_loading_frames` to `True`.
+    Get the paths of the video frames, either from a directory of JPEG files or from
+    the given list of `frame_paths`, in the order they are loaded by `load_video_frames`.
     """
     if isinstance(video_path, str) and os.path.isdir(video_path):
         jpg_folder = video_path
@@ -229,6 +276,30 @@ def load_video_frames(
         img_paths = [os.path.join(jpg_folder, frame_name) for frame_name in frame_names]
     else:
         img_paths = frame_names
+    return img_paths
+
+
+def load_video_frames(
+        video_path,
+        image_size,
+        offload_video_to_cpu,
+        img_mean=(0.485, 0.456, 0.406),
+        img_std=(0.229, 0.224, 0.225),
+        async_loading_frames=False,
+        frame_paths=None,
+        compute_device=torch.device("cuda"),
+
+):
+    """
+    Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
+
+    The frames are resized to image_size x image_size and are loaded to GPU if
+    `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
+
+    You can load a frame asynchronously by setting `async_loading_frames` to `True`.
+    """
+    img_paths = get_video_frame_paths(video_path, frame_paths)
+    num_frames = len(img_paths)
 
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
     img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
@@ -277,7 +348,8 @@ def fill_holes_in_mask_scores(mask, max_area):
         # We fill holes with a small positive mask score (0.1) to change them to foreground.
         mask = torch.where(is_hole, 0.1, mask)
     except Exception as e:
-        # Skip the post-processing step on removing small holes if the CUDA kernel fails
+        # Skip the post-processing step on removing small holes if the CUDA kernel (for
+        # CUDA masks) or OpenCV (for CPU masks) isn't available
         warnings.warn(
             f"{e}\n\nSkipping the post-processing step due to the error above. You can "
             "still use SAM 2 and it's OK to ignore the error above, although some post-processing "
@@ -291,6 +363,291 @@ def fill_holes_in_mask_scores(mask, max_area):
     return mask
 
 
+def pack_mask_bits(masks):
+    """
+    Pack a boolean mask tensor into a flat uint8 tensor with 8 pixels per byte
+    (most significant bit first, i.e. the same layout as `np.packbits`). The packing
+    runs on the masks' device, so only 1/8 of the bytes need to be transferred.
+    """
+    flat = masks.flatten().to(torch.uint8)
+    pad = (-flat.numel()) % 8
+    if pad > 0:
+        flat = torch.nn.functional.pad(flat, (0, pad))
+    shifts = torch.arange(7, -1, -1, dtype=torch.uint8, device=flat.device)
+    return (flat.view(-1, 8) << shifts).sum(dim=1, dtype=torch.uint8)
+
+
+def unpack_mask_bits(packed, shape):
+    """Unpack a uint8 numpy array from `pack_mask_bits` into a boolean mask of `shape`."""
+    count = int(np.prod(shape))
+    return np.unpackbits(packed, count=count).reshape(shape).astype(bool)
+
+
+class AsyncMaskPacker:
+    """
+    Threshold mask logits on device, pack them into bits and copy them to pinned host
+    buffers on a side CUDA stream. Each submitted frame is returned one step later,
+    so that the device-to-host transfer of a frame overlaps with the computation of
+    the next frame and the compute stream is never synchronized by the copy.
+
+    On CPU devices there's nothing to overlap, so the masks are only thresholded
+    (but still returned one step late to keep the same calling convention).
+    """
+
+    def __init__(self, device, score_thresh=0.0, num_buffers=2):
+        assert num_buffers >= 2, "at least two buffers are needed to overlap transfers"
+        self.device = torch.device(device)
+        self.score_thresh = score_thresh
+        self.num_buffers = num_buffers
+        self.use_cuda = self.device.type == "cuda"
+        self.stream = torch.cuda.Stream(self.device) if self.use_cuda else None
+        # pinned host buffers, reused in a round-robin way
+        self.host_buffers = [None] * num_buffers
+        self.pending = deque()
+        self.num_submitted = 0
+
+    def submit(self, key, mask_logits):
+        """
+        Start the transfer of `mask_logits` ([N, 1, H, W] on device) and return the
+        (key, masks) of the previously submitted frame once it's ready (or None if no
+        frame is ready yet). `masks` is a boolean numpy array of [N, 1, H, W] shape.
+        """
+        shape = tuple(mask_logits.shape)
+        binary_masks = mask_logits > self.score_thresh
+        if self.use_cuda:
+            packed = pack_mask_bits(binary_masks)
+            slot = self.num_submitted % self.num_buffers
+            host_buffer = self.host_buffers[slot]
+            if host_buffer is None or host_buffer.numel() < packed.numel():
+                host_buffer = torch.empty(
+                    packed.numel(), dtype=torch.uint8, pin_memory=True
+                )
+                self.host_buffers[slot] = host_buffer
+            host_buffer = host_buffer[: packed.numel()]
+            # the copy must wait for the packing kernels on the compute stream
+            self.stream.wait_stream(torch.cuda.current_stream(self.device))
+            with torch.cuda.stream(self.stream):
+                host_buffer.copy_(packed, non_blocking=True)
+                packed.record_stream(self.stream)
+                copy_done = torch.cuda.Event()
+                copy_done.record(self.stream)
+            self.pending.append((key, shape, host_buffer, copy_done))
+        else:
+            self.pending.append((key, shape, binary_masks, None))
+        self.num_submitted += 1
+
+        # keep up to (num_buffers - 1) frames in flight
+        if len(self.pending) >= self.num_buffers:
+            return self._pop()
+        return None
+
+    def flush(self):
+        """Return (key, masks) of all the frames that are still in flight."""
+        ready = []
+        while len(self.pending) > 0:
+            ready.append(self._pop())
+        return ready
+
+    def _pop(self):
+        key, shape, host_buffer, copy_done = self.pending.popleft()
+        if copy_done is None:
+            return key, host_buffer.numpy()
+        copy_done.synchronize()
+        # unpacking allocates a new array, so the pinned buffer can be reused right away
+        return key, unpack_mask_bits(host_buffer.numpy(), shape)
+
+
+class LazyVideoResMasks:
+    """
+    A handle on the low-resolution mask logits of all objects on a frame, which defers
+    resizing them to the original video resolution until the consumer asks for it.
+
+    `logits()` gives the same float scores as the eager video-resolution output, while
+    `masks()` upsamples and thresholds one object at a time into a uint8 mask, so that
+    a float32 video-resolution tensor is never materialized for all objects at once.
+    """
+
+    def __init__(self, low_res_masks, video_height, video_width, non_overlap_masks):
+        self.low_res_masks = low_res_masks  # [N, 1, h, w] mask logits
+        self.video_height = video_height
+        self.video_width = video_width
+        self.non_overlap_masks = non_overlap_masks
+
+    def __len__(self):
+        return self.low_res_masks.size(0)
+
+    @property
+    def shape(self):
+        """The shape of the video-resolution output."""
+        return (len(self), 1, self.video_height, self.video_width)
+
+    def _upsample(self, low_res_masks, size):
+        if low_res_masks.shape[-2:] == size:
+            return low_res_masks
+        return torch.nn.functional.interpolate(
+            low_res_masks, size=size, mode="bilinear", align_corners=False
+        )
+
+    def logits(self):
+        """Get the mask logits at the video resolution, i.e. [N, 1, H, W] float scores."""
+        size = (self.video_height, self.video_width)
+        video_res_masks = self._upsample(self.low_res_masks, size)
+        if self.non_overlap_masks and len(self) > 1:
+            # keep only the highest scoring object at each location (see
+            # `SAM2Base._apply_non_overlapping_constraints`)
+            max_obj_inds = torch.argmax(video_res_masks, dim=0, keepdim=True)
+            batch_obj_inds = torch.arange(len(self), device=max_obj_inds.device)
+            keep = max_obj_inds == batch_obj_inds[:, None, None, None]
+            video_res_masks = torch.where(
+                keep, video_res_masks, torch.clamp(video_res_masks, max=-10.0)
+            )
+        return video_res_masks
+
+    def masks(self, score_thresh=0.0, size=None):
+        """
+        Get the binary masks as a [N, 1, H, W] uint8 tensor at `size` (default to the
+        video resolution). The masks are upsampled and thresholded object by object, and
+        under non-overlapping constraints each pixel goes to the highest scoring object
+        (equivalent to thresholding `logits()` for any `score_thresh` above -10.0).
+        """
+        if size is None:
+            size = (self.video_height, self.video_width)
+        size = tuple(size)
+        num_objs = len(self)
+        device = self.low_res_masks.device
+        out_masks = torch.empty(num_objs, 1, *size, dtype=torch.uint8, device=device)
+        non_overlap = self.non_overlap_masks and num_objs > 1
+        if non_overlap:
+            best_scores = None
+            best_obj_inds = torch.zeros(1, 1, *size, dtype=torch.int32, device=device)
+        for obj_idx in range(num_objs):
+            obj_scores = self._upsample(self.low_res_masks[obj_idx : obj_idx + 1], size)
+            out_masks[obj_idx : obj_idx + 1] = obj_scores > score_thresh
+            if non_overlap:
+                if best_scores is None:
+                    best_scores = obj_scores.clone()
+                else:
+                    # strictly greater, so that ties go to the first object like `argmax`
+                    is_better = obj_scores > best_scores
+                    best_scores = torch.where(is_better, obj_scores, best_scores)
+                    best_obj_inds.masked_fill_(is_better, obj_idx)
+        if non_overlap:
+            batch_obj_inds = torch.arange(num_objs, device=device)[:, None, None, None]
+            out_masks &= (best_obj_inds == batch_obj_inds).to(torch.uint8)
+        return out_masks
+
+    def boxes(self, score_thresh=0.0):
+        """
+        Get the bounding boxes of the masks as a [N, 4] float tensor in XYXY format and
+        video-resolution pixel coordinates, computed directly on the low-resolution masks
+        (objects with an empty mask get a box of all -1's). As in `mask_to_box`, the
+        bottom-right corner is the last pixel inside the box (i.e. it's inclusive).
+        """
+        low_res_H, low_res_W = self.low_res_masks.shape[-2:]
+        boxes = mask_to_box(self.low_res_masks > score_thresh)[:, 0].float()
+        is_empty = boxes[:, 2] < 0
+        # convert from low-res pixel indices to video-resolution pixel coordinates
+        scale = torch.tensor(
+            [
+                self.video_width / low_res_W,
+                self.video_height / low_res_H,
+                self.video_width / low_res_W,
+                self.video_height / low_res_H,
+            ],
+            device=boxes.device,
+        )
+        # scale the exclusive bottom-right corner, then go back to the last pixel inside
+        boxes[:, 2:] += 1
+        boxes = boxes * scale
+        boxes[:, 2:] -= 1
+        boxes[is_empty] = -1.0
+        return boxes
+
+
+class QuantizedTensor:
+    """
+    A compact int8 or fp8 (e4m3) copy of a [B, C, ...] float tensor with one scale per
+    (B, C) channel, used to store memory features and mask logits in long sessions.
+    Slicing along the batch dimension (e.g. to take per-object outputs) gives another
+    `QuantizedTensor` sharing the same storage.
+    """
+
+    # the largest magnitude representable in each storage format
+    _QMAX = {"int8": 127.0, "fp8": 448.0}
+
+    def __init__(self, data, scale, mode, dtype):
+        self.data = data
+        self.scale = scale
+        self.mode = mode
+        self.dtype = dtype  # the dtype of the dequantized tensor
+
+    @classmethod
+    def quantize(cls, x, mode):
+        """Quantize `x` with `mode` in ("int8", "fp8")."""
+        if mode not in cls._QMAX:
+            raise ValueError(f"unknown quantization mode {mode}; use 'int8' or 'fp8'")
+        if mode == "fp8" and not hasattr(torch, "float8_e4m3fn"):
+            raise RuntimeError("fp8 quantization requires PyTorch 2.1 or newer")
+        x_float = x.float()
+        reduce_dims = tuple(range(2, x.dim()))
+        amax = x_float.abs().amax(dim=reduce_dims, keepdim=True)
+        scale = torch.clamp(amax, min=1e-8) / cls._QMAX[mode]
+        data = x_float / scale
+        if mode == "int8":
+            data = torch.round(data).clamp_(-127, 127).to(torch.int8)
+        else:
+            data = data.to(torch.float8_e4m3fn)
+        return cls(data, scale, mode, x.dtype)
+
+    def dequantize(self, device=None, non_blocking=False):
+        """Get back a tensor in the original dtype (on `device` if specified)."""
+        data, scale = self.data, self.scale
+        if device is not None:
+            data = data.to(device, non_blocking=non_blocking)
+            scale = scale.to(device, non_blocking=non_blocking)
+        return (data.float() * scale).to(self.dtype)
+
+    def to(self, device, non_blocking=False):
+        """Move the quantized storage to `device` (without dequantizing it)."""
+        return QuantizedTensor(
+            self.data.to(device, non_blocking=non_blocking),
+            self.scale.to(device, non_blocking=non_blocking),
+            self.mode,
+            self.dtype,
+        )
+
+    def __getitem__(self, idx):
+        return QuantizedTensor(self.data[idx], self.scale[idx], self.mode, self.dtype)
+
+    @property
+    def shape(self):
+        return self.data.shape
+
+    def size(self, dim=None):
+        return self.data.size() if dim is None else self.data.size(dim)
+
+    def nbytes(self):
+        """The number of bytes held by the quantized storage."""
+        return (
+            self.data.numel() * self.data.element_size()
+            + self.scale.numel() * self.scale.element_size()
+        )
+
+
+def maybe_quantize(x, mode):
+    """Quantize `x` into a `QuantizedTensor` if `mode` is not None."""
+    if x is None or mode is None:
+        return x
+    return QuantizedTensor.quantize(x, mode)
+
+
+def maybe_dequantize(x, device, non_blocking=True):
+    """Load a tensor or `QuantizedTensor` onto `device` as a regular tensor."""
+    if isinstance(x, QuantizedTensor):
+        return x.dequantize(device, non_blocking=non_blocking)
+    return x.to(device, non_blocking=non_blocking)
+
+
 def concat_points(old_point_inputs, new_points, new_labels):
     """Add new points and labels to previous point inputs (add at the end)."""
     if old_point_inputs is None:
@@ -0,0 +1,274 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import itertools
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+from sam2.utils.misc import QuantizedTensor
+
+# marks a missing default value in `TieredFrameOutputs.pop`
+_MISSING = object()
+
+
+def slice_frame_output(out, obj_idx):
+    """
+    Take the slice of object `obj_idx` from a multi-object frame output. The resulting
+    slices share the same tensor storage as `out`.
+    """
+    obj_slice = slice(obj_idx, obj_idx + 1)
+    obj_out = {
+        "maskmem_features": None,
+        "maskmem_pos_enc": None,
+        "pred_masks": out["pred_masks"][obj_slice],
+        "obj_ptr": out["obj_ptr"][obj_slice],
+    }
+    if out["maskmem_features"] is not None:
+        obj_out["maskmem_features"] = out["maskmem_features"][obj_slice]
+    if out["maskmem_pos_enc"] is not None:
+        obj_out["maskmem_pos_enc"] = [x[obj_slice] for x in out["maskmem_pos_enc"]]
+    return obj_out
+
+
+def _to_cpu(x, pin_memory):
+    """Move a tensor or `QuantizedTensor` to (optionally pinned) CPU memory."""
+    if x is None:
+        return None
+    if isinstance(x, QuantizedTensor):
+        return QuantizedTensor(
+            _to_cpu(x.data, pin_memory), _to_cpu(x.scale, pin_memory), x.mode, x.dtype
+        )
+    x = x.cpu()
+    if pin_memory and not x.is_pinned():
+        x = x.pin_memory()
+    return x
+
+
+def _to_payload(x):
+    """Turn a tensor or `QuantizedTensor` into plain tensors and strings to save."""
+    if isinstance(x, QuantizedTensor):
+        return {
+            "data": x.data.cpu(),
+            "scale": x.scale.cpu(),
+            "mode": x.mode,
+            "dtype": str(x.dtype).replace("torch.", ""),
+        }
+    return None if x is None else x.cpu()
+
+
+def _from_payload(payload):
+    if isinstance(payload, dict):
+        dtype = getattr(torch, payload["dtype"])
+        return QuantizedTensor(payload["data"], payload["scale"], payload["mode"], dtype)
+    return payload
+
+
+class TieredFrameOutputs(MutableMapping):
+    """
+    A {frame_idx: output} mapping for the per-frame tracking outputs in `output_dict`,
+    which keeps the memory features and mask logits of the most recently added frames
+    where they were stored (on GPU unless `offload_state_to_cpu=True`), the next most
+    recent ones in pinned CPU memory, and spills all the older ones into files on disk
+    that are memory-mapped back on access. Object pointers are small and always kept on
+    the compute device, as in the regular in-memory storage.
+
+    Frames that will be needed soon (e.g. the memory frames of the next frame to track)
+    can be loaded back from disk in the background via `prefetch`.
+    """
+
+    def __init__(self, spill_dir, compute_device, gpu_window=16, cpu_window=64):
+        assert gpu_window >= 1 and cpu_window >= 0
+        os.makedirs(spill_dir, exist_ok=True)
+        # each session spills into its own directory, removed with the storage
+        self.spill_dir = tempfile.mkdtemp(prefix="sam2_state_", dir=spill_dir)
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self.spill_dir, ignore_errors=True
+        )
+        self.compute_device = torch.device(compute_device)
+        self.gpu_window = gpu_window
+        self.cpu_window = cpu_window
+        self.pin_memory = torch.cuda.is_available()
+        # the three tiers, each {frame_idx: output} ordered from the oldest to the newest
+        self._hot = OrderedDict()
+        self._warm = OrderedDict()
+        # {frame_idx: maskmem_pos_enc} for the frames on disk ("maskmem_pos_enc" is
+        # an expanded view of a session constant, so it's not worth spilling)
+        self._cold = OrderedDict()
+        # {frame_idx: path} of the up-to-date disk copy of each frame
+        self._files = {}
+        self._file_version = itertools.count()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1)
+        self._prefetching = {}
+
+    def __getitem__(self, frame_idx):
+        if frame_idx in self._hot:
+            return self._hot[frame_idx]
+        if frame_idx in self._warm:
+            return self._warm[frame_idx]
+        if frame_idx not in self._cold:
+            raise KeyError(frame_idx)
+        future = self._prefetching.pop(frame_idx, None)
+        if future is not None:
+            out = future.result()
+        else:
+            out = self._load(self._files[frame_idx], self._cold[frame_idx])
+        # keep the loaded frame in the warm tier (its disk copy stays valid)
+        del self._cold[frame_idx]
+        self._warm[frame_idx] = out
+        self._evict()
+        return out
+
+    def __setitem__(self, frame_idx, out):
+        self._discard(frame_idx)
+        self._hot[frame_idx] = out
+        self._evict()
+
+    def pop(self, frame_idx, default=_MISSING):
+        """
+        Remove a frame and return its output. Unlike the inherited `pop`, a spilled
+        frame is read from disk without being promoted to the warm tier first (which
+        could spill another frame). Use `del` to remove a frame without reading it.
+        """
+        if frame_idx in self._hot:
+            out = self._hot[frame_idx]
+        elif frame_idx in self._warm:
+            out = self._warm[frame_idx]
+        elif frame_idx in self._cold:
+            future = self._prefetching.get(frame_idx)
+            if future is not None:
+                out = future.result()
+            else:
+                out = self._load(self._files[frame_idx], self._cold[frame_idx])
+        elif default is _MISSING:
+            raise KeyError(frame_idx)
+        else:
+            return default
+        self._discard(frame_idx)
+        return out
+
+    def __delitem__(self, frame_idx):
+        if not self._discard(frame_idx):
+            raise KeyError(frame_idx)
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._hot or frame_idx in self._warm or frame_idx in self._cold
+
+    def __iter__(self):
+        return iter(list(self._cold) + list(self._warm) + list(self._hot))
+
+    def __len__(self):
+        return len(self._hot) + len(self._warm) + len(self._cold)
+
+    def clear(self):
+        for frame_idx in list(self):
+            self._discard(frame_idx)
+
+    def prefetch(self, frame_inds):
+        """Start loading the frames in `frame_inds` from disk in the background."""
+        for frame_idx in frame_inds:
+            if frame_idx in self._cold and frame_idx not in self._prefetching:
+                # pass the file and positional encoding rather than the frame index,
+                # as the bookkeeping dicts may change while the job runs
+                self._prefetching[frame_idx] = self._prefetch_executor.submit(
+                    self._load, self._files[frame_idx], self._cold[frame_idx]
+                )
+
+    def _discard(self, frame_idx):
+        """Remove a frame from all tiers and return whether it was present."""
+        found = frame_idx in self
+        self._hot.pop(frame_idx, None)
+        self._warm.pop(frame_idx, None)
+        self._cold.pop(frame_idx, None)
+        future = self._prefetching.pop(frame_idx, None)
+        if future is not None:
+            future.cancel()
+        path = self._files.pop(frame_idx, None)
+        if path is not None:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # e.g. still memory-mapped on Windows; removed with `spill_dir`
+        return found
+
+    def _evict(self):
+        """Demote the oldest frames from the hot to the warm tier and from warm to disk."""
+        while len(self._hot) > self.gpu_window:
+            frame_idx, out = self._hot.popitem(last=False)
+            out = out.copy()
+            out["maskmem_features"] = _to_cpu(out["maskmem_features"], self.pin_memory)
+            out["pred_masks"] = _to_cpu(out["pred_masks"], self.pin_memory)
+            self._warm[frame_idx] = out
+        while len(self._warm) > self.cpu_window:
+            frame_idx, out = self._warm.popitem(last=False)
+            if frame_idx not in self._files:
+                self._files[frame_idx] = self._save(frame_idx, out)
+            self._cold[frame_idx] = out["maskmem_pos_enc"]
+
+    def _save(self, frame_idx, out):
+        path = os.path.join(
+            self.spill_dir, f"{frame_idx:07d}_{next(self._file_version)}.pt"
+        )
+        payload = {
+            "maskmem_features": _to_payload(out["maskmem_features"]),
+            "pred_masks": _to_payload(out["pred_masks"]),
+            "obj_ptr": _to_payload(out["obj_ptr"]),
+        }
+        torch.save(payload, path)
+        return path
+
+    def _load(self, path, maskmem_pos_enc):
+        """Load a frame output from its disk copy (also run on the prefetch thread)."""
+        payload = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+        return {
+            "maskmem_features": _from_payload(payload["maskmem_features"]),
+            "maskmem_pos_enc": maskmem_pos_enc,
+            "pred_masks": _from_payload(payload["pred_masks"]),
+            # object pointers are expected on the compute device
+            "obj_ptr": payload["obj_ptr"].to(self.compute_device, non_blocking=True),
+        }
+
+
+class FrameOutputsObjectSlice(MutableMapping):
+    """
+    The per-object view of a `TieredFrameOutputs` used in `output_dict_per_obj`. Each
+    item is sliced on the fly from the multi-object output in the parent storage, so
+    the per-object slices never keep a spilled frame alive in memory. Adding or removing
+    frames is done on the parent storage (which is what `output_dict` always holds).
+    """
+
+    def __init__(self, parent, obj_idx):
+        self.parent = parent
+        self.obj_idx = obj_idx
+
+    def __getitem__(self, frame_idx):
+        return slice_frame_output(self.parent[frame_idx], self.obj_idx)
+
+    def __setitem__(self, frame_idx, obj_out):
+        # the slices are derived from the outputs in the parent storage
+        if frame_idx not in self.parent:
+            raise KeyError(f"frame {frame_idx} must be added to the parent storage first")
+
+    def __delitem__(self, frame_idx):
+        pass  # removed together with the parent storage
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self.parent
+
+    def __iter__(self):
+        return iter(self.parent)
+
+    def __len__(self):
+        return len(self.parent)
+
+    def clear(self):
+        pass  # cleared together with the parent storage
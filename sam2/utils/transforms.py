@@ -6,6 +6,7 @@
 
 import warnings
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -38,9 +39,63 @@ class SAM2Transforms(nn.Module):
         x = self.to_tensor(x)
         return self.transforms(x)
 
-    def forward_batch(self, img_list):
-        img_batch = [self.transforms(self.to_tensor(img)) for img in img_list]
-        img_batch = torch.stack(img_batch, dim=0)
+    def forward_batch(self, img_list, device=None, pin_memory=False):
+        """
+        Transform a batch of images into a Bx3xHxW input tensor for the model. The
+        images can be a list of HWC images (np.ndarray or PIL Image) with pixel values
+        in [0, 255], or a BxHxWxC uint8 tensor.
+
+        Instead of transforming the images one by one, those of the same size are
+        resized together by a single `F.interpolate` (the same bilinear antialiased
+        resize as `Resize`), which runs on `device` if it's given (so only the uint8
+        pixels are copied to it), and then normalized in one fused op. With
+        `pin_memory=True`, an output on CPU is returned in pinned memory so that it
+        can be copied to GPU asynchronously.
+        """
+        if isinstance(img_list, torch.Tensor):
+            groups = [(list(range(img_list.size(0))), img_list)]
+        else:
+            img_list = [np.asarray(img) for img in img_list]
+            inds_per_size = {}
+            for i, img in enumerate(img_list):
+                inds_per_size.setdefault(img.shape, []).append(i)
+            groups = [
+                (inds, torch.from_numpy(np.stack([img_list[i] for i in inds])))
+                for inds in inds_per_size.values()
+            ]
+
+        if device is not None:
+            out_device = torch.device(device)
+        else:
+            out_device = groups[0][1].device  # i.e. CPU unless given a tensor elsewhere
+        # (x / max_value - mean) / std == x * scale + bias, as in `ToTensor` + `Normalize`
+        max_value = 255.0 if groups[0][1].dtype == torch.uint8 else 1.0
+        std = torch.tensor(self.std, device=out_device).view(1, -1, 1, 1)
+        mean = torch.tensor(self.mean, device=out_device).view(1, -1, 1, 1)
+        scale = 1.0 / (max_value * std)
+        bias = -mean / std
+
+        img_batch = None
+        for inds, imgs in groups:
+            imgs = imgs.to(out_device, non_blocking=True).permute(0, 3, 1, 2).float()
+            imgs = F.interpolate(
+                imgs,
+                (self.resolution, self.resolution),
+                mode="bilinear",
+                align_corners=False,
+                antialias=True,
+            )
+            imgs = torch.addcmul(bias, imgs, scale)
+            if len(groups) == 1:
+                img_batch = imgs
+                break
+            if img_batch is None:
+                num_images = sum(len(inds) for inds, _ in groups)
+                img_batch = imgs.new_empty(num_images, *imgs.shape[1:])
+            img_batch[torch.tensor(inds, device=out_device)] = imgs
+
+        if pin_memory and img_batch.device.type == "cpu":
+            img_batch = img_batch.pin_memory()
         return img_batch
 
     def transform_coords(
@@ -103,7 +158,8 @@ class SAM2Transforms(nn.Module):
                 # We fill holes with negative mask score (-10.0) to change them to background.
                 masks = torch.where(is_hole, self.mask_threshold - 10.0, masks)
         except Exception as e:
-            # Skip the post-processing step if the CUDA kernel fails
+            # Skip the post-processing step if the CUDA kernel (for CUDA masks) or
+            # OpenCV (for CPU masks) isn't available
             warnings.warn(
                 f"{e}\n\nSkipping the post-processing step due to the error above. You can "
                 "still use SAM 2 and it's OK to ignore the error above, although some post-processing "
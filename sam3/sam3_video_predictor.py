@@ -88,6 +88,8 @@ def main():
     final_video_path = config['final_video_path']
     images_ending_count = config['images_ending_count']
 
+    # the SAM2 model service is built for the first video and kept for all the others
+    model = None
     for i in range(video_start, video_start + video_end):
         if os.path.exists(working_dir_name):
             if delete == 'yes':
@@ -104,7 +106,7 @@ def main():
                     logger.info(f"Working directory '{working_dir_name}' not deleted")
                     sys.exit(1000)
 
-        run_pipeline(
+        model = run_pipeline(
             fps=fps,
             video_number=i,
             prefix=prefix,
@@ -118,7 +120,8 @@ def main():
             verified_img_dir=verified_img_dir.replace('working_dir', working_dir_name),
             verified_mask_dir=verified_mask_dir.replace('working_dir', working_dir_name),
             final_video_path=final_video_path,
-            images_ending_count=images_ending_count
+            images_ending_count=images_ending_count,
+            model=model
         )
 
         if os.path.exists(working_dir_name):
@@ -97,9 +97,10 @@ class MaskProcessor:
         is_prompted = (prompt_encoding(inference_state, batch_number) is not None) or is_prompted
         if is_prompted:
             video_segments = {}
-            for out_frame_idx, out_obj_ids, out_mask_logits in sam2_predictor.propagate_in_video(inference_state):
+            for out_frame_idx, out_obj_ids, out_masks in sam2_predictor.propagate_in_video(
+                    inference_state, async_mask_output=True):
                 video_segments[out_frame_idx] = {
-                    out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
+                    out_obj_id: out_masks[i]
                     for i, out_obj_id in enumerate(out_obj_ids)
                 }
             present_count = self.image_counter
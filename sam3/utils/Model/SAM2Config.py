@@ -7,7 +7,7 @@ class SAM2Config:
     def __init__(self, video_number, batch_size=120, images_starting_count=0, images_ending_count=None,
                  prefix="file", video_path_template=None, images_extract_dir=None,
                  rendered_frames_dir=None, temp_processing_dir=None, window_size=None,
-                 label_colors=None, memory_bank_size=5, prompt_memory_size=5):
+                 label_colors=None, memory_bank_size=5, prompt_memory_size=5, cpu_int8=False):
         self.video_number = video_number
         self.batch_size = batch_size
         self.images_starting_count = images_starting_count
@@ -30,3 +30,7 @@ class SAM2Config:
         self.prompt_memory_size = prompt_memory_size
         self.model_config_path = get_resource_path("./sam2_configs/sam2_hiera_l.yaml")
         self.checkpoint_path = get_resource_path("./checkpoints/sam2_hiera_large.pt")
+        # int8 inference profile used when running on CPU; the quantized weights are
+        # converted from `checkpoint_path` once and reused from this file afterwards
+        self.cpu_int8 = cpu_int8
+        self.quantized_checkpoint_path = get_resource_path("./checkpoints/sam2_hiera_large_cpu_int8.pt")
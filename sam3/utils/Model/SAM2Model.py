@@ -1,14 +1,13 @@
 import torch
-import GPUtil
 from ..UserUI.logger_config import logger
 from sam2.build_sam import build_sam2_video_predictor
 
 class SAM2Model:
-    """Base class for SAM2 model setup and management."""
+    """SAM2 model service: builds the predictor once and is shared by the per-video sessions."""
     def __init__(self, config):
         self.config = config
         self.device = self.get_device()
-        self.gpus = GPUtil.getGPUs()
+        self._gpus = None
         self.sam2_predictor = self.build_predictor()
 
     def get_device(self):
@@ -21,15 +20,31 @@ class SAM2Model:
         return device
 
     def build_predictor(self):
-        """Build SAM2 video predictor."""
+        """Build SAM2 video predictor (with the int8 profile on CPU if enabled)."""
+        cpu_int8 = self.device.type == "cpu" and self.config.cpu_int8
+        if cpu_int8:
+            logger.info("Using the int8 CPU inference profile")
         return build_sam2_video_predictor(
             self.config.model_config_path,
             self.config.checkpoint_path,
             device=self.device,
+            cpu_int8=cpu_int8,
+            quantized_ckpt_path=self.config.quantized_checkpoint_path if cpu_int8 else None,
+            # the model is shared across the videos of a pipeline, so only build it once
+            use_cache=True,
             memory_bank_size=self.config.memory_bank_size,
             prompt_memory_size=self.config.prompt_memory_size
         )
 
+    @property
+    def gpus(self):
+        """The GPUs reported by GPUtil (queried, and GPUtil imported, on first use)."""
+        if self._gpus is None:
+            import GPUtil
+
+            self._gpus = GPUtil.getGPUs()
+        return self._gpus
+
     def gpu_memory_usage(self, ind=0):
         """Get GPU memory usage."""
         return self.gpus[ind]
\ No newline at end of file
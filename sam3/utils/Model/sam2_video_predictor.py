@@ -3,8 +3,6 @@ import sys
 
 import cv2
 import numpy as np
-import pygetwindow as gw
-import torch
 
 from ..UserUI.AnnotationManager import AnnotationManager
 from ..Model.SAM2Config import SAM2Config
@@ -16,16 +14,15 @@ from ..Model.SAM2Model import SAM2Model
 from ..UserUI.UserInteraction import UserInteractionHandler
 from ..UserUI.logger_config import logger
 
-print(torch.cuda.get_device_name(0))
 
-
-class SAM2VideoProcessor(SAM2Model):
-    """Main class for SAM2 video processing."""
+class SAM2VideoProcessor:
+    """Per-video SAM2 processing session, running on a (possibly shared) SAM2Model service."""
 
     def __init__(self, video_number, batch_size=120, images_starting_count=0, images_ending_count=None,
                  prefix="file", video_path_template=None, images_extract_dir=None,
                  rendered_frames_dir=None, temp_processing_dir=None, is_drawing=False,
-                 window_size=None, label_colors=None, memory_bank_size=5, prompt_memory_size=5):
+                 window_size=None, label_colors=None, memory_bank_size=5, prompt_memory_size=5,
+                 model=None):
         self.inference_state = None
         sam2Config = SAM2Config(
             video_number=video_number, batch_size=batch_size, images_starting_count=images_starting_count,
@@ -34,7 +31,12 @@ class SAM2VideoProcessor(SAM2Model):
             temp_processing_dir=temp_processing_dir, window_size=window_size,
             label_colors=label_colors, memory_bank_size=memory_bank_size, prompt_memory_size=prompt_memory_size
         )
-        super().__init__(sam2Config)
+        self.config = sam2Config
+        # the model service (only built here for the first video) stays resident across videos,
+        # so only the session state below is set up for each video
+        self.model = model if model is not None else SAM2Model(sam2Config)
+        self.device = self.model.device
+        self.sam2_predictor = self.model.sam2_predictor
         if video_path_template is None:
             logger.error("Missing the video file paths or video")
             sys.exit(1)
@@ -51,6 +53,10 @@ class SAM2VideoProcessor(SAM2Model):
         self.user_interaction = UserInteractionHandler(sam2Config, self.annotation_manager, self)
         self.mask_processor = MaskProcessor(sam2Config)
 
+    def gpu_memory_usage(self, ind=0):
+        """Get GPU memory usage."""
+        return self.model.gpu_memory_usage(ind)
+
     def click_event(self, event, x, y, flags, param):
         """Handle mouse events for point selection."""
         inference_state_temp, frame_path = param
@@ -96,6 +102,9 @@ class SAM2VideoProcessor(SAM2Model):
             zoom_view = self.user_interaction.show_zoom_view(self.user_interaction.current_frame, x, y)
             cv2.imshow("Zoom View", zoom_view)
             try:
+                # GUI-only (and Windows-only) dependency, so only imported when used
+                import pygetwindow as gw
+
                 zoom_window = gw.getWindowsWithTitle("Zoom View")[0]
                 zoom_window.activate()
             except Exception:
@@ -140,10 +149,10 @@ class SAM2VideoProcessor(SAM2Model):
         self.prompt_encoding(inference_state)
         if self.is_prompted:
             video_segments = {}
-            for out_frame_idx, out_obj_ids, out_mask_logits in self.sam2_predictor.propagate_in_video(
-                    inference_state, isSingle=True):
+            for out_frame_idx, out_obj_ids, out_masks in self.sam2_predictor.propagate_in_video(
+                    inference_state, isSingle=True, async_mask_output=True):
                 video_segments[out_frame_idx] = {
-                    out_obj_id: (out_mask_logits[i] > 0.0).cpu().numpy()
+                    out_obj_id: out_masks[i]
                     for i, out_obj_id in enumerate(out_obj_ids)
                 }
             mask = self.mask_processor.binary_mask_2_color_mask(
@@ -215,13 +224,14 @@ class SAM2VideoProcessor(SAM2Model):
             label_list.append(k)
         points_np = [np.array(points, dtype=np.float32) for points in points_list]
         labels_np = label_list
-        for i in range(len(points_np)):
+        if len(points_np) > 0:
             self.is_prompted = True
-            self.sam2_predictor.add_new_points_or_box(
+            # all objects' boxes go through one batched prompt encoder and decoder call
+            self.sam2_predictor.add_new_boxes(
                 inference_state=inference_state,
                 frame_idx=0,
-                obj_id=int(labels_np[i]),
-                box=points_np[i]
+                obj_ids=[int(label) for label in labels_np],
+                boxes=np.stack(points_np)
             )
         return points_np
 
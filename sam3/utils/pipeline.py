@@ -4,15 +4,19 @@ from .FileManagement.FileManager import ensure_directory
 from .FileManagement.ImageCopier import ImageCopier
 from .FileManagement.ImageOverlayProcessor import ImageOverlayProcessor
 from .FileManagement.VideoCreator import VideoCreator
-from .Model.sam2_video_predictor import SAM2VideoProcessor
 from .UserUI.logger_config import logger
 
 
 def run_pipeline(video_number, video_path_template, images_extract_dir, rendered_dirs, overlap_dir,
                  verified_img_dir, verified_mask_dir, prefix, batch_size, fps, final_video_path,
-                 temp_processing_dir, delete, images_ending_count):
-    """Run the entire pipeline for a single video number."""
+                 temp_processing_dir, delete, images_ending_count, model=None):
+    """
+    Run the entire pipeline for a single video number. The SAM2Model service `model` is
+    reused if given (or built otherwise), and returned to be reused for the next videos.
+    """
     logger.info(f"Processing video {video_number}")
+    # imported here so that the model stack (torch, sam2) only loads once a video is processed
+    from .Model.sam2_video_predictor import SAM2VideoProcessor
 
     processor = SAM2VideoProcessor(
         video_number=video_number,
@@ -22,7 +26,8 @@ def run_pipeline(video_number, video_path_template, images_extract_dir, rendered
         images_extract_dir=images_extract_dir,
         rendered_frames_dir=rendered_dirs,
         temp_processing_dir=temp_processing_dir,
-        images_ending_count=images_ending_count
+        images_ending_count=images_ending_count,
+        model=model
     )
     processor.run()
     overlay_processor = ImageOverlayProcessor(
@@ -66,3 +71,4 @@ def run_pipeline(video_number, video_path_template, images_extract_dir, rendered
         fps=fps
     )
     video_creator.run()
+    return processor.model
@@ -10,8 +10,6 @@
 # in the sav_dataset directory.
 from argparse import ArgumentParser
 
-from utils.sav_benchmark import benchmark
-
 """
 The structure of the {GT_ROOT} can be either of the follow two structures. 
 {GT_ROOT} and {PRED_ROOT} should be of the same format
@@ -79,6 +77,9 @@ parser.add_argument(
 
 if __name__ == "__main__":
     args = parser.parse_args()
+    # imported after parsing the arguments, so that e.g. `--help` doesn't load cv2 & co
+    from utils.sav_benchmark import benchmark
+
     benchmark(
         [args.gt_root],
         [args.pred_root],
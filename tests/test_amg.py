@@ -0,0 +1,184 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+from sam2.utils.amg import (
+    area_from_rle,
+    FlatRLE,
+    mask_to_rle_pytorch,
+    MaskData,
+    rle_to_mask,
+    uncrop_masks,
+)
+
+
+def _reference_mask_to_rle(tensor):
+    """The per-mask loop implementation of `mask_to_rle_pytorch` from SAM."""
+    b, h, w = tensor.shape
+    tensor = tensor.permute(0, 2, 1).flatten(1)
+    diff = tensor[:, 1:] ^ tensor[:, :-1]
+    change_indices = diff.nonzero()
+    out = []
+    for i in range(b):
+        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
+        cur_idxs = torch.cat([torch.tensor([0]), cur_idxs + 1, torch.tensor([h * w])])
+        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
+        counts = [] if tensor[i, 0] == 0 else [0]
+        counts.extend(btw_idxs.tolist())
+        out.append({"size": [h, w], "counts": counts})
+    return out
+
+
+def _random_masks(b, h, w, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    masks = torch.rand(b, h, w, generator=generator) > 0.6
+    masks[0] = False  # empty mask
+    masks[1] = True  # full mask
+    masks[2, 0, 0] = True  # starting with foreground
+    masks[3, -1, -1] = True  # ending with foreground
+    return masks
+
+
+def test_from_masks_matches_reference():
+    masks = _random_masks(6, 13, 17)
+    rles = FlatRLE.from_masks(masks)
+    assert rles.to_rles() == _reference_mask_to_rle(masks)
+    assert mask_to_rle_pytorch(masks) == _reference_mask_to_rle(masks)
+    assert np.array_equal(rles.decode(), masks.numpy())
+    for i, rle in enumerate(rles.to_rles()):
+        assert np.array_equal(rle_to_mask(rle), masks[i].numpy())
+    assert rles.areas().tolist() == [area_from_rle(r) for r in rles.to_rles()]
+
+
+@pytest.mark.parametrize(
+    "crop_box",
+    [[0, 0, 9, 20], [4, 0, 13, 20], [0, 5, 17, 14], [3, 6, 12, 15], [0, 0, 17, 20]],
+)
+def test_from_masks_in_crop_matches_uncropped(crop_box):
+    orig_h, orig_w = 20, 17
+    x0, y0, x1, y1 = crop_box
+    masks = _random_masks(5, y1 - y0, x1 - x0, seed=1)
+    rles = FlatRLE.from_masks(masks, crop_box=crop_box, orig_size=(orig_h, orig_w))
+    full_masks = uncrop_masks(masks, crop_box, orig_h, orig_w)
+    assert rles.size == [orig_h, orig_w]
+    assert rles.to_rles() == _reference_mask_to_rle(full_masks)
+
+
+def test_index_and_cat():
+    masks = _random_masks(6, 8, 11)
+    rles = FlatRLE.from_masks(masks)
+    ref = _reference_mask_to_rle(masks)
+    assert rles.index([4, 1, 1]).to_rles() == [ref[4], ref[1], ref[1]]
+    keep = np.array([True, False, True, False, False, True])
+    assert rles.index(keep).to_rles() == [ref[0], ref[2], ref[5]]
+    assert len(rles.index([])) == 0
+    cat = FlatRLE.cat([rles.index([0, 1]), FlatRLE.empty(rles.size), rles.index([5])])
+    assert cat.to_rles() == [ref[0], ref[1], ref[5]]
+    assert FlatRLE.from_rles(ref).to_rles() == ref
+
+
+def test_coco_round_trip():
+    masks = _random_masks(6, 31, 23)
+    # a mask with long runs, whose counts take several chars in the COCO string
+    masks[4] = False
+    masks[4, :, 5:] = True
+    rles = FlatRLE.from_masks(masks)
+    coco_rles = rles.to_coco()
+    assert all(isinstance(rle["counts"], str) for rle in coco_rles)
+    assert FlatRLE.from_coco(coco_rles).to_rles() == rles.to_rles()
+
+
+def test_coco_matches_pycocotools():
+    mask_utils = pytest.importorskip("pycocotools.mask")
+    masks = _random_masks(6, 31, 23)
+    masks[4] = False
+    masks[4, :, 5:] = True
+    rles = FlatRLE.from_masks(masks)
+    coco_rles = rles.to_coco()
+    for i, (rle, coco_rle) in enumerate(zip(rles.to_rles(), coco_rles)):
+        ref = mask_utils.frPyObjects(rle, *rle["size"])
+        assert coco_rle["counts"] == ref["counts"].decode("utf-8")
+        assert np.array_equal(mask_utils.decode(coco_rle), masks[i].numpy())
+
+
+def _reference_mask_data(batches, keeps):
+    """The rows left by concatenating `batches` and filtering each by its `keeps`."""
+    columns = {}
+    for batch, keep in zip(batches, keeps):
+        for k, v in batch.items():
+            if isinstance(v, FlatRLE):
+                v = v.to_rles()
+            elif isinstance(v, (torch.Tensor, np.ndarray)):
+                v = v.tolist()
+            v = [v[i] for i in range(len(v)) if keep[i]]
+            columns[k] = columns.get(k, []) + list(v)
+    return columns
+
+
+def _mask_data_batch(n, seed):
+    generator = torch.Generator().manual_seed(seed)
+    masks = torch.rand(n, 6, 7, generator=generator) > 0.5
+    return {
+        "rles": FlatRLE.from_masks(masks),
+        "iou_preds": torch.rand(n, generator=generator),
+        "boxes": torch.randint(0, 7, (n, 4), generator=generator),
+        "points": np.random.default_rng(seed).random((n, 2)),
+        "names": [f"{seed}-{i}" for i in range(n)],
+    }
+
+
+def _as_lists(data):
+    out = {}
+    for k, v in data.items():
+        if isinstance(v, FlatRLE):
+            out[k] = v.to_rles()
+        elif isinstance(v, (torch.Tensor, np.ndarray)):
+            out[k] = v.tolist()
+        else:
+            out[k] = list(v)
+    return out
+
+
+def test_mask_data_cat_and_filter():
+    batches = [_mask_data_batch(n, seed) for seed, n in enumerate([3, 0, 5, 9, 1])]
+    keeps = []
+    data = MaskData()
+    for i, batch in enumerate(batches):
+        new_data = MaskData(**batch)
+        keep = torch.arange(len(batch["iou_preds"])) % 2 == i % 2
+        new_data.filter(keep)
+        keeps.append(keep.tolist())
+        data.cat(new_data)
+    assert _as_lists(data) == _reference_mask_data(batches, keeps)
+    assert len(data["boxes"]) == sum(sum(keep) for keep in keeps)
+
+
+def test_mask_data_filters_compose():
+    batch = _mask_data_batch(10, seed=0)
+    data = MaskData(**batch)
+    data.filter(torch.tensor([9, 2, 4, 5, 7]))
+    data.filter(np.array([True, False, True, True, False]))
+    data.filter([2, 0])
+    ref = {k: [v[i] for i in [5, 9]] for k, v in _as_lists(MaskData(**batch)).items()}
+    assert _as_lists(data) == ref
+
+
+def test_mask_data_to_numpy():
+    data = MaskData(**_mask_data_batch(4, seed=0))
+    data.cat(MaskData(**_mask_data_batch(3, seed=1)))
+    ref = _as_lists(data)
+    data.to_numpy()
+    for k in ["iou_preds", "boxes"]:
+        assert isinstance(data[k], np.ndarray)
+        assert data[k].dtype == np.float32
+        assert np.allclose(data[k], np.asarray(ref[k], dtype=np.float32))
+    # the buffers were grown past the number of rows, which must not show up
+    assert len(data["boxes"]) == 7
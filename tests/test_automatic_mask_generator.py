@@ -0,0 +1,69 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("cv2")
+pytest.importorskip("hydra")
+
+from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
+from sam2.utils.amg import batched_mask_to_box, FlatRLE, MaskData
+
+
+def _mask_data_with_island():
+    """Mask data (as left by `_generate_masks`) of a square with a small island."""
+    masks = torch.zeros(2, 32, 32, dtype=torch.bool)
+    masks[0, 4:20, 4:20] = True
+    masks[0, 28:30, 28:30] = True  # 4-pixel island
+    masks[1, 22:26, 2:12] = True  # no small regions
+    data = MaskData(
+        rles=FlatRLE.from_masks(masks),
+        boxes=batched_mask_to_box(masks),
+        iou_preds=torch.tensor([0.9, 0.8]),
+        points=torch.tensor([[10.0, 10.0], [5.0, 24.0]]),
+        stability_score=torch.tensor([0.97, 0.96]),
+        crop_boxes=torch.tensor([[0, 0, 32, 32], [0, 0, 32, 32]]),
+    )
+    data.to_numpy()
+    return data
+
+
+def _make_generator(mask_data, min_mask_region_area):
+    # bypass the model: only the postprocessing and encoding of `generate` are tested
+    generator = SAM2AutomaticMaskGenerator.__new__(SAM2AutomaticMaskGenerator)
+    generator.min_mask_region_area = min_mask_region_area
+    generator.box_nms_thresh = 0.7
+    generator.crop_nms_thresh = 0.7
+    generator.output_mode = "binary_mask"
+    generator._generate_masks = lambda image, ignore_mask=None: mask_data
+    return generator
+
+
+def test_generate_removes_small_islands():
+    generator = _make_generator(_mask_data_with_island(), min_mask_region_area=10)
+    records = generator.generate(np.zeros((32, 32, 3), dtype=np.uint8))
+
+    assert len(records) == 2
+    by_iou = {round(r["predicted_iou"], 2): r for r in records}
+    square = by_iou[0.9]
+    assert not square["segmentation"][28:30, 28:30].any()
+    assert square["area"] == 16 * 16
+    assert square["bbox"] == [4.0, 4.0, 15.0, 15.0]
+    other = by_iou[0.8]
+    assert other["area"] == 4 * 10
+    assert other["bbox"] == [2.0, 22.0, 9.0, 3.0]
+
+
+def test_postprocess_small_regions_with_tensor_boxes():
+    data = _mask_data_with_island()
+    data["boxes"] = torch.from_numpy(data["boxes"])
+    data = SAM2AutomaticMaskGenerator.postprocess_small_regions(data, 10, 0.7)
+    boxes = data["boxes"]
+    assert isinstance(boxes, torch.Tensor)
+    assert sorted(boxes.tolist()) == [[2.0, 22.0, 11.0, 25.0], [4.0, 4.0, 19.0, 19.0]]
@@ -0,0 +1,151 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+from PIL import Image
+from sam2 import automatic_video_mask_generator
+from sam2.automatic_video_mask_generator import SAM2AutomaticVideoMaskGenerator
+
+NUM_FRAMES = 10
+VIDEO_H, VIDEO_W = 32, 48
+KEYFRAME_INTERVAL = 4
+
+
+def _box_mask(x0, y0, x1, y1):
+    mask = np.zeros((VIDEO_H, VIDEO_W), dtype=bool)
+    mask[y0:y1, x0:x1] = True
+    return mask
+
+
+SQUARE_A = _box_mask(2, 2, 12, 12)
+SQUARE_B = _box_mask(20, 2, 30, 12)
+SQUARE_C = _box_mask(30, 20, 40, 30)
+
+
+class _FakeMaskGenerator:
+    """Returns the masks of `masks_per_frame` on the frame found in the image."""
+
+    masks_per_frame = {}
+
+    def __init__(self, predictor, output_mode, **kwargs):
+        assert output_mode == "binary_mask"
+        self.calls = []
+
+    def generate(self, image, ignore_mask=None):
+        # the frames are filled with their index (see `video_state`)
+        frame_idx = int(image[0, 0, 0])
+        self.calls.append((frame_idx, ignore_mask))
+        return [
+            {"segmentation": mask, "area": int(mask.sum()), "predicted_iou": iou}
+            for mask, iou in self.masks_per_frame.get(frame_idx, [])
+        ]
+
+
+class _FakeVideoPredictor:
+    """A tracker that keeps the masks added on the start frame for all the frames."""
+
+    def __init__(self):
+        self.added_masks = []
+        self.masks = {}
+
+    def reset_state(self, inference_state):
+        self.masks = {}
+
+    def add_new_mask(self, inference_state, frame_idx, obj_id, mask):
+        self.added_masks.append((frame_idx, obj_id))
+        self.masks[obj_id] = mask
+
+    def propagate_in_video(self, inference_state, start_frame_idx):
+        obj_ids = list(self.masks)
+        masks = torch.from_numpy(np.stack([self.masks[i] for i in obj_ids]))[:, None]
+        for frame_idx in range(start_frame_idx, inference_state["num_frames"]):
+            yield frame_idx, obj_ids, torch.where(masks, 10.0, -10.0)
+
+
+@pytest.fixture
+def video_state(tmp_path):
+    img_paths = []
+    for frame_idx in range(NUM_FRAMES):
+        img = np.full((VIDEO_H, VIDEO_W, 3), frame_idx, dtype=np.uint8)
+        img_paths.append(str(tmp_path / f"frame_{frame_idx:05d}.png"))
+        Image.fromarray(img).save(img_paths[-1])
+    return {"num_frames": NUM_FRAMES, "img_paths": img_paths}
+
+
+def _make_generator(monkeypatch, masks_per_frame, **kwargs):
+    monkeypatch.setattr(_FakeMaskGenerator, "masks_per_frame", masks_per_frame)
+    monkeypatch.setattr(
+        automatic_video_mask_generator,
+        "SAM2AutomaticMaskGenerator",
+        _FakeMaskGenerator,
+    )
+    return SAM2AutomaticVideoMaskGenerator(
+        _FakeVideoPredictor(),
+        keyframe_interval=KEYFRAME_INTERVAL,
+        min_new_mask_area=20,
+        **kwargs,
+    )
+
+
+def test_generate_adds_new_objects_on_keyframes(monkeypatch, video_state):
+    masks_per_frame = {
+        0: [
+            (SQUARE_A, 0.9),
+            (SQUARE_B, 0.8),
+            (_box_mask(3, 3, 11, 12), 0.7),  # mostly on A
+            (_box_mask(40, 25, 42, 27), 0.95),  # too small
+        ],
+        # a new object, and the tracked objects found again
+        4: [(SQUARE_A, 0.99), (SQUARE_C, 0.9), (_box_mask(20, 4, 30, 12), 0.8)],
+        8: [(SQUARE_C, 0.9)],
+    }
+    generator = _make_generator(monkeypatch, masks_per_frame)
+    video_segments = generator.generate(video_state)
+
+    # every frame has an output, and the ids of the tracked objects are kept
+    # when the tracking restarts on the keyframe with the new object
+    assert sorted(video_segments) == list(range(NUM_FRAMES))
+    predictor = generator.predictor
+    assert predictor.added_masks == [(0, 0), (0, 1), (4, 0), (4, 1), (4, 2)]
+    for frame_idx, masks in video_segments.items():
+        ref = {0: SQUARE_A, 1: SQUARE_B}
+        if frame_idx >= 4:
+            ref[2] = SQUARE_C
+        assert sorted(masks) == sorted(ref)
+        for obj_id, mask in masks.items():
+            assert np.array_equal(mask, ref[obj_id])
+
+    # the keyframes after the first one are searched outside the tracked objects
+    calls = generator.mask_generator.calls
+    assert [frame_idx for frame_idx, _ in calls] == [0, 4, 8]
+    assert calls[0][1] is None
+    assert np.array_equal(calls[1][1], SQUARE_A | SQUARE_B)
+    assert np.array_equal(calls[2][1], SQUARE_A | SQUARE_B | SQUARE_C)
+
+
+def test_generate_waits_for_the_first_objects(monkeypatch, video_state):
+    generator = _make_generator(monkeypatch, {4: [(SQUARE_A, 0.9)]})
+    video_segments = generator.generate(video_state)
+    assert sorted(video_segments) == list(range(NUM_FRAMES))
+    assert all(video_segments[frame_idx] == {} for frame_idx in range(4))
+    assert all(sorted(video_segments[i]) == [0] for i in range(4, NUM_FRAMES))
+    assert generator.predictor.added_masks == [(4, 0)]
+
+
+def test_generate_with_max_num_objects(monkeypatch, video_state):
+    masks_per_frame = {0: [(SQUARE_A, 0.9), (SQUARE_B, 0.8)], 4: [(SQUARE_C, 0.9)]}
+    generator = _make_generator(monkeypatch, masks_per_frame, max_num_objects=1)
+    video_segments = generator.generate(video_state)
+    assert sorted(video_segments) == list(range(NUM_FRAMES))
+    assert all(list(masks) == [0] for masks in video_segments.values())
+    assert all(np.array_equal(m[0], SQUARE_A) for m in video_segments.values())
+    # no more objects can be added, so the other keyframes are not searched
+    assert [frame_idx for frame_idx, _ in generator.mask_generator.calls] == [0]
@@ -0,0 +1,94 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+import torch.nn as nn
+from sam2 import build_sam
+from sam2.build_sam import _INIT_FNS, build_sam2, clear_model_cache
+
+CONFIG = "sam2_hiera_t.yaml"
+OVERRIDES = ["++model.image_size=256"]
+
+
+def _build(ckpt_path=None, **kwargs):
+    return build_sam2(
+        CONFIG, ckpt_path, device="cpu", hydra_overrides_extra=OVERRIDES, **kwargs
+    )
+
+
+@pytest.fixture(scope="module")
+def checkpoint(tmp_path_factory):
+    """A checkpoint of a randomly initialized model, and the model itself."""
+    torch.manual_seed(0)
+    model = _build()
+    ckpt_path = tmp_path_factory.mktemp("checkpoints") / "sam2_hiera_tiny.pt"
+    torch.save({"model": model.state_dict()}, ckpt_path)
+    return str(ckpt_path), model
+
+
+def _init_fns():
+    return {name: getattr(nn.init, name) for name in _INIT_FNS}
+
+
+@pytest.mark.parametrize("fast_load", [True, False])
+def test_load_checkpoint(checkpoint, fast_load):
+    ckpt_path, ref_model = checkpoint
+    init_fns = _init_fns()
+    # a different seed, so that the random init alone does not give the same weights
+    torch.manual_seed(1)
+    model = _build(ckpt_path, fast_load=fast_load)
+    assert _init_fns() == init_fns
+    assert not model.training
+
+    params, ref_params = dict(model.named_parameters()), ref_model.named_parameters()
+    for name, ref_param in ref_params:
+        assert torch.equal(params[name], ref_param), name
+    buffers, ref_buffers = dict(model.named_buffers()), ref_model.named_buffers()
+    for name, ref_buffer in ref_buffers:
+        assert torch.equal(buffers[name], ref_buffer), name
+
+
+def test_skip_weight_init_restores_init_fns(checkpoint, monkeypatch):
+    ckpt_path, _ = checkpoint
+    init_fns = _init_fns()
+    with build_sam._skip_weight_init():
+        tensor = torch.zeros(3)
+        assert nn.init.normal_(tensor) is tensor
+        assert torch.equal(tensor, torch.zeros(3))
+    assert _init_fns() == init_fns
+
+    def failing_instantiate(*args, **kwargs):
+        # the init functions are disabled while the model is created
+        assert all(getattr(nn.init, name) is not fn for name, fn in init_fns.items())
+        raise RuntimeError("instantiation failed")
+
+    monkeypatch.setattr(build_sam, "instantiate", failing_instantiate)
+    with pytest.raises(RuntimeError, match="instantiation failed"):
+        _build(ckpt_path, fast_load=True)
+    assert _init_fns() == init_fns
+
+
+def test_model_cache(checkpoint, monkeypatch):
+    ckpt_path, _ = checkpoint
+    clear_model_cache()
+    model = _build(ckpt_path, use_cache=True)
+    assert _build(ckpt_path, use_cache=True) is model
+    # the checkpoint is identified by its absolute path
+    monkeypatch.chdir(os.path.dirname(ckpt_path))
+    assert _build("sam2_hiera_tiny.pt", use_cache=True) is model
+    assert _build(ckpt_path) is not model
+    assert _build(ckpt_path, use_cache=True, mode="train") is not model
+    assert _build(use_cache=True) is not model
+
+    clear_model_cache()
+    assert _build(ckpt_path, use_cache=True) is not model
+    clear_model_cache()
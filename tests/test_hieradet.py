@@ -0,0 +1,147 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+import torch.nn as nn
+import torch.nn.functional as F
+from sam2.modeling.backbones import hieradet
+from sam2.modeling.backbones.hieradet import (
+    do_pool,
+    MultiScaleAttention,
+    MultiScaleBlock,
+)
+from sam2.modeling.backbones.utils import (
+    window_partition,
+    window_partition_strided,
+    window_unpartition,
+    window_unpartition_strided,
+)
+
+# (B, H, W, C) shapes and window sizes, with padding on both sides, on one side only,
+# within a single window and without padding
+SHAPES_AND_WINDOW_SIZES = [
+    ((1, 32, 32, 8), 14),
+    ((2, 14, 30, 4), 7),
+    ((2, 30, 14, 4), 7),
+    ((2, 5, 3, 4), 8),
+    ((2, 28, 28, 8), 14),
+]
+
+
+def _randn(*shape, seed=0):
+    return torch.randn(*shape, generator=torch.Generator().manual_seed(seed))
+
+
+@pytest.mark.parametrize("shape, window_size", SHAPES_AND_WINDOW_SIZES)
+def test_window_partition_strided_matches_padded(shape, window_size):
+    x = _randn(*shape)
+    ref_windows, ref_pad_hw = window_partition(x, window_size)
+    windows, pad_hw = window_partition_strided(x, window_size)
+    assert pad_hw == ref_pad_hw
+    assert torch.equal(windows, ref_windows)
+
+    # the padding tokens take the given value instead of zeros
+    B, H, W, C = shape
+    pad_value = _randn(C, seed=1)
+    padded = pad_value.expand(B, *pad_hw, C).clone()
+    padded[:, :H, :W] = x
+    windows, _ = window_partition_strided(x, window_size, pad_value)
+    assert torch.equal(windows, window_partition(padded, window_size)[0])
+
+
+@pytest.mark.parametrize("shape, window_size", SHAPES_AND_WINDOW_SIZES)
+def test_window_unpartition_strided_matches_padded(shape, window_size):
+    x = _randn(*shape)
+    windows, pad_hw = window_partition(x, window_size)
+    windows = windows * 2 + 1  # nonzero padding tokens, which must be dropped
+    hw = shape[1:3]
+    out = window_unpartition_strided(windows, window_size, hw)
+    assert torch.equal(out, window_unpartition(windows, window_size, pad_hw, hw))
+    # round trip
+    windows, _ = window_partition_strided(x, window_size)
+    assert torch.equal(window_unpartition_strided(windows, window_size, hw), x)
+
+
+@pytest.mark.parametrize("shape, window_size", SHAPES_AND_WINDOW_SIZES)
+def test_forward_windowed_matches_padded_attention(shape, window_size):
+    torch.manual_seed(0)
+    C = shape[-1]
+    attn = MultiScaleAttention(C, C, num_heads=2)
+    x = _randn(*shape)
+    with torch.no_grad():
+        windows, pad_hw = window_partition(x, window_size)
+        ref = window_unpartition(attn(windows), window_size, pad_hw, shape[1:3])
+        out = attn.forward_windowed(x, window_size)
+    assert out.shape == ref.shape
+    assert torch.allclose(out, ref, atol=1e-5)
+
+
+def _block_pair(**kwargs):
+    torch.manual_seed(0)
+    block = MultiScaleBlock(fast_window_attn=True, **kwargs).eval()
+    ref_block = MultiScaleBlock(fast_window_attn=False, **kwargs).eval()
+    ref_block.load_state_dict(block.state_dict())
+    return block, ref_block
+
+
+@pytest.mark.parametrize("shape, window_size", SHAPES_AND_WINDOW_SIZES)
+def test_multi_scale_block_fast_window_attn(shape, window_size):
+    C = shape[-1]
+    block, ref_block = _block_pair(
+        dim=C, dim_out=C, num_heads=2, window_size=window_size
+    )
+    x = _randn(*shape)
+    with torch.no_grad():
+        assert torch.allclose(block(x), ref_block(x), atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "shape, pool",
+    [
+        ((2, 16, 12, 4), nn.MaxPool2d(2, 2)),
+        ((1, 32, 32, 3), nn.MaxPool2d((4, 2), (4, 2))),
+        # not tiling: odd sizes, overlapping windows and padding
+        ((2, 15, 12, 4), nn.MaxPool2d(2, 2)),
+        ((2, 16, 12, 4), nn.MaxPool2d(3, 2)),
+        ((2, 16, 12, 4), nn.MaxPool2d(2, 2, padding=1)),
+    ],
+)
+def test_do_pool_matches_max_pool2d(shape, pool):
+    x = _randn(*shape)
+    ref = F.max_pool2d(
+        x.permute(0, 3, 1, 2),
+        pool.kernel_size,
+        pool.stride,
+        pool.padding,
+        pool.dilation,
+    ).permute(0, 2, 3, 1)
+    assert torch.equal(do_pool(x, pool), ref)
+    norm = nn.LayerNorm(shape[-1])
+    assert torch.allclose(do_pool(x, pool, norm), norm(ref))
+
+
+@pytest.mark.parametrize(
+    "shape, window_size", [((2, 28, 28, 8), 14), ((1, 32, 32, 8), 8)]
+)
+def test_multi_scale_block_with_q_pooling(shape, window_size, monkeypatch):
+    # a block at a stage change, whose Q pooling tiles the feature map
+    C = shape[-1]
+    block, _ = _block_pair(
+        dim=C, dim_out=2 * C, num_heads=2, q_stride=(2, 2), window_size=window_size
+    )
+    x = _randn(*shape)
+    assert hieradet._is_tiling_max_pool(block.pool, *shape[1:3])
+    with torch.no_grad():
+        out = block(x)
+        monkeypatch.setattr(hieradet, "_is_tiling_max_pool", lambda *args: False)
+        ref = block(x)
+    B, H, W, _ = shape
+    assert out.shape == (B, H // 2, W // 2, 2 * C)
+    assert torch.allclose(out, ref, atol=1e-6)
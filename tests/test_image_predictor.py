@@ -0,0 +1,218 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("hydra")
+
+from sam2.build_sam import build_sam2
+from sam2.sam2_image_predictor import SAM2ImagePredictor
+
+IMAGE_SIZE = 256
+IMAGE_H, IMAGE_W = 300, 400
+TILE_OVERLAP = 64
+# the tiles of a 300x400 image (with 256x256 tiles overlapping by 64 pixels)
+TILE_BOXES = [
+    (0, 0, 256, 256),
+    (144, 0, 400, 256),
+    (0, 44, 256, 300),
+    (144, 44, 400, 300),
+]
+
+
+@pytest.fixture(scope="module")
+def predictor():
+    # a randomly initialized tiny model at a small resolution (only the routing and
+    # the shapes of the outputs are tested, not the quality of the masks)
+    torch.manual_seed(0)
+    model = build_sam2(
+        "sam2_hiera_t.yaml",
+        device="cpu",
+        hydra_overrides_extra=[f"++model.image_size={IMAGE_SIZE}"],
+    )
+    predictor = SAM2ImagePredictor(model)
+    predictor._bb_feat_sizes = [(IMAGE_SIZE // s,) * 2 for s in [4, 8, 16]]
+    return predictor
+
+
+def _image(h, w, seed=0):
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:h, 0:w]
+    img = np.stack([xs % 256, ys % 256, rng.integers(0, 256, (h, w))], axis=-1)
+    return img.astype(np.uint8)
+
+
+@pytest.fixture
+def tiled_predictor(predictor):
+    predictor.set_image_tiled(_image(IMAGE_H, IMAGE_W), tile_overlap=TILE_OVERLAP)
+    return predictor
+
+
+@pytest.mark.parametrize(
+    "length, tile_size, tile_overlap",
+    [(100, 256, 64), (256, 256, 64), (300, 256, 64), (1000, 256, 64), (513, 256, 0)],
+)
+def test_tile_starts_cover_the_image(length, tile_size, tile_overlap):
+    starts = SAM2ImagePredictor._get_tile_starts(length, tile_size, tile_overlap)
+    assert starts[0] == 0
+    assert starts == sorted(set(starts))
+    if length <= tile_size:
+        assert starts == [0]
+        return
+    assert starts[-1] + tile_size == length
+    # neighboring tiles overlap by at least `tile_overlap` (so there are no gaps)
+    assert all(b - a <= tile_size - tile_overlap for a, b in zip(starts, starts[1:]))
+
+
+def test_set_image_tiled(tiled_predictor):
+    assert tiled_predictor._tile_boxes == TILE_BOXES
+    assert tiled_predictor._tiled_hw == (IMAGE_H, IMAGE_W)
+    assert tiled_predictor._orig_hw == [(256, 256)] * len(TILE_BOXES)
+    assert tiled_predictor._features["image_embed"].size(0) == len(TILE_BOXES)
+
+
+def test_predict_tiled_checks_inputs(predictor):
+    predictor.reset_predictor()
+    with pytest.raises(RuntimeError):
+        predictor.predict_tiled(box=np.array([0, 0, 10, 10]))
+    predictor.set_image_tiled(_image(IMAGE_H, IMAGE_W), tile_overlap=TILE_OVERLAP)
+    with pytest.raises(ValueError):
+        predictor.predict_tiled()
+
+
+def _record_tile_inds(predictor, monkeypatch):
+    """Record the tiles the prompts of each `predict_tiled` call are routed to."""
+    calls = []
+    predict_batch = predictor._predict_batch
+
+    def _recording_predict_batch(prompts_per_image, *args, img_inds=None, **kwargs):
+        calls.append((img_inds, prompts_per_image))
+        return predict_batch(prompts_per_image, *args, img_inds=img_inds, **kwargs)
+
+    monkeypatch.setattr(predictor, "_predict_batch", _recording_predict_batch)
+    return calls
+
+
+@pytest.mark.parametrize(
+    "point, tile_inds",
+    [((20, 20), [0]), ((390, 20), [1]), ((390, 290), [3]), ((200, 150), [0, 1, 2, 3])],
+)
+def test_predict_tiled_routes_points_to_their_tiles(
+    tiled_predictor, monkeypatch, point, tile_inds
+):
+    calls = _record_tile_inds(tiled_predictor, monkeypatch)
+    masks, _ = tiled_predictor.predict_tiled(
+        point_coords=np.array([point]), point_labels=np.array([1]), return_logits=True
+    )
+    assert len(calls) == 1 and calls[0][0] == tile_inds
+    for tile_idx, (coords, labels, box, mask_input) in zip(tile_inds, calls[0][1]):
+        # the point is in the tile's pixels (tiles are not resized)
+        x0, y0 = TILE_BOXES[tile_idx][:2]
+        assert coords.tolist() == [[[point[0] - x0, point[1] - y0]]]
+        assert labels.tolist() == [[1]] and box is None and mask_input is None
+    # the pixels outside the tiles of the object are background
+    covered = np.zeros((IMAGE_H, IMAGE_W), dtype=bool)
+    for x0, y0, x1, y1 in [TILE_BOXES[i] for i in tile_inds]:
+        covered[y0:y1, x0:x1] = True
+    assert (masks[0][~covered] == -32.0).all()
+
+
+def test_predict_tiled_routes_boxes_to_their_tiles(tiled_predictor, monkeypatch):
+    calls = _record_tile_inds(tiled_predictor, monkeypatch)
+    boxes = np.array([[10, 10, 100, 40], [300, 100, 390, 290]], dtype=np.float32)
+    tiled_predictor.predict_tiled(box=boxes)
+    # the first box is only in the first tile, and the second box in the right ones
+    assert calls[0][0] == [0, 1, 3]
+    unnorm_boxes = [box for _, _, box, _ in calls[0][1]]
+    assert unnorm_boxes[0].tolist() == [[[10, 10], [100, 40]]]
+    # the second box is clipped to the first right tile, which ends at y=256
+    assert unnorm_boxes[1].tolist() == [[[156, 100], [246, 256]]]
+    assert unnorm_boxes[2].tolist() == [[[156, 56], [246, 246]]]
+
+
+@pytest.mark.parametrize("multimask_output", [False, True])
+def test_predict_tiled_output_shapes(tiled_predictor, multimask_output):
+    num_masks = 3 if multimask_output else 1
+    masks, ious = tiled_predictor.predict_tiled(
+        point_coords=np.array([[200, 150], [20, 20]]),
+        point_labels=np.array([1, 0]),
+        multimask_output=multimask_output,
+    )
+    assert masks.shape == (num_masks, IMAGE_H, IMAGE_W)
+    assert ious.shape == (num_masks,)
+    assert masks.dtype == np.float32 and set(np.unique(masks)) <= {0.0, 1.0}
+
+    masks, ious = tiled_predictor.predict_tiled(
+        box=np.array([[10, 10, 100, 40], [150, 50, 390, 290], [0, 0, 400, 300]]),
+        multimask_output=multimask_output,
+    )
+    assert masks.shape == (3, num_masks, IMAGE_H, IMAGE_W)
+    assert ious.shape == (3, num_masks)
+
+    masks, ious = tiled_predictor.predict_tiled(
+        point_coords=np.array([[[20, 20]], [[390, 290]]]),
+        point_labels=np.array([[1], [1]]),
+        box=np.array([[0, 0, 60, 60], [350, 250, 400, 300]]),
+        multimask_output=multimask_output,
+    )
+    assert masks.shape == (2, num_masks, IMAGE_H, IMAGE_W)
+    assert ious.shape == (2, num_masks)
+
+
+def test_predict_tiled_with_a_single_tile_matches_predict_batch(predictor):
+    image = _image(IMAGE_SIZE, IMAGE_SIZE, seed=1)
+    point_coords, point_labels = np.array([[100, 120]]), np.array([1])
+    predictor.set_image_batch([image])
+    ref_masks, ref_ious, _ = predictor.predict_batch(
+        [point_coords], [point_labels], return_logits=True
+    )
+    predictor.set_image_tiled(image)
+    assert predictor._tile_boxes == [(0, 0, IMAGE_SIZE, IMAGE_SIZE)]
+    masks, ious = predictor.predict_tiled(
+        point_coords, point_labels, multimask_output=True, return_logits=True
+    )
+    assert np.allclose(masks, ref_masks[0], atol=1e-4)
+    assert np.allclose(ious, ref_ious[0], atol=1e-5)
+
+
+def test_predict_batch_with_img_inds(predictor):
+    # images of different sizes, to check the masks are resized to their own image
+    predictor.set_image_batch([_image(200, 300, seed=2), _image(256, 180, seed=3)])
+    prompts = [
+        ([[50, 60]], [1], None),
+        ([[120, 30]], [1], None),
+        (None, None, [[10, 20, 150, 100]]),
+    ]
+    img_inds = [1, 0, 1]
+    prompts_per_item = []
+    for (coords, labels, box), img_idx in zip(prompts, img_inds):
+        _, unnorm_coords, labels, unnorm_box = predictor._prep_prompts(
+            None if coords is None else np.array(coords),
+            None if labels is None else np.array(labels),
+            None if box is None else np.array(box),
+            None,
+            True,
+            img_idx=img_idx,
+        )
+        prompts_per_item.append((unnorm_coords, labels, unnorm_box, None))
+    outputs = predictor._predict_batch(
+        prompts_per_item, return_logits=True, img_inds=img_inds
+    )
+
+    assert len(outputs) == len(prompts)
+    for item_idx, img_idx in enumerate(img_inds):
+        # each item matches its prompts alone on its own image
+        ref_masks, ref_ious, _ = predictor._predict(
+            *prompts_per_item[item_idx][:3], return_logits=True, img_idx=img_idx
+        )
+        masks, ious, _ = outputs[item_idx]
+        assert masks.shape == ref_masks.shape
+        assert masks.shape[-2:] == predictor._orig_hw[img_idx]
+        assert torch.allclose(masks, ref_masks, atol=1e-4)
+        assert torch.allclose(ious, ref_ious, atol=1e-5)
@@ -0,0 +1,81 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+from sam2.utils.misc import (
+    AsyncMaskPacker,
+    get_connected_components,
+    pack_mask_bits,
+    unpack_mask_bits,
+)
+
+DEVICES = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+
+@pytest.mark.parametrize("device", DEVICES)
+@pytest.mark.parametrize("shape", [(2, 1, 16, 8), (3, 1, 7, 5), (1, 1, 1, 1)])
+def test_pack_mask_bits_round_trip(device, shape):
+    masks = torch.rand(shape, generator=torch.Generator().manual_seed(0)) > 0.5
+    packed = pack_mask_bits(masks.to(device)).cpu().numpy()
+    assert packed.dtype == np.uint8
+    assert np.array_equal(packed, np.packbits(masks.numpy()))
+    assert np.array_equal(unpack_mask_bits(packed, shape), masks.numpy())
+
+
+@pytest.mark.parametrize("device", DEVICES)
+@pytest.mark.parametrize("num_buffers", [2, 3])
+def test_async_mask_packer(device, num_buffers):
+    generator = torch.Generator().manual_seed(0)
+    # the number of objects (and so the packed size) changes between frames
+    frames = [torch.randn(1 + i % 3, 1, 9, 13, generator=generator) for i in range(7)]
+    packer = AsyncMaskPacker(device, score_thresh=0.2, num_buffers=num_buffers)
+    outputs = []
+    for frame_idx, mask_logits in enumerate(frames):
+        out = packer.submit(frame_idx, mask_logits.to(device))
+        # each frame is returned once (num_buffers - 1) more frames are submitted
+        if frame_idx < num_buffers - 1:
+            assert out is None
+        else:
+            assert out is not None and out[0] == frame_idx - num_buffers + 1
+            outputs.append(out)
+    outputs.extend(packer.flush())
+    assert packer.flush() == []
+
+    assert [key for key, _ in outputs] == list(range(len(frames)))
+    for (_, masks), mask_logits in zip(outputs, frames):
+        assert masks.dtype == bool
+        assert np.array_equal(masks, (mask_logits > 0.2).numpy())
+
+
+def test_get_connected_components_cpu():
+    pytest.importorskip("cv2")
+    mask = torch.zeros(2, 1, 6, 8, dtype=torch.bool)
+    mask[0, 0, 0:2, 0:3] = True  # component of 6 pixels
+    mask[0, 0, 3:6, 5] = True  # component of 4 pixels (connected diagonally)
+    mask[0, 0, 2, 4] = True
+    # the second mask is empty
+    for batch in [mask, mask[:1]]:
+        labels, counts = get_connected_components(batch)
+        assert labels.dtype == counts.dtype == torch.int32
+        assert labels.shape == counts.shape == batch.shape
+        assert torch.equal(labels > 0, batch)
+        labels, counts = labels[0, 0], counts[0, 0]
+        assert labels[0, 0] != labels[5, 5]
+        assert len(labels[0:2, 0:3].unique()) == 1
+        assert len(labels[3:6, 5].unique()) == 1 and labels[2, 4] == labels[3, 5]
+        assert (counts[0:2, 0:3] == 6).all() and (counts[3:6, 5] == 4).all()
+        assert counts[2, 4] == 4 and counts.sum() == 6 * 6 + 4 * 4
+    labels, counts = get_connected_components(mask)
+    assert (labels[1] == 0).all() and (counts[1] == 0).all()
+
+    labels, counts = get_connected_components(torch.zeros(0, 1, 6, 8, dtype=torch.bool))
+    assert labels.shape == counts.shape == (0, 1, 6, 8)
+    assert labels.dtype == counts.dtype == torch.int32
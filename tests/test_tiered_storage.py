@@ -0,0 +1,123 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import random
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("hydra")
+
+from sam2.utils.tiered_storage import (
+    FrameOutputsObjectSlice,
+    slice_frame_output,
+    TieredFrameOutputs,
+)
+
+# the positional encoding is a constant of the session (expanded per object)
+POS_ENC = [torch.randn(1, 4, 2, 2)]
+
+
+def _frame_output(frame_idx, num_objs=3):
+    generator = torch.Generator().manual_seed(frame_idx)
+    return {
+        "maskmem_features": torch.randn(num_objs, 4, 2, 2, generator=generator),
+        "maskmem_pos_enc": [x.expand(num_objs, -1, -1, -1) for x in POS_ENC],
+        "pred_masks": torch.randn(num_objs, 1, 8, 8, generator=generator),
+        "obj_ptr": torch.randn(num_objs, 16, generator=generator),
+    }
+
+
+def _assert_same_output(out, ref):
+    assert out.keys() == ref.keys()
+    for k, v in ref.items():
+        if isinstance(v, list):
+            assert len(out[k]) == len(v)
+            assert all(torch.equal(a.cpu(), b) for a, b in zip(out[k], v))
+        else:
+            assert torch.equal(out[k].cpu(), v)
+
+
+def _assert_same_storage(storage, ref):
+    assert len(storage) == len(ref)
+    assert sorted(storage) == sorted(ref)
+    for frame_idx, out in ref.items():
+        assert frame_idx in storage
+        _assert_same_output(storage[frame_idx], out)
+
+
+def test_matches_dict(tmp_path):
+    storage = TieredFrameOutputs(tmp_path, "cpu", gpu_window=2, cpu_window=3)
+    ref = {}
+    rng = random.Random(0)
+    for step in range(200):
+        frame_idx = rng.randrange(20)
+        op = rng.choice(["set", "set", "get", "del", "pop", "prefetch"])
+        if op == "set":
+            storage[frame_idx] = _frame_output(frame_idx + 100 * step)
+            ref[frame_idx] = _frame_output(frame_idx + 100 * step)
+        elif op == "get" and frame_idx in ref:
+            _assert_same_output(storage[frame_idx], ref[frame_idx])
+        elif op == "del":
+            if frame_idx in ref:
+                del storage[frame_idx]
+                del ref[frame_idx]
+            else:
+                with pytest.raises(KeyError):
+                    del storage[frame_idx]
+        elif op == "pop":
+            out = storage.pop(frame_idx, None)
+            ref_out = ref.pop(frame_idx, None)
+            assert (out is None) == (ref_out is None)
+            if ref_out is not None:
+                _assert_same_output(out, ref_out)
+        elif op == "prefetch":
+            storage.prefetch([frame_idx, frame_idx + 1])
+        assert len(storage) == len(ref)
+    _assert_same_storage(storage, ref)
+
+    storage.clear()
+    assert len(storage) == 0
+    assert len(list(tmp_path.rglob("*.pt"))) == 0
+
+
+def test_pop_does_not_spill_other_frames(tmp_path):
+    storage = TieredFrameOutputs(tmp_path, "cpu", gpu_window=1, cpu_window=1)
+    for frame_idx in range(4):
+        storage[frame_idx] = _frame_output(frame_idx)
+    # frames 0 and 1 are on disk, 2 in CPU memory and 3 in the hot tier
+    assert list(storage._cold) == [0, 1]
+    storage.prefetch([1])
+    _assert_same_output(storage.pop(1), _frame_output(1))
+    _assert_same_output(storage.pop(0), _frame_output(0))
+    assert list(storage._warm) == [2] and list(storage._hot) == [3]
+    assert len(list(tmp_path.rglob("*.pt"))) == 0
+    with pytest.raises(KeyError):
+        storage.pop(0)
+    assert storage.pop(0, "missing") == "missing"
+
+
+def test_object_slices(tmp_path):
+    storage = TieredFrameOutputs(tmp_path, "cpu", gpu_window=1, cpu_window=1)
+    ref = {frame_idx: _frame_output(frame_idx) for frame_idx in range(5)}
+    obj_slices = [FrameOutputsObjectSlice(storage, obj_idx) for obj_idx in range(3)]
+    for frame_idx, out in ref.items():
+        storage[frame_idx] = _frame_output(frame_idx)
+        for obj_slice in obj_slices:
+            obj_slice[frame_idx] = slice_frame_output(out, obj_slice.obj_idx)
+    with pytest.raises(KeyError):
+        obj_slices[0][7] = slice_frame_output(ref[0], 0)
+
+    for obj_slice in obj_slices:
+        assert sorted(obj_slice) == sorted(ref)
+        for frame_idx, out in ref.items():
+            ref_obj_out = slice_frame_output(out, obj_slice.obj_idx)
+            _assert_same_output(obj_slice[frame_idx], ref_obj_out)
+        # removing a frame from a slice is a no-op until the parent removes it
+        del obj_slice[0]
+    assert 0 in storage
+    del storage[0]
+    assert all(0 not in obj_slice for obj_slice in obj_slices)
@@ -0,0 +1,238 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import pytest
+
+np = pytest.importorskip("numpy")
+torch = pytest.importorskip("torch")
+pytest.importorskip("torchvision")
+pytest.importorskip("cv2")
+pytest.importorskip("hydra")
+
+from PIL import Image
+from sam2.build_sam import build_sam2_video_predictor
+
+NUM_FRAMES = 10
+VIDEO_H, VIDEO_W = 96, 128
+BOXES = [[10.0, 20.0, 50.0, 70.0], [70.0, 10.0, 120.0, 50.0]]
+
+
+@pytest.fixture(scope="module")
+def predictor():
+    # a randomly initialized tiny model at a small resolution (only the equivalence of
+    # the different inference paths is tested, not the quality of the masks)
+    torch.manual_seed(0)
+    return build_sam2_video_predictor(
+        "sam2_hiera_t.yaml",
+        device="cpu",
+        hydra_overrides_extra=["++model.image_size=256"],
+    )
+
+
+@pytest.fixture(scope="module")
+def video_dir(tmp_path_factory):
+    """A short clip of two squares moving over a gradient, as JPEG frames."""
+    video_dir = tmp_path_factory.mktemp("video")
+    ys, xs = np.mgrid[0:VIDEO_H, 0:VIDEO_W]
+    for frame_idx in range(NUM_FRAMES):
+        img = np.stack([xs * 2, ys * 2, np.full_like(xs, 64)], axis=-1)
+        x0 = 15 + 3 * frame_idx
+        img[25:65, x0 : x0 + 35] = [230, 40, 40]
+        img[15:45, 75 - 2 * frame_idx : 115 - 2 * frame_idx] = [40, 40, 230]
+        Image.fromarray(img.astype(np.uint8)).save(
+            video_dir / f"frame_{frame_idx:05d}.jpg"
+        )
+    return str(video_dir)
+
+
+def _propagate(predictor, inference_state, **kwargs):
+    return {
+        frame_idx: (list(obj_ids), video_res_masks.clone())
+        for frame_idx, obj_ids, video_res_masks in predictor.propagate_in_video(
+            inference_state, **kwargs
+        )
+    }
+
+
+def _assert_close_masks(out, ref, atol=1e-4, max_flipped=1e-3):
+    """Mask logits that agree within `atol`, except for a few pixels near 0."""
+    assert out.shape == ref.shape
+    flipped = ((out > 0) != (ref > 0)).float().mean().item()
+    assert flipped <= max_flipped
+    close = torch.isclose(out, ref, atol=atol, rtol=1e-4)
+    assert close.float().mean().item() >= 1 - max_flipped
+
+
+def _assert_close_videos(out, ref, **kwargs):
+    assert sorted(out) == sorted(ref)
+    for frame_idx, (obj_ids, masks) in ref.items():
+        assert out[frame_idx][0] == obj_ids
+        _assert_close_masks(out[frame_idx][1], masks, **kwargs)
+
+
+def _add_boxes_one_by_one(predictor, inference_state, frame_idx, obj_ids, boxes):
+    for obj_id, box in zip(obj_ids, boxes):
+        out = predictor.add_new_points_or_box(
+            inference_state, frame_idx, obj_id, box=np.array(box, dtype=np.float32)
+        )
+    return out
+
+
+def test_add_new_boxes_matches_per_object_calls(predictor, video_dir):
+    state = predictor.init_state(video_path=video_dir, frame_paths=None)
+    ref_state = predictor.init_state(video_path=video_dir, frame_paths=None)
+
+    frame_idx, obj_ids, masks = predictor.add_new_boxes(state, 0, [3, 5], BOXES)
+    ref_frame_idx, ref_obj_ids, ref_masks = _add_boxes_one_by_one(
+        predictor, ref_state, 0, [3, 5], BOXES
+    )
+    assert frame_idx == ref_frame_idx == 0
+    assert list(obj_ids) == list(ref_obj_ids) == [3, 5]
+    assert masks.shape == (2, 1, VIDEO_H, VIDEO_W)
+    _assert_close_masks(masks, ref_masks)
+
+    _assert_close_videos(_propagate(predictor, state), _propagate(predictor, ref_state))
+
+
+@pytest.mark.parametrize("tracked", [False, True])
+def test_add_new_boxes_falls_back_to_per_object_calls(
+    predictor, video_dir, tracked, monkeypatch
+):
+    state = predictor.init_state(video_path=video_dir, frame_paths=None)
+    ref_state = predictor.init_state(video_path=video_dir, frame_paths=None)
+    predictor.add_new_boxes(state, 0, [0, 1], BOXES)
+    _add_boxes_one_by_one(predictor, ref_state, 0, [0, 1], BOXES)
+    if tracked:
+        # refine the tracked objects on a later frame
+        _propagate(predictor, state)
+        _propagate(predictor, ref_state)
+        frame_idx = 4
+    else:
+        # prompt the same frame again before tracking
+        frame_idx = 0
+
+    new_boxes = [[14.0, 22.0, 56.0, 70.0], [64.0, 12.0, 112.0, 48.0]]
+    calls = []
+    add_new_points_or_box = predictor.add_new_points_or_box
+
+    def _counting_add_new_points_or_box(*args, **kwargs):
+        calls.append(args[2] if len(args) > 2 else kwargs["obj_id"])
+        return add_new_points_or_box(*args, **kwargs)
+
+    with monkeypatch.context() as m:
+        m.setattr(predictor, "add_new_points_or_box", _counting_add_new_points_or_box)
+        _, obj_ids, masks = predictor.add_new_boxes(
+            state, frame_idx, [0, 1], new_boxes
+        )
+    assert calls == [0, 1]
+    _, ref_obj_ids, ref_masks = _add_boxes_one_by_one(
+        predictor, ref_state, frame_idx, [0, 1], new_boxes
+    )
+    assert list(obj_ids) == list(ref_obj_ids) == [0, 1]
+    _assert_close_masks(masks, ref_masks)
+    _assert_close_videos(_propagate(predictor, state), _propagate(predictor, ref_state))
+
+
+def test_add_new_boxes_checks_inputs(predictor, video_dir):
+    state = predictor.init_state(video_path=video_dir, frame_paths=None)
+    with pytest.raises(ValueError):
+        predictor.add_new_boxes(state, 0, [0, 1], BOXES[:1])
+    with pytest.raises(ValueError):
+        predictor.add_new_boxes(state, 0, [], [])
+
+
+def test_memory_kv_cache_matches_uncached(predictor, video_dir):
+    # the clip is longer than the memory window (`num_maskmem` frames), so the
+    # memories of the first tracked frames slide out of it and are evicted
+    assert NUM_FRAMES > predictor.num_maskmem + 1
+    outputs = {}
+    for cache_memory_kv in [False, True]:
+        state = predictor.init_state(
+            video_path=video_dir, frame_paths=None, cache_memory_kv=cache_memory_kv
+        )
+        predictor.add_new_boxes(state, 0, [0, 1], BOXES)
+        outputs[cache_memory_kv] = _propagate(predictor, state)
+
+    cache = state["memory_kv_cache"]
+    num_layers = len(predictor.memory_attention.layers)
+    # one entry per layer for each memory frame in the current window
+    assert 0 < len(cache._feat_entries) <= num_layers * predictor.num_maskmem
+    window = _last_memory_frames(predictor, state)
+    window_ids = {id(out["maskmem_features"]) for out in window}
+    assert {feat_key[1] for feat_key in cache._feat_entries} <= window_ids
+    _assert_close_videos(outputs[True], outputs[False], atol=1e-3)
+
+
+def _last_memory_frames(predictor, inference_state):
+    """The outputs of the memory frames of the frame after the last tracked one."""
+    output_dict = inference_state["output_dict"]
+    outs = list(output_dict["cond_frame_outputs"].values())
+    for t in range(NUM_FRAMES - predictor.num_maskmem, NUM_FRAMES):
+        if t in output_dict["non_cond_frame_outputs"]:
+            outs.append(output_dict["non_cond_frame_outputs"][t])
+    return outs
+
+
+@pytest.mark.parametrize("num_cond_frames", [1, 2])
+def test_static_memory_shape_matches_dynamic(
+    predictor, video_dir, num_cond_frames, monkeypatch
+):
+    # (with 2 conditioning frames, there are more than `num_static_cond_slots`, so
+    # the frames after the second one fall back to the dynamic shape)
+    outputs = {}
+    for static_memory_shape in [False, True]:
+        monkeypatch.setattr(predictor, "static_memory_shape", static_memory_shape)
+        state = predictor.init_state(video_path=video_dir, frame_paths=None)
+        predictor.add_new_boxes(state, 0, [0, 1], BOXES)
+        if num_cond_frames == 2:
+            predictor.add_new_boxes(state, 5, [0, 1], BOXES)
+        outputs[static_memory_shape] = _propagate(predictor, state)
+    _assert_close_videos(outputs[True], outputs[False], atol=1e-2)
+
+
+def test_compile_with_cloned_outputs(monkeypatch):
+    from sam2.modeling import sam2_base
+
+    def fake_compile(forward, **kwargs):
+        # like CUDA graphs, the compiled function returns static output buffers that
+        # are overwritten by the next call
+        buffer = torch.zeros(3)
+
+        def compiled_forward(*args, **kwargs):
+            out = forward(*args, **kwargs)
+            buffer.copy_(out["out"])
+            return {**out, "out": buffer}
+
+        return compiled_forward
+
+    def forward(x, scale=1.0):
+        return {"out": x * scale, "list": [x + 1], "num": 3}
+
+    monkeypatch.setattr(torch, "compile", fake_compile)
+    compiled = sam2_base._compile_with_cloned_outputs(forward, mode="max-autotune")
+    assert compiled.__wrapped__ is forward
+    first = compiled(torch.ones(3), scale=2.0)
+    second = compiled(torch.full((3,), 5.0))
+    assert torch.equal(first["out"], torch.full((3,), 2.0))
+    assert torch.equal(first["list"][0], torch.full((3,), 2.0))
+    assert torch.equal(second["out"], torch.full((3,), 5.0))
+    assert first["num"] == second["num"] == 3
+
+
+def test_compile_track_step_wraps_the_tracking_modules():
+    model = build_sam2_video_predictor(
+        "sam2_hiera_t.yaml",
+        device="cpu",
+        hydra_overrides_extra=[
+            "++model.image_size=256",
+            "++model.compile_track_step=true",
+        ],
+    )
+    assert model.static_memory_shape
+    modules = [model.memory_attention, model.sam_mask_decoder, model.memory_encoder]
+    for module in modules:
+        # the compiled forward (run lazily on the first call) clones its outputs
+        assert module.forward.__wrapped__ == type(module).forward.__get__(module)
@@ -0,0 +1,134 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import json
+import os
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+
+from memory_quantization_benchmark import mean_iou
+
+# the default checkpoints and prompts are found relative to the repo, not the cwd
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_prompts(points_json):
+    """
+    Load the first-frame clicks from a prompt file in the `DataPoints` format, where
+    the label of each (positive) click is the id of the object it selects.
+    """
+    with open(points_json, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    per_obj_points = defaultdict(list)
+    for point, obj_id in zip(data["points"][0], data["labels"][0]):
+        per_obj_points[int(obj_id)].append(point)
+    return {
+        obj_id: np.array(points, dtype=np.float32)
+        for obj_id, points in per_obj_points.items()
+    }
+
+
+@torch.inference_mode()
+def run_session(predictor, video_dir, per_obj_points):
+    """Track the clicked objects through the video and return the masks and fps."""
+    inference_state = predictor.init_state(video_path=video_dir, frame_paths=None)
+    for obj_id, points in per_obj_points.items():
+        predictor.add_new_points_or_box(
+            inference_state=inference_state,
+            frame_idx=0,
+            obj_id=obj_id,
+            points=points,
+            labels=np.ones(len(points), dtype=np.int32),
+        )
+    start_time = time.perf_counter()
+    video_segments = {}
+    for out_frame_idx, _, out_mask_logits in predictor.propagate_in_video(
+        inference_state
+    ):
+        video_segments[out_frame_idx] = (out_mask_logits[:, 0] > 0.0).cpu().numpy()
+    elapsed = time.perf_counter() - start_time
+    return video_segments, max(len(video_segments), 1) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="accuracy and speed of the int8 CPU inference profile vs fp32"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="sam2_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default=os.path.join(REPO_ROOT, "checkpoints", "sam2_hiera_base_plus.pt"),
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--quantized_checkpoint",
+        type=str,
+        default=os.path.join(
+            REPO_ROOT, "checkpoints", "sam2_hiera_base_plus_cpu_int8.pt"
+        ),
+        help="where the int8 quantized weights are saved (or loaded from if present)",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory containing the sample clip (as JPEG files)",
+    )
+    parser.add_argument(
+        "--points_json",
+        type=str,
+        default=os.path.join(REPO_ROOT, "DataPoints", "points_labels_video3.json"),
+        help="first-frame clicks of the objects to track (DataPoints format)",
+    )
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="number of CPU threads for PyTorch (default: PyTorch's choice)",
+    )
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    per_obj_points = load_prompts(args.points_json)
+
+    results = {}
+    for cpu_int8 in [False, True]:
+        start_time = time.perf_counter()
+        predictor = build_sam2_video_predictor(
+            config_file=args.sam2_cfg,
+            ckpt_path=args.sam2_checkpoint,
+            device="cpu",
+            cpu_int8=cpu_int8,
+            quantized_ckpt_path=args.quantized_checkpoint if cpu_int8 else None,
+        )
+        build_time = time.perf_counter() - start_time
+        video_segments, fps = run_session(predictor, args.video_dir, per_obj_points)
+        results["int8" if cpu_int8 else "fp32"] = (video_segments, fps, build_time)
+        del predictor
+
+    ref_video_segments = results["fp32"][0]
+    print(f"{'model':>6} | {'build s':>8} | {'fps':>6} | {'mIoU vs fp32':>12}")
+    for name, (video_segments, fps, build_time) in results.items():
+        print(
+            f"{name:>6} | {build_time:8.1f} | {fps:6.2f} | "
+            f"{mean_iou(video_segments, ref_video_segments):12.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
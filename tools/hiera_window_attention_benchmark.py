@@ -0,0 +1,99 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import time
+
+import torch
+from sam2.modeling.backbones.hieradet import MultiScaleBlock
+
+
+def time_block(block, x, num_warmup, num_iters):
+    """Average forward time (in ms) of a block on input x."""
+    for _ in range(num_warmup):
+        block(x)
+    start_time = time.perf_counter()
+    for _ in range(num_iters):
+        block(x)
+    return (time.perf_counter() - start_time) / num_iters * 1000
+
+
+@torch.inference_mode()
+def benchmark_stage(dim, num_heads, window_size, feat_size, args):
+    """Compare the windowed attention paths on a (non-pooling) block of a stage."""
+    ref_block = MultiScaleBlock(
+        dim, dim, num_heads, window_size=window_size, fast_window_attn=False
+    )
+    fast_block = MultiScaleBlock(
+        dim, dim, num_heads, window_size=window_size, fast_window_attn=True
+    )
+    fast_block.load_state_dict(ref_block.state_dict())
+    ref_block.eval()
+    fast_block.eval()
+
+    x = torch.randn(args.batch_size, feat_size, feat_size, dim)
+    max_diff = (ref_block(x) - fast_block(x)).abs().max().item()
+    ref_ms = time_block(ref_block, x, args.num_warmup, args.num_iters)
+    fast_ms = time_block(fast_block, x, args.num_warmup, args.num_iters)
+    return ref_ms, fast_ms, max_diff
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="CPU time of the windowed attention blocks in each Hiera stage"
+    )
+    parser.add_argument(
+        "--embed_dim", type=int, default=112, help="Hiera initial embed dim"
+    )
+    parser.add_argument(
+        "--num_heads", type=int, default=2, help="Hiera initial number of heads"
+    )
+    parser.add_argument(
+        "--window_spec",
+        type=int,
+        nargs="+",
+        default=[8, 4, 14, 7],
+        help="window size per stage",
+    )
+    parser.add_argument(
+        "--image_size", type=int, default=1024, help="input image resolution"
+    )
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--num_warmup", type=int, default=3)
+    parser.add_argument("--num_iters", type=int, default=10)
+    parser.add_argument(
+        "--num_threads",
+        type=int,
+        default=None,
+        help="number of CPU threads for PyTorch (default: PyTorch's choice)",
+    )
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    print(
+        f"{'stage':>5} | {'tokens':>9} | {'window':>6} | {'current ms':>10} | "
+        f"{'strided ms':>10} | {'speedup':>7} | {'max diff':>8}"
+    )
+    # the patch embedding has stride 4, and each stage halves the resolution
+    feat_size = args.image_size // 4
+    dim, num_heads = args.embed_dim, args.num_heads
+    for stage, window_size in enumerate(args.window_spec, start=1):
+        ref_ms, fast_ms, max_diff = benchmark_stage(
+            dim, num_heads, window_size, feat_size, args
+        )
+        print(
+            f"{stage:>5} | {f'{feat_size}x{feat_size}':>9} | {window_size:>6} | "
+            f"{ref_ms:10.2f} | {fast_ms:10.2f} | {ref_ms / fast_ms:7.2f} | "
+            f"{max_diff:8.1e}"
+        )
+        feat_size //= 2
+        dim, num_heads = dim * 2, num_heads * 2
+
+
+if __name__ == "__main__":
+    main()
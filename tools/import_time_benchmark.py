@@ -0,0 +1,118 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (module, directory it is imported from, import-time budget in ms, modules that it
+# must not load at import time as they are only needed by some of its features)
+TARGETS = [
+    ("sam2.build_sam", ".", 3000, []),
+    ("sam2.modeling.sam.transformer", ".", 3000, []),
+    ("sam3.utils.pipeline", ".", 1000, ["torch", "sam2", "GPUtil", "pygetwindow"]),
+    ("sav_evaluator", "sav_dataset", 300, ["cv2", "skimage", "utils.sav_benchmark"]),
+    ("vos_inference", "tools", 4000, []),
+    ("DatasetCreatere", "DatasetManager/YolovDatasetManager", 3000, ["torchvision"]),
+]
+
+# run in a fresh interpreter: import the module and report which of the given modules
+# got loaded and whether CUDA was initialized (e.g. by querying the devices)
+CHECK_SCRIPT = """
+import importlib, json, sys
+importlib.import_module(sys.argv[1])
+torch = sys.modules.get("torch")
+print(json.dumps({
+    "loaded": [name for name in sys.argv[2:] if name in sys.modules],
+    "cuda_initialized": torch is not None and torch.cuda.is_initialized(),
+}))
+"""
+
+
+def get_import_time_ms(module, cwd):
+    """Cumulative import time (in ms) of a module in a fresh interpreter."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"failed to import {module}:\n{proc.stderr}")
+    # lines are "import time: self [us] | cumulative | imported package", and the
+    # requested module is the last top-level entry
+    for line in reversed(proc.stderr.splitlines()):
+        fields = line.split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError(f"no import time reported for {module}")
+
+
+def check_import_side_effects(module, cwd, forbidden):
+    proc = subprocess.run(
+        [sys.executable, "-c", CHECK_SCRIPT, module, *forbidden],
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"failed to import {module}:\n{proc.stderr}")
+    return json.loads(proc.stdout.splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="import-time regression check of the sam2/sam3 entry points"
+    )
+    parser.add_argument(
+        "--num_runs",
+        type=int,
+        default=3,
+        help="number of fresh-interpreter imports per module (the median is reported)",
+    )
+    parser.add_argument(
+        "--budget_scale",
+        type=float,
+        default=1.0,
+        help="factor applied to all the import-time budgets (e.g. for slower machines)",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'module':>30} | {'ms':>7} | {'budget':>7} | issues")
+    for module, rel_dir, budget_ms, forbidden in TARGETS:
+        cwd = os.path.join(REPO_ROOT, rel_dir)
+        try:
+            times = [get_import_time_ms(module, cwd) for _ in range(args.num_runs)]
+            side_effects = check_import_side_effects(module, cwd, forbidden)
+        except RuntimeError as e:
+            # e.g. an optional dependency of this entry point isn't installed
+            reason = str(e).splitlines()[-1]
+            print(f"{module:>30} | {'-':>7} | {'-':>7} | skipped ({reason})")
+            continue
+        median_ms = sorted(times)[len(times) // 2]
+        budget_ms = budget_ms * args.budget_scale
+        issues = []
+        if median_ms > budget_ms:
+            issues.append("over budget")
+        if side_effects["loaded"]:
+            issues.append(f"loads {', '.join(side_effects['loaded'])}")
+        if side_effects["cuda_initialized"]:
+            issues.append("initializes CUDA")
+        failed = failed or len(issues) > 0
+        print(
+            f"{module:>30} | {median_ms:7.0f} | {budget_ms:7.0f} | "
+            f"{'; '.join(issues) or 'ok'}"
+        )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import argparse
+import os
+import time
+
+import numpy as np
+import torch
+from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.misc import QuantizedTensor
+
+from vos_inference import get_per_obj_mask, load_ann_png
+
+# the default checkpoint is found relative to the repo, not the cwd
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_state_nbytes(inference_state):
+    """Count the bytes held by the memory features and mask logits in `output_dict`."""
+    nbytes = 0
+    output_dict = inference_state["output_dict"]
+    for storage_key in ["cond_frame_outputs", "non_cond_frame_outputs"]:
+        for out in output_dict[storage_key].values():
+            for key in ["maskmem_features", "pred_masks"]:
+                x = out[key]
+                if isinstance(x, QuantizedTensor):
+                    nbytes += x.nbytes()
+                elif x is not None:
+                    nbytes += x.numel() * x.element_size()
+    return nbytes
+
+
+@torch.inference_mode()
+def run_session(predictor, video_dir, per_obj_input_mask, offload_state_to_cpu, mode):
+    """Track the input masks through the video and return the output masks and stats."""
+    inference_state = predictor.init_state(
+        video_path=video_dir,
+        frame_paths=None,
+        offload_state_to_cpu=offload_state_to_cpu,
+        memory_quantization=mode,
+    )
+    for object_id, object_mask in per_obj_input_mask.items():
+        predictor.add_new_mask(
+            inference_state=inference_state,
+            frame_idx=0,
+            obj_id=object_id,
+            mask=object_mask,
+        )
+    if inference_state["device"].type == "cuda":
+        torch.cuda.synchronize()
+    start_time = time.perf_counter()
+    video_segments = {}
+    for out_frame_idx, _, out_masks in predictor.propagate_in_video(
+        inference_state, async_mask_output=True
+    ):
+        video_segments[out_frame_idx] = out_masks
+    elapsed = time.perf_counter() - start_time
+    num_frames = max(len(video_segments), 1)
+    return video_segments, get_state_nbytes(inference_state), num_frames / elapsed
+
+
+def mean_iou(video_segments, ref_video_segments):
+    """Mean IoU over all frames and objects against the reference masks."""
+    ious = []
+    for frame_idx, ref_masks in ref_video_segments.items():
+        masks = video_segments[frame_idx]
+        inter = np.logical_and(masks, ref_masks).reshape(len(masks), -1).sum(-1)
+        union = np.logical_or(masks, ref_masks).reshape(len(masks), -1).sum(-1)
+        # two empty masks are a perfect match
+        ious.append(np.where(union > 0, inter / np.maximum(union, 1), 1.0))
+    return float(np.mean(np.concatenate(ious)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="accuracy and memory of quantized memory features in video tracking"
+    )
+    parser.add_argument(
+        "--sam2_cfg",
+        type=str,
+        default="sam2_hiera_b+.yaml",
+        help="SAM 2 model configuration file",
+    )
+    parser.add_argument(
+        "--sam2_checkpoint",
+        type=str,
+        default=os.path.join(REPO_ROOT, "checkpoints", "sam2_hiera_base_plus.pt"),
+        help="path to the SAM 2 model checkpoint",
+    )
+    parser.add_argument(
+        "--video_dir",
+        type=str,
+        required=True,
+        help="directory containing the sample video (as JPEG files)",
+    )
+    parser.add_argument(
+        "--input_mask",
+        type=str,
+        required=True,
+        help="PNG file with the object masks on the first frame (DAVIS format)",
+    )
+    parser.add_argument(
+        "--offload_state_to_cpu",
+        action="store_true",
+        help="whether to offload the inference state to CPU memory",
+    )
+    args = parser.parse_args()
+
+    predictor = build_sam2_video_predictor(
+        config_file=args.sam2_cfg, ckpt_path=args.sam2_checkpoint
+    )
+    input_mask, _ = load_ann_png(args.input_mask)
+    per_obj_input_mask = get_per_obj_mask(input_mask)
+
+    results = {}
+    for mode in [None, "int8", "fp8"]:
+        if mode == "fp8" and not hasattr(torch, "float8_e4m3fn"):
+            print("skipping fp8 (requires PyTorch 2.1 or newer)")
+            continue
+        results[mode] = run_session(
+            predictor,
+            args.video_dir,
+            per_obj_input_mask,
+            args.offload_state_to_cpu,
+            mode,
+        )
+
+    ref_video_segments, ref_nbytes, _ = results[None]
+    print(f"{'storage':>8} | {'state MB':>9} | {'ratio':>6} | {'fps':>6} | {'mIoU vs bf16':>12}")
+    for mode, (video_segments, nbytes, fps) in results.items():
+        print(
+            f"{mode or 'bf16':>8} | {nbytes / 2**20:9.1f} | {ref_nbytes / nbytes:6.2f} | "
+            f"{fps:6.1f} | {mean_iou(video_segments, ref_video_segments):12.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
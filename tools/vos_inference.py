@@ -178,11 +178,11 @@ def vos_inference(
     os.makedirs(os.path.join(output_mask_dir, video_name), exist_ok=True)
     output_palette = input_palette or DAVIS_PALETTE
     video_segments = {}  # video_segments contains the per-frame segmentation results
-    for out_frame_idx, out_obj_ids, out_mask_logits in predictor.propagate_in_video(
-        inference_state
+    for out_frame_idx, out_obj_ids, out_masks in predictor.propagate_in_video(
+        inference_state, async_mask_output=True, score_thresh=score_thresh
     ):
         per_obj_output_mask = {
-            out_obj_id: (out_mask_logits[i] > score_thresh).cpu().numpy()
+            out_obj_id: out_masks[i]
             for i, out_obj_id in enumerate(out_obj_ids)
         }
         video_segments[out_frame_idx] = per_obj_output_mask